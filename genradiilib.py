@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import numpy
 import argparse
+import re
 '''
 Generate a radii.lib file, based on an Amber topology (*.parm7) file, for use
 in volume calculations.
@@ -16,6 +17,66 @@ How to use:
   file path to the parm7 file.
 '''
 
+# sections of the topology that are needed, and the type of their values
+SECTIONS = {'ATOM_TYPE_INDEX': int,
+            'NONBONDED_PARM_INDEX': int,
+            'LENNARD_JONES_ACOEF': float,
+            'LENNARD_JONES_BCOEF': float,
+            'RESIDUE_LABEL': str,
+            'ATOM_NAME': str,
+            'RESIDUE_POINTER': int}
+
+def _parse_section(lines, width, dtype):
+    '''
+    Array of the fixed-width (``width`` characters) fields of the lines of a
+    section. Every line but the last is full, so the lines are joined and cut
+    into fields all at once.
+    '''
+    text = ''.join(line.rstrip('\r\n') for line in lines)
+    if not text.strip():
+        return numpy.array([], dtype=dtype)
+    # a short last field
+    text = text.ljust(-(-len(text)//width)*width)
+    fields = numpy.frombuffer(text.encode('ascii'), dtype='S{:d}'.format(width))
+    if dtype is str:
+        return fields.astype('U{:d}'.format(width))
+    return fields.astype(dtype)
+
+def read_parm7(parmpath, sections=SECTIONS):
+    '''
+    Read the sections named in ``sections`` (a dict of flag: type of values)
+    of an Amber topology file into numpy arrays. The file is read one line at
+    a time, and the lines of other sections are not stored.
+
+    -------------
+    Returns
+    -------------
+    dict of flag: array of values
+    '''
+    arrays = {}
+    flag = None
+    lines = []
+    with open(parmpath, 'r') as parmfile:
+        for line in parmfile:
+            if line.startswith('%FLAG'):
+                if flag is not None:
+                    arrays[flag] = _parse_section(lines, width, sections[flag])
+                flag = line[5:].strip()
+                if flag not in sections:
+                    flag = None
+                lines = []
+            elif line.startswith('%FORMAT'):
+                # e.g. %FORMAT(10I8); the number of fields per line, their
+                # type and their width
+                width = int(re.match(r'%FORMAT\((\d+)([a-zA-Z])(\d+)', line).group(3))
+            elif line.startswith('%'):
+                continue
+            elif flag is not None:
+                lines.append(line)
+        if flag is not None:
+            arrays[flag] = _parse_section(lines, width, sections[flag])
+    return arrays
+
 class RadiiLibGen(object):
     def __init__(self, parmpath, output='radii.lib'):
         '''
@@ -28,87 +89,34 @@ class RadiiLibGen(object):
         self.build_map()
         self.print_radii_lib()
 
-    def _load_atom_name(self):
-        arr = []
-        found_next_section = False
-
-        # skip over the format line
-        self.lineidx += 2
-        line = self.lines[self.lineidx]
-
-        linecount = 0
-        while not found_next_section:
-            linecount += 1
-            split = [line[i:i+4] for i in range(0, len(line)-1, 4)]
-            arr += split
-            self.lineidx += 1
-            line = self.lines[self.lineidx]
-            if line.startswith('%'):
-                found_next_section = True 
-
-        return numpy.array(arr)
-
-
-    def _load_until_next_section(self, dtype=None):
-        arr = []
-        found_next_section = False
-
-        # skip over the format line
-        self.lineidx += 2
-        line = self.lines[self.lineidx]
-        while not found_next_section:
-            split = line.split()
-            arr += split
-            self.lineidx += 1
-            line = self.lines[self.lineidx]
-            if line.startswith('%'):
-                found_next_section = True 
-
-        if dtype is not None:
-            return numpy.array(arr, dtype=dtype)
-        else:
-            return numpy.array(arr)
-            
     def _load(self):
-        parmfile = open(self.parmpath, 'r')
-        self.lines = parmfile.readlines()
-        parmfile.close()
-        self.lineidx = 0
-        while self.lineidx < len(self.lines):
-            line = self.lines[self.lineidx]
-            if line.startswith('%FLAG ATOM_TYPE_INDEX'):
-                self.atom_type_index = self._load_until_next_section(dtype=int)
-            elif line.startswith('%FLAG NONBONDED_PARM_INDEX'):
-                self.nonbonded_parm_index = self._load_until_next_section(dtype=int)
-            elif line.startswith('%FLAG LENNARD_JONES_ACOEF'):
-                self.acoef = self._load_until_next_section(dtype=float)
-            elif line.startswith('%FLAG LENNARD_JONES_BCOEF'):
-                self.bcoef = self._load_until_next_section(dtype=float)
-            elif line.startswith('%FLAG RESIDUE_LABEL'):
-                self.residue_label = self._load_until_next_section()
-            elif line.startswith('%FLAG ATOM_NAME'):
-                self.atom_name = self._load_atom_name()
-            elif line.startswith('%FLAG RESIDUE_POINTER'):
-                self.residue_pointer = self._load_until_next_section(dtype=int)
-            else: self.lineidx += 1
+        arrays = read_parm7(self.parmpath)
+        self.atom_type_index = arrays['ATOM_TYPE_INDEX']
+        self.nonbonded_parm_index = arrays['NONBONDED_PARM_INDEX']
+        self.acoef = arrays['LENNARD_JONES_ACOEF']
+        self.bcoef = arrays['LENNARD_JONES_BCOEF']
+        self.residue_label = numpy.char.strip(arrays['RESIDUE_LABEL'])
+        self.atom_name = arrays['ATOM_NAME']
+        self.residue_pointer = arrays['RESIDUE_POINTER']
         self.ntypes = int(numpy.sqrt(self.nonbonded_parm_index.shape[0]))
+        # radius of every atom type, looked up by get_van_der_waals_radius and
+        # build_map
+        self.vdw_radii = self.get_van_der_waals_radii()
 
-
+    def get_residue_index(self, iatom):
+        '''
+        iatom: (int or array) the index of atom, from 0
+        '''
+        # RESIDUE_POINTER holds the number (from 1) of the first atom of each
+        # residue
+        return numpy.searchsorted(self.residue_pointer, numpy.asarray(iatom) + 1,
+                                  side='right') - 1
 
     def get_residue_label(self,iatom):
         '''
         iatom: (int) the index of atom
         '''
-        residx = 0
-
-        if iatom < self.residue_pointer[-1]:
-            for residx, respointer in enumerate(self.residue_pointer):
-                if iatom < self.residue_pointer[residx+1]:
-                    break
-        else:
-            residx = self.residue_pointer.shape[0]-1
-
-        return self.residue_label[residx]
+        return self.residue_label[self.get_residue_index(iatom)]
 
     def get_atom_name(self, iatom):
         '''
@@ -122,18 +130,26 @@ class RadiiLibGen(object):
         return self.nonbonded_parm_index[self.ntypes*(atomtypeindex1-1)+atomtypeindex2-1]
 
 
+    def get_van_der_waals_radii(self):
+        '''
+        The van der Waals radius of every atom type; radius i-1 is that of atom
+        type index i.
+        '''
+        types = numpy.arange(1, self.ntypes+1)
+        nonbonded_parm_index = self.get_nonbonded_parm_index(types, types)
+        valid = nonbonded_parm_index > 0
+        # index 0 for the atom types without parameters; their radius is 0
+        coef_index = numpy.where(valid, nonbonded_parm_index-1, 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            r = (2*self.acoef[coef_index]/self.bcoef[coef_index])**(1./6)/2
+        r[~valid] = 0
+        return r
+
     def get_van_der_waals_radius(self, atomtypeindex):
         '''
          
         '''
-        nonbonded_parm_index = self.get_nonbonded_parm_index(atomtypeindex,
-                                                             atomtypeindex)
-        if nonbonded_parm_index > 0:
-            acoef = self.acoef[nonbonded_parm_index-1]
-            bcoef = self.bcoef[nonbonded_parm_index-1]
-            r = (2*acoef/bcoef)**(1./6)/2
-        else:
-            r = 0
+        r = self.vdw_radii[atomtypeindex-1]
         if numpy.isnan(r):
             if not atomtypeindex in self.atomswithnanradii:
                 print("Radius is zero for atom type index: {:d}".format(atomtypeindex) )
@@ -148,13 +164,25 @@ class RadiiLibGen(object):
         '''
         print("length of ATOM_NAME: {:d}".format(self.atom_name.shape[0]))
         print("length of ATOM_TYPE_INDEX: {:d}".format(self.atom_type_index.shape[0]))
-        self.map = dict()
-        # iterate over every atom
-        for iatom, atomtypeindex in enumerate(self.atom_type_index):
-            reslabel = self.get_residue_label(iatom)
-            atomname = self.get_atom_name(iatom)
-            vdw_r = self.get_van_der_waals_radius(atomtypeindex)
-            self.map[(reslabel, atomname)] = vdw_r
+        natoms = self.atom_type_index.shape[0]
+        reslabel = self.residue_label[self.get_residue_index(numpy.arange(natoms))]
+        radii = self.vdw_radii.copy()
+        for atomtypeindex in numpy.unique(self.atom_type_index):
+            if numpy.isnan(radii[atomtypeindex-1]):
+                print("Radius is zero for atom type index: {:d}".format(atomtypeindex) )
+                self.atomswithnanradii.add(atomtypeindex)
+        radii[numpy.isnan(radii)] = 0
+        vdw_r = radii[self.atom_type_index-1]
+
+        # the last atom with a (residue_label, atom_name) sets its radius
+        names = numpy.zeros(natoms, dtype=[('reslabel', reslabel.dtype),
+                                           ('atomname', self.atom_name.dtype)])
+        names['reslabel'] = reslabel
+        names['atomname'] = self.atom_name[:natoms]
+        unique_names, last = numpy.unique(names[::-1], return_index=True)
+        self.map = dict(zip(zip(unique_names['reslabel'].tolist(),
+                                unique_names['atomname'].tolist()),
+                            vdw_r[::-1][last].tolist()))
 
     def print_radii_lib(self):
         outfile = open(self.outpath,'w+')
@@ -0,0 +1,66 @@
+#ifndef BATCH_H
+#define BATCH_H
+
+#include "bitgrid.h"
+#include <math.h>
+
+// Relative margin around the squared cutoff within which a squared distance
+// is compared with a square root instead; far larger than the rounding errors
+// of sqrt and of the squared cutoff.
+#define BAND 1e-10
+
+// Solute atoms as a structure of arrays, with the squared cutoffs of the
+// batched distance checks precomputed. Atom i blocks the voxels closer than
+// cut[i] = solute_rad[i] + solvent_rad to (x[i], y[i], z[i]). A squared
+// distance below lo2[i] is certainly closer than that, one at or above hi2[i]
+// certainly not; those in between are decided with a square root, as in
+// is_free. With ``single``, xf ... cut2f hold the same in single precision,
+// and lo2, hi2 are not used.
+struct Atoms
+{
+    int n;
+    int single;
+    double* x;
+    double* y;
+    double* z;
+    double* cut;
+    double* lo2;
+    double* hi2;
+    float* xf;
+    float* yf;
+    float* zf;
+    float* cut2f;
+};
+
+struct Atoms* newAtoms(double* solute_pos, double* solute_rad, int nsolute,
+                       double solvent_rad, int single);
+void delAtoms(struct Atoms* atoms);
+
+void rasterize_batch_slab(double voxel_len, struct BitGrid* blocked,
+                          struct Atoms* atoms, int xstart, int xstop,
+                          long* nchecked);
+
+void rasterize_batch(double voxel_len, struct BitGrid* blocked,
+                     struct Atoms* atoms, int nthreads, long* nchecked);
+
+// Whether an atom at height solz above voxel iz of a row, and at squared
+// distance dxy2 from the row in the xy-plane, blocks the voxel; the same
+// test as in row_double of batch.c
+static inline int blocks(double voxel_len, int iz, double solz, double dxy2,
+                         double cut, double lo2, double hi2)
+{
+    double dz = solz - iz*voxel_len;
+    double s = dxy2 + dz*dz;
+    if (s < lo2){
+        return 1;
+    }
+    if (s >= hi2){
+        return 0;
+    }
+    return sqrt(s) < cut;
+}
+
+void blocked_run(double voxel_len, int nz, int ix, int iy, double* p,
+                 double cut, int* z0, int* z1);
+
+#endif
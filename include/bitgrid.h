@@ -0,0 +1,56 @@
+#ifndef BITGRID_H
+#define BITGRID_H
+
+#include <stdint.h>
+
+// (nx, ny, nz) grid of bits, stored as 64-bit words. Each row along z starts
+// on a new word, so that rows never share a word. ``capacity`` words are
+// allocated, which may be more than the grid uses after resizeBitGrid.
+struct BitGrid
+{
+    int nx, ny, nz;
+    long rowwords;
+    long capacity;
+    uint64_t* words;
+};
+
+struct BitGrid* newBitGrid(int nx, int ny, int nz);
+void delBitGrid(struct BitGrid* bitgrid);
+int resizeBitGrid(struct BitGrid* bitgrid, int nx, int ny, int nz);
+long countBits(struct BitGrid* bitgrid);
+unsigned long bitGridBytes(int nx, int ny, int nz);
+
+// pointer to the first word of row (x, y)
+static inline uint64_t* getrow(struct BitGrid* bitgrid, int x, int y)
+{
+    return bitgrid->words + ((long)x*bitgrid->ny + y)*bitgrid->rowwords;
+}
+
+static inline int getbit(struct BitGrid* bitgrid, int x, int y, int z)
+{
+    return (getrow(bitgrid, x, y)[z >> 6] >> (z & 63)) & 1;
+}
+
+static inline void setbit(struct BitGrid* bitgrid, int x, int y, int z)
+{
+    getrow(bitgrid, x, y)[z >> 6] |= (uint64_t)1 << (z & 63);
+}
+
+// Set bits z0 ... z1 of ``row``
+static inline void setrun(uint64_t* row, int z0, int z1)
+{
+    int w;
+    uint64_t mask;
+    for (w=z0 >> 6; w<=(z1 >> 6); w++){
+        mask = ~(uint64_t)0;
+        if (w == (z0 >> 6)){
+            mask &= ~(uint64_t)0 << (z0 & 63);
+        }
+        if (w == (z1 >> 6)){
+            mask &= ~(uint64_t)0 >> (63 - (z1 & 63));
+        }
+        row[w] |= mask;
+    }
+}
+
+#endif
@@ -0,0 +1,23 @@
+#ifndef CELLLIST_H
+#define CELLLIST_H
+
+// uniform grid of cells ("buckets") over the solute atoms; atoms are stored
+// sorted by cell, so that the atoms of cell c are pos[start[c]...start[c+1]-1]
+struct CellList
+{
+    double origin[3];
+    double cell_len;
+    int ncx, ncy, ncz;
+    int* start;
+    double* pos;
+    double* rad;
+};
+
+struct CellList* newCellList(double* solute_pos, double* solute_rad,
+                             int nsolute, double solvent_rad);
+void delCellList(struct CellList* cells);
+unsigned char is_free_cells(double voxx, double voxy, double voxz,
+                            struct CellList* cells, double solvent_rad,
+                            long* nchecked);
+
+#endif
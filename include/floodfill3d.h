@@ -2,16 +2,39 @@
 #define FLOODFILL3D_H
 
 #include <math.h>
+#include "celllist.h"
+#include "bitgrid.h"
+#include "queue.h"
+#include "stats.h"
 
 double dist(double x1, double y1, double z1, double x2, double y2, double z2);
 
 unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
-                      double* solute_rad, int nsolute, double solvent_rad);
+                      double* solute_rad, int nsolute, double solvent_rad,
+                      long* nchecked);
 
-void floodfill(int ix, int iy, int iz, int nx, int ny, int nz, double voxel_len,
-               unsigned char* visited_grid, unsigned char* grid, int* moves,
-               double* solute_pos, double* solute_rad, int nsolute, 
-               double solvent_rad);
+void rasterize(double voxel_len, struct BitGrid* blocked, double* solute_pos,
+               double* solute_rad, int nsolute, double solvent_rad,
+               long* nchecked);
+
+void rasterize_slab(double voxel_len, struct BitGrid* blocked,
+                    double* solute_pos, double* solute_rad, int nsolute,
+                    double solvent_rad, int xstart, int xstop,
+                    long* nchecked);
+
+int floodfill(int ix, int iy, int iz, double voxel_len,
+              struct BitGrid* visited_grid, struct BitGrid* grid,
+              double* solute_pos, double* solute_rad, int nsolute, 
+              double solvent_rad, struct CellList* cells,
+              struct BitGrid* blocked, struct Queue* queue,
+              struct FillStats* stats);
+
+int floodfill_multi(int* seeds, int nseeds, double voxel_len,
+                    struct BitGrid* visited_grid, struct BitGrid* grid,
+                    double* solute_pos, double* solute_rad, int nsolute,
+                    double solvent_rad, struct CellList* cells,
+                    struct BitGrid* blocked, struct Queue* queue,
+                    struct FillStats* stats);
 
 #endif
 
@@ -0,0 +1,49 @@
+#ifndef INCREMENTAL_H
+#define INCREMENTAL_H
+
+#include "bitgrid.h"
+#include "queue.h"
+
+// The grid is split into bricks of BRICK_LEN^3 voxels to keep track of where
+// the voxels changed; a brick's part of a row is one byte of its words
+#define BRICK_LEN 8
+
+// State of a volume calculation that is updated from one set of solute
+// positions (a frame) to the next, on a grid that stays the same.
+struct Incremental
+{
+    int nx, ny, nz;
+    double voxel_len;
+    int nsolute;
+    double solvent_rad;
+    double* pos;             // positions of the last frame, on the grid
+    double* rad;             // radii of the solute atoms
+    unsigned short* counts;  // number of atoms that block each voxel
+    int saturated;           // a count went over USHRT_MAX; counts unused
+    struct BitGrid* blocked; // voxels blocked by at least one atom
+    struct BitGrid* grid;    // voxels reached from voxel (0, 0, 0)
+    struct BitGrid* mark;    // scratch; all zero between calls
+    int nbx, nby, nbz;
+    int* bricks;             // per brick: 0 if unchanged, else a label
+    int* brick_stack;
+    int* halo;               // per brick: label of the bricks it is next to
+    int* halo_stack;
+    unsigned char* saved;    // scratch; bytes of rows of the halo bricks
+    long* stack;             // scratch list of voxels
+    long stack_capacity;
+    int* seeds;
+    long seed_capacity;
+    struct Queue* queue;
+    long changed;            // voxels whose count went to or from 0
+    long dirty_bricks;       // bricks with such voxels
+};
+
+struct Incremental* newIncremental(int nx, int ny, int nz, double voxel_len,
+                                   double* solute_rad, int nsolute,
+                                   double solvent_rad);
+void delIncremental(struct Incremental* inc);
+int incremental_full(struct Incremental* inc, double* solute_pos);
+int incremental_update(struct Incremental* inc, double* solute_pos,
+                       double max_dirty);
+
+#endif
@@ -0,0 +1,32 @@
+#ifndef LABEL_H
+#define LABEL_H
+
+#include "celllist.h"
+#include "bitgrid.h"
+#include "stats.h"
+
+// Runs of accessible voxels along the z-axis. The runs of row (x, y) are
+// run[rowstart[x*ny+y]] ... run[rowstart[x*ny+y+1]-1], in order of z. Runs in
+// the same tree of ``parent`` are connected.
+struct Runs
+{
+    long* rowstart;
+    unsigned short* z0;
+    unsigned short* z1;
+    long* parent;
+};
+
+long find_root(long* parent, long i);
+void merge_runs(long* parent, long i, long j);
+long row_runs(uint64_t* row, int nz, unsigned short* z0, unsigned short* z1);
+void merge_rows(struct Runs* runs, long a, long b);
+void merge_plane(struct Runs* runs, int x, int ny);
+long find_run(struct Runs* runs, int nx, int ny, int nz, int x, int y, int z);
+
+int floodfill_parallel(int* seeds, int nseeds, double voxel_len,
+                       struct BitGrid* grid, double* solute_pos,
+                       double* solute_rad, int nsolute, double solvent_rad,
+                       struct CellList* cells, struct BitGrid* blocked,
+                       int nthreads, struct FillStats* stats);
+
+#endif
@@ -0,0 +1,12 @@
+#ifndef PBC_H
+#define PBC_H
+
+#include "bitgrid.h"
+#include "stats.h"
+
+long floodfill_periodic(int* seeds, int nseeds, double* cell,
+                        double* solute_pos, double* solute_rad, int nsolute,
+                        double solvent_rad, struct BitGrid* blocked,
+                        struct BitGrid* grid, struct FillStats* stats);
+
+#endif
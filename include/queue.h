@@ -1,25 +1,25 @@
 #ifndef QUEUE_H
 #define QUEUE_H
 
-// encapsulate grid indices
-struct Triple
+// encapsulate a run of voxels (x, y, z0) ... (x, y, z1) along the z-axis
+struct Span
 {
-    unsigned short int x, y, z;
+    unsigned short int x, y, z0, z1;
 };
 
-// fifo data structure
+// fifo data structure; the capacity grows on demand
 struct Queue 
 {
     unsigned long front, rear, size;
     unsigned long capacity;
-    struct Triple* items;
+    struct Span* items;
 };
 
 struct Queue* newQueue(unsigned long capacity);
 void delQueue(struct Queue* queue);
 int isFull(struct Queue* queue);
 int isEmpty(struct Queue* queue);
-int append(struct Triple coords, struct Queue* queue);
-struct Triple pop(struct Queue* queue);
+int append(struct Span span, struct Queue* queue);
+struct Span pop(struct Queue* queue);
 
 #endif
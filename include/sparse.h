@@ -0,0 +1,15 @@
+#ifndef SPARSE_H
+#define SPARSE_H
+
+#include "stats.h"
+
+// edge length of a brick, in voxels
+#define BRICK 8
+
+long floodfill_sparse(int* seeds, int nseeds, int nx, int ny, int nz,
+                      double voxel_len, double* solute_pos, double* solute_rad,
+                      int nsolute, double solvent_rad,
+                      struct FillStats* stats);
+unsigned long sparseBytes(int nx, int ny, int nz);
+
+#endif
@@ -0,0 +1,17 @@
+#ifndef STATS_H
+#define STATS_H
+
+// Counters of a volume calculation. The routines that take a pointer to a
+// FillStats add to its counters, and skip the counting if it is NULL.
+struct FillStats
+{
+    long visited;         // times the fill looked at a voxel
+    long is_free_calls;   // voxels checked against the solute atoms
+    long distance_evals;  // solute atoms checked against a voxel (or a box)
+    long seeds;           // seed voxels given to the fill
+    long fills;           // seeds that started a new fill
+    long queue_max;       // most spans (or bricks) waiting to be filled at once
+    long bytes;           // bytes of scratch memory allocated by the fill
+};
+
+#endif
@@ -0,0 +1,13 @@
+#ifndef SWEEP_H
+#define SWEEP_H
+
+void probe_levels(double voxel_len, int nx, int ny, int nz,
+                  unsigned char* levels, double* solute_pos,
+                  double* solute_rad, int nsolute, double* probe_rad,
+                  int nprobe, int xstart, int xstop);
+
+int probe_sweep(double voxel_len, int nx, int ny, int nz, double* solute_pos,
+                double* solute_rad, int nsolute, double* probe_rad,
+                int nprobe, int nthreads, long* counts);
+
+#endif
@@ -0,0 +1,13 @@
+#ifndef TILE_H
+#define TILE_H
+
+#include "stats.h"
+
+long floodfill_tiled(int* seeds, int nseeds, int nx, int ny, int nz,
+                     double voxel_len, double* solute_pos, double* solute_rad,
+                     int nsolute, double solvent_rad, unsigned long budget,
+                     const char* scratch_dir, int nthreads,
+                     struct FillStats* stats);
+unsigned long tiledBytes(int nx, int ny, int nz);
+
+#endif
@@ -1,39 +1,167 @@
 #!/usr/bin/env python
 import argparse
+import csv
+import glob
+import json
+import multiprocessing
 import numpy
+import os
 import sys
+import tempfile
+import time
 sys.path.append('../')
 import volume
 
+# fields of the atoms of a PDBStructure
+ATOM_DTYPE = numpy.dtype([('atomname', 'U4'),
+                          ('resname', 'U3'),
+                          ('position', numpy.float64, (3,))])
+
+# bytes of a PDB file that are read at a time
+_CHUNK = 1 << 22
+
+def _records(buf):
+    '''
+    The ATOM records among the lines of ``buf``, a uint8 array of whole lines
+    (ending with a newline).
+
+    -------------
+    Returns
+    -------------
+    (chars, nbefore); shape (n,54) array of the first 54 characters (up to
+    the z coordinate) of the ATOM records, padded with zeros, and the number
+    of ATOM records before each ENDMDL record
+    '''
+    ends = numpy.flatnonzero(buf == ord('\n'))
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    # pad, so that the first 54 characters of every line can be gathered
+    padded = numpy.concatenate((buf, numpy.zeros(54, dtype=numpy.uint8)))
+    is_atom = numpy.ones(starts.shape[0], dtype=bool)
+    for i, c in enumerate(numpy.frombuffer(b'ATOM', dtype=numpy.uint8)):
+        is_atom &= padded[starts + i] == c
+    is_endmdl = numpy.ones(starts.shape[0], dtype=bool)
+    for i, c in enumerate(numpy.frombuffer(b'ENDMDL', dtype=numpy.uint8)):
+        is_endmdl &= padded[starts + i] == c
+
+    cols = numpy.arange(54)
+    chars = padded[starts[is_atom][:,numpy.newaxis] + cols]
+    chars[cols >= (ends - starts)[is_atom][:,numpy.newaxis]] = 0
+    nbefore = numpy.cumsum(is_atom)[is_endmdl]
+    return chars, nbefore
+
+def _parse_atoms(chars):
+    '''
+    Structured array (ATOM_DTYPE) of ATOM records, given as an array of the
+    characters of one record per row. The fields are cut out of all records
+    at once.
+    '''
+    atoms = numpy.zeros(chars.shape[0], dtype=ATOM_DTYPE)
+    if not chars.shape[0]:
+        return atoms
+    chars = chars.view('S1')
+    atoms['atomname'] = numpy.ascontiguousarray(chars[:,12:16]).view('S4')[:,0]
+    atoms['resname'] = numpy.ascontiguousarray(chars[:,17:20]).view('S3')[:,0]
+    # x, y and z are in columns 30:38, 38:46 and 46:54
+    atoms['position'] = numpy.ascontiguousarray(chars[:,30:54]).view('S8')\
+                             .astype(numpy.float64)
+    return atoms
+
 class PDBStructure(object):
     def __init__(self):
-        pass
+        self.atoms = numpy.zeros(0, dtype=ATOM_DTYPE)
 
     def from_file(self, pdbpath):
-        self.atoms = []
-        with open(pdbpath, 'r') as f:
-            for line in f:
-                if line.startswith('ATOM'):
-                    self.atoms.append({'atomname': line[12:16],
-                                       'resname': line[17:20],
-                                       'position': numpy.fromstring(line[32:54], 
-                                                           dtype=numpy.float64, 
-                                                           sep=' ')
-                                       }
-                                      )
+        '''
+        Read the ATOM records of the first model of a PDB file into
+        ``self.atoms``, a structured array with fields 'atomname', 'resname'
+        and 'position'.
+        '''
+        for atoms in self.models(pdbpath):
+            self.atoms = atoms
+            break
+        return self
 
-class PDBVolume(object):
-    def __init__(self, pdbpath, radiipath, explicitsolvent=False, solventname='WAT', solventrad=1.4, voxel_len=0.5):
-        self.use_explicit_solvent = explicitsolvent
-        self.solventname = solventname
-        self.solventrad = 1.4
-        self.voxel_len = voxel_len
-        self.radii = {}
-        self.loadradii(radiipath)
-        self.pdb = PDBStructure()
-        self.pdb.from_file(pdbpath)
+    @staticmethod
+    def models(pdbpath):
+        '''
+        Iterate over the models (MODEL ... ENDMDL blocks) of a PDB file, as
+        structured arrays of their ATOM records. The file is read in chunks,
+        and only the current model is held in memory. A file without MODEL
+        records is a single model.
+        '''
+        parts = []
+        rest = b''
+        with open(pdbpath, 'rb') as f:
+            while True:
+                block = f.read(_CHUNK)
+                if block:
+                    # only parse whole lines; keep the rest for the next chunk
+                    data = rest + block
+                    cut = data.rfind(b'\n') + 1
+                    data, rest = data[:cut], data[cut:]
+                else:
+                    data, rest = rest, b''
+                    if data:
+                        data += b'\n'
+                if data:
+                    chars, nbefore = _records(numpy.frombuffer(data,
+                                                               dtype=numpy.uint8))
+                    start = 0
+                    for end in nbefore:
+                        parts.append(chars[start:end])
+                        yield _parse_atoms(numpy.concatenate(parts))
+                        parts = []
+                        start = end
+                    parts.append(chars[start:])
+                if not block:
+                    break
+        # an empty file leaves no parts
+        if parts:
+            chars = numpy.concatenate(parts)
+            if chars.shape[0]:
+                yield _parse_atoms(chars)
 
-    def loadradii(self, radiipath):
+class RadiiLibrary(object):
+    '''
+    Radii of a radii library (radii.lib), as a sorted table of (residue, atom
+    name) keys and an array of radii, so that the radii of all atoms of a
+    structure are looked up at once.
+
+    The table is cached next to the library (radii.lib.npz), and rebuilt
+    when the modification time or size of the library changes.
+    '''
+    # fields of the keys of the table
+    KEY_DTYPE = numpy.dtype([('resname', 'U3'), ('atomname', 'U4')])
+
+    def __init__(self, keys, radii):
+        self.keys = keys
+        self.radii = radii
+
+    @classmethod
+    def load(cls, radiipath, cache=True):
+        '''
+        Read the radii library at ``radiipath``, from its cache if that is up
+        to date. With ``cache``, the cache is (re)written if needed.
+        '''
+        stat = os.stat(radiipath)
+        stamp = numpy.array((stat.st_mtime, stat.st_size), dtype=numpy.float64)
+        cachepath = radiipath + '.npz'
+        if cache:
+            try:
+                with numpy.load(cachepath) as cached:
+                    if (cached['stamp'] == stamp).all():
+                        return cls(cached['keys'], cached['radii'])
+            except (IOError, OSError, KeyError, ValueError):
+                pass
+
+        library = cls.from_file(radiipath)
+        if cache:
+            library._save(cachepath, stamp)
+        return library
+
+    @classmethod
+    def from_file(cls, radiipath):
+        radii = {}
         with open(radiipath, 'r') as f:
             for line in f:
                 # 0:3 
@@ -44,53 +172,355 @@ class PDBVolume(object):
 
                 # 9:15
                 radius = float(line[8:14])
-                try:
-                    self.radii[resfield][atomfield] = radius
-                except KeyError:
-                    self.radii[resfield] = {}
-                    self.radii[resfield][atomfield] = radius
-
-    def run(self):
-        # make numpy arrays for the solvent and solute
-        solute = [] 
-        solvent = []
-        solute_rad = []
-        for atom in self.pdb.atoms:
-            if atom['resname'] == self.solventname:
-                solvent.append(atom['position'])
-            else:
-                try:
-                    solute_rad.append(self.radii[atom['resname']][atom['atomname']])
-                    solute.append(atom['position'])
-                except KeyError:
-                    print("no radius specified for residue, atom name ({:s}, {:s}). "\
-                          "Excluding from volume calculation".format(atom['resname'],
-                                                                     atom['atomname']))
-
-        solute = numpy.array(solute, dtype=numpy.float64)
-        solvent = numpy.array(solvent, dtype=numpy.float64)
-        solute_rad = numpy.array(solute_rad, dtype=numpy.float64)
-        
+                # a later line for the same atom replaces an earlier one
+                radii[(resfield, atomfield)] = radius
+
+        names = sorted(radii)
+        keys = numpy.zeros(len(names), dtype=cls.KEY_DTYPE)
+        keys['resname'] = [resname for resname, atomname in names]
+        keys['atomname'] = [atomname for resname, atomname in names]
+        return cls(keys, numpy.array([radii[name] for name in names],
+                                     dtype=numpy.float64))
+
+    def _save(self, cachepath, stamp):
+        # write to a temporary file first, so that a reader never sees a
+        # partial cache; a library in a read-only directory is not cached
+        try:
+            fd, tmppath = tempfile.mkstemp(suffix='.npz',
+                                           dir=os.path.dirname(os.path.abspath(cachepath)))
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, keys=self.keys, radii=self.radii, stamp=stamp)
+            os.rename(tmppath, cachepath)
+        except (IOError, OSError):
+            pass
+
+    def index(self, resnames, atomnames):
+        '''
+        Index into ``self.radii`` of each (residue, atom name), or -1 for
+        names that are not in the library.
+        '''
+        names = numpy.zeros(len(resnames), dtype=self.KEY_DTYPE)
+        names['resname'] = resnames
+        names['atomname'] = atomnames
+        if not self.keys.shape[0]:
+            return numpy.full(names.shape[0], -1, dtype=numpy.intp)
+        # search for each distinct name only once
+        unique_names, inverse = numpy.unique(names, return_inverse=True)
+        index = numpy.searchsorted(self.keys, unique_names)
+        index[index == self.keys.shape[0]] = 0
+        index[self.keys[index] != unique_names] = -1
+        return index[inverse.reshape(-1)]
+
+    def lookup(self, resnames, atomnames):
+        '''
+        Radius of each (residue, atom name), or nan for names that are not in
+        the library.
+        '''
+        # index -1 picks the nan at the end
+        return numpy.append(self.radii, numpy.nan)[self.index(resnames, atomnames)]
+
+class PDBVolume(object):
+    def __init__(self, pdbpath, radiipath, explicitsolvent=False, solventname='WAT', solventrad=1.4, voxel_len=0.5, radii=None, solventshell=None, cache=None):
+        self.use_explicit_solvent = explicitsolvent
+        # a volumecache.VolumeCache that run looks the volume up in first
+        self.cache = cache
+        # with explicit solvent, only the solvent within this distance of the
+        # solute seeds the fill (see volume.volume_explicit_sol)
+        self.solventshell = solventshell
+        self.solventname = solventname
+        self.solventrad = solventrad
+        self.voxel_len = voxel_len
+        self.pdbpath = pdbpath
+        # a RadiiLibrary that is already loaded saves reading radiipath again
+        if radii is None:
+            self.loadradii(radiipath)
+        else:
+            self.radii = radii
+        self.pdb = PDBStructure()
+        self.pdb.from_file(pdbpath)
+
+    def loadradii(self, radiipath):
+        self.radii = RadiiLibrary.load(radiipath)
+
+    def select(self, atoms=None, report=True):
+        '''
+        Split the atoms (by default, ``self.pdb.atoms``) into solute and
+        solvent. Solute atoms without a radius in the radii library are left
+        out, and reported if ``report``.
+
+        -------------
+        Returns
+        -------------
+        (solute, solute_rad, solvent); shape (n,3) array of solute positions,
+        shape (n,) array of solute radii and shape (m,3) array of solvent
+        positions
+        '''
+        if atoms is None:
+            atoms = self.pdb.atoms
+        is_solvent = atoms['resname'] == self.solventname
+        solvent = atoms['position'][is_solvent]
+        solute = atoms[~is_solvent]
+
+        solute_rad = self.radii.lookup(solute['resname'], solute['atomname'])
+        found = ~numpy.isnan(solute_rad)
+        if report and not found.all():
+            names = numpy.zeros(int((~found).sum()), dtype=RadiiLibrary.KEY_DTYPE)
+            names['resname'] = solute['resname'][~found]
+            names['atomname'] = solute['atomname'][~found]
+            missing, counts = numpy.unique(names, return_counts=True)
+            print("no radius specified for {:d} atoms; excluding from volume "\
+                  "calculation (residue, atom name: count): {:s}"\
+                  .format(names.shape[0],
+                          ", ".join("({:s}, {:s}): {:d}".format(resname, atomname,
+                                                                 count)
+                                    for (resname, atomname), count
+                                    in zip(missing, counts))))
+        return (numpy.ascontiguousarray(solute['position'][found]),
+                solute_rad[found],
+                numpy.ascontiguousarray(solvent))
+
+    def run(self, return_grid=False):
+        '''
+        Volume of the solute; with ``return_grid``, (volume, AccessibleGrid)
+        '''
+        solute, solute_rad, solvent = self.select()
+        calc = volume if self.cache is None else self.cache
 
         if self.use_explicit_solvent:
-            return volume.volume_explicit_sol(solute, solute_rad, solvent, 
-                                              self.solventrad, self.voxel_len)
+            return calc.volume_explicit_sol(solute, solute_rad, solvent, 
+                                            self.solventrad, self.voxel_len,
+                                            return_grid=return_grid,
+                                            solvent_shell=self.solventshell)
+        else:
+            return calc.volume(solute, solute_rad, self.solventrad, 
+                               self.voxel_len, return_grid=return_grid)
+
+    def run_models(self):
+        '''
+        Volume of every model of the PDB file. The models are read one at a
+        time, and missing radii are only reported for the first.
+        '''
+        vols = []
+        with volume.VolumeCalculator(self.solventrad, self.voxel_len) as calc:
+            for i, atoms in enumerate(PDBStructure.models(self.pdbpath)):
+                solute, solute_rad, solvent = self.select(atoms, report=(i == 0))
+                if self.use_explicit_solvent:
+                    vols.append(calc.volume_explicit_sol(solute, solute_rad,
+                                                         solvent,
+                                                         self.solventshell))
+                else:
+                    vols.append(calc.volume(solute, solute_rad))
+        return numpy.array(vols, dtype=numpy.float64)
+
+# the BatchVolume and VolumeCalculator of a worker process of a batch
+_batch_worker = None
+
+def _init_batch_worker(batch):
+    global _batch_worker
+    _batch_worker = (batch, volume.VolumeCalculator(batch.solventrad,
+                                                    batch.voxel_len))
+
+def _batch_row(pdbpath):
+    batch, calc = _batch_worker
+    return batch.row(pdbpath, calc)
+
+class BatchVolume(object):
+    '''
+    Volumes of the first model of each of many PDB files, with the same radii
+    library and settings. The library is loaded once, the files are shared
+    out among a pool of ``workers`` processes (0 for one per core), and each
+    result is written to the output file as soon as it comes in. Files that
+    already have a volume in the output file are skipped, so that a batch
+    that was interrupted can be run again to finish it.
+
+    The output is CSV, or JSON lines if its name ends in .jsonl, with the
+    fields of FIELDS: the path of the PDB file, the volume, the number of
+    solute atoms, the seconds taken and the error message (if the volume
+    could not be calculated; the file is tried again by the next run).
+    '''
+    FIELDS = ('pdbpath', 'volume', 'natoms', 'seconds', 'error')
+
+    def __init__(self, radiipath, explicitsolvent=False, solventname='WAT',
+                 solventrad=1.4, voxel_len=0.5, workers=1, solventshell=None):
+        self.radii = RadiiLibrary.load(radiipath)
+        self.solventshell = solventshell
+        self.use_explicit_solvent = explicitsolvent
+        self.solventname = solventname
+        self.solventrad = solventrad
+        self.voxel_len = voxel_len
+        self.workers = workers if workers > 0 else multiprocessing.cpu_count()
+
+    @staticmethod
+    def expand(inputs):
+        '''
+        The PDB files given by ``inputs``, in order: each input is a PDB file,
+        a directory (for its *.pdb files), a glob pattern, or @ followed by
+        the path of a file that lists inputs one per line. Files given more
+        than once are only listed the first time.
+        '''
+        pdbpaths = []
+        for item in inputs:
+            if item.startswith('@'):
+                with open(item[1:], 'r') as f:
+                    pdbpaths += BatchVolume.expand([line.strip() for line in f
+                                                    if line.strip()])
+            elif os.path.isdir(item):
+                pdbpaths += sorted(glob.glob(os.path.join(item, '*.pdb')))
+            elif glob.has_magic(item):
+                pdbpaths += sorted(glob.glob(item))
+            else:
+                pdbpaths.append(item)
+        seen = set()
+        return [pdbpath for pdbpath in pdbpaths
+                if not (pdbpath in seen or seen.add(pdbpath))]
+
+    @staticmethod
+    def _is_jsonl(outpath):
+        return outpath.endswith('.jsonl')
+
+    def finished(self, outpath):
+        '''
+        The PDB files that have a volume in the output file ``outpath``. A last
+        line that was cut off when a run was interrupted is ignored; the file
+        is not changed.
+        '''
+        done = set()
+        if not os.path.exists(outpath):
+            return done
+        with open(outpath, 'rb') as f:
+            data = f.read()
+        cut = data.rfind(b'\n') + 1
+        lines = data[:cut].decode('utf-8').splitlines()
+        if self._is_jsonl(outpath):
+            rows = [json.loads(line) for line in lines if line.strip()]
+        else:
+            rows = csv.DictReader(lines)
+        for row in rows:
+            if not row['error']:
+                done.add(row['pdbpath'])
+        return done
+
+    @staticmethod
+    def _truncate_partial(outpath):
+        # remove a last line that was cut off when a run was interrupted, so
+        # that new rows are appended after whole lines
+        with open(outpath, 'rb+') as f:
+            data = f.read()
+            cut = data.rfind(b'\n') + 1
+            if cut < len(data):
+                f.truncate(cut)
+
+    def row(self, pdbpath, calc):
+        '''
+        The result of one PDB file, as a dict of FIELDS, using the
+        VolumeCalculator ``calc``
+        '''
+        start = time.time()
+        result = dict(pdbpath=pdbpath, volume=None, natoms=0, seconds=0.0,
+                      error='')
+        try:
+            pdbvol = PDBVolume(pdbpath, None,
+                               explicitsolvent=self.use_explicit_solvent,
+                               solventname=self.solventname,
+                               solventrad=self.solventrad,
+                               voxel_len=self.voxel_len, radii=self.radii)
+            solute, solute_rad, solvent = pdbvol.select(report=False)
+            if not solute.shape[0]:
+                raise ValueError("no solute atoms with a radius")
+            if self.use_explicit_solvent:
+                vol = calc.volume_explicit_sol(solute, solute_rad, solvent,
+                                               self.solventshell)
+            else:
+                vol = calc.volume(solute, solute_rad)
+            result['volume'] = vol
+            result['natoms'] = solute.shape[0]
+        except Exception as e:
+            result['error'] = "{:s}: {:s}".format(type(e).__name__, str(e))
+        result['seconds'] = time.time() - start
+        return result
+
+    def run(self, inputs, outpath=None):
+        '''
+        Calculate the volumes of the PDB files of ``inputs`` (see ``expand``)
+        that are not finished in ``outpath`` yet, and append them to it as
+        they come in; without ``outpath``, write CSV to standard output.
+
+        -------------
+        Returns
+        -------------
+        (rows, nskipped); the results calculated, as dicts of FIELDS in the
+        order they came in, and the number of files that were finished already
+        '''
+        pdbpaths = self.expand(inputs)
+        done = self.finished(outpath) if outpath else set()
+        todo = [pdbpath for pdbpath in pdbpaths if pdbpath not in done]
+        jsonl = bool(outpath) and self._is_jsonl(outpath)
+        if outpath:
+            if os.path.exists(outpath):
+                self._truncate_partial(outpath)
+            new = not os.path.exists(outpath) or not os.path.getsize(outpath)
+            out = open(outpath, 'a')
         else:
-            return volume.volume(solute, solute_rad, self.solventrad, 
-                                 self.voxel_len)
+            new = True
+            out = sys.stdout
+        writer = None if jsonl else csv.DictWriter(out, self.FIELDS,
+                                                   lineterminator='\n')
+        if new and not jsonl:
+            writer.writeheader()
+
+        rows = []
+        pool = None
+        try:
+            if (self.workers > 1) and (len(todo) > 1):
+                pool = multiprocessing.Pool(min(self.workers, len(todo)),
+                                            _init_batch_worker, (self,))
+                results = pool.imap_unordered(_batch_row, todo)
+            else:
+                _init_batch_worker(self)
+                results = (_batch_row(pdbpath) for pdbpath in todo)
+            for row in results:
+                if jsonl:
+                    out.write(json.dumps(row) + '\n')
+                else:
+                    writer.writerow(row)
+                out.flush()
+                rows.append(row)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if out is not sys.stdout:
+                out.close()
+        return rows, len(pdbpaths) - len(todo)
 
 class PDB2VolumeTool(PDBVolume):
     def __init__(self):
         self._parse_args()
+        if self.args.batch:
+            self._run_batch()
+            return
         super(PDB2VolumeTool, self).__init__(self.args.pdbpath, 
                                              self.args.radiipath,
                                              explicitsolvent=self.args.explicitsolvent,
                                              solventname=self.args.solventname,
                                              solventrad=self.args.solventrad,
-                                             voxel_len=self.args.voxel_len)
+                                             voxel_len=self.args.voxel_len,
+                                             solventshell=self.args.solventshell)
         v = self.run()
         print("Volume: {:.01f} Angstroms^3".format(v))
 
+    def _run_batch(self):
+        batch = BatchVolume(self.args.radiipath,
+                            explicitsolvent=self.args.explicitsolvent,
+                            solventname=self.args.solventname,
+                            solventrad=self.args.solventrad,
+                            voxel_len=self.args.voxel_len,
+                            workers=self.args.workers,
+                            solventshell=self.args.solventshell)
+        rows, nskipped = batch.run(self.args.batch, self.args.output)
+        nfailed = sum(1 for row in rows if row['error'])
+        sys.stderr.write("{:d} volumes calculated, {:d} failed, {:d} finished "\
+                         "before\n".format(len(rows) - nfailed, nfailed,
+                                           nskipped))
 
     def _parse_args(self):
         parser = argparse.ArgumentParser()
@@ -121,9 +551,34 @@ class PDB2VolumeTool(PDBVolume):
                             help="The residue name of the solvent (used only if "
                             "-e/--explicit-solvent is specified)")
 
+        parser.add_argument("-ss", "--solvent-shell", dest="solventshell",
+                            default=None, type=float,
+                            help="With -e/--explicit-solvent, only use the "
+                            "solvent within this distance of the solute (and "
+                            "in its internal cavities), and only fill the grid "
+                            "around it; the volume stays the same, but a large "
+                            "box of solvent takes much less time and memory")
+
         parser.add_argument("-v", "--voxel-len", dest="voxel_len", default=0.1, 
                             type=float,
                             help="The edge length of the (cubic) voxels.")
+
+        parser.add_argument("-b", "--batch", dest="batch", nargs='+',
+                            help="Calculate the volumes of many PDB files "
+                            "instead of -p/--pdbpath: PDB files, directories "
+                            "(of *.pdb files), glob patterns, or @ followed by "
+                            "a file that lists them one per line")
+
+        parser.add_argument("-o", "--output", dest="output", type=str,
+                            help="With -b/--batch, the CSV file (or JSON lines, "
+                            "if it ends in .jsonl) to append the volumes to; "
+                            "files already in it are skipped. By default, CSV "
+                            "is written to standard output")
+
+        parser.add_argument("-j", "--workers", dest="workers", default=1,
+                            type=int,
+                            help="With -b/--batch, the number of worker "
+                            "processes; 0 for one per core")
         self.args = parser.parse_args()
 
 if __name__ == "__main__":
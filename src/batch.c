@@ -0,0 +1,362 @@
+#include "batch.h"
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+struct Atoms* newAtoms(double* solute_pos, double* solute_rad, int nsolute,
+                       double solvent_rad, int single)
+{
+    /*
+     * Copy the solute atoms into a structure of arrays for the batched
+     * distance checks.
+     *
+     * ---------------
+     * Parameters
+     * ---------------
+     * solute_pos: shape (n,3) array of positions of solute atoms
+     * solute_rad: shape (n,) array of radii of solute atoms
+     * nsolute: (int) The value ``n`` in the above two lines
+     * solvent_rad: (double) the radius of the solvent
+     * single: if not 0, check distances in single precision; faster, but
+     *     voxels within about 1e-6 of the cutoff (relative) can be decided
+     *     differently from is_free
+     *
+     * --------
+     * Returns
+     * -------
+     * A pointer to the new atoms, or NULL if memory could not be allocated.
+     * Free with delAtoms.
+     */
+    struct Atoms* atoms;
+    double cut;
+    int i;
+
+    atoms = (struct Atoms*)calloc(1, sizeof(struct Atoms));
+    if (!atoms){
+        return NULL;
+    }
+    atoms->n = nsolute;
+    atoms->single = single;
+    // one extra element, so that nothing is allocated with size 0
+    atoms->x = (double*)malloc(6*((long)nsolute + 1)*sizeof(double));
+    if (single){
+        atoms->xf = (float*)malloc(4*((long)nsolute + 1)*sizeof(float));
+    }
+    if ((!atoms->x) || (single && !atoms->xf)){
+        delAtoms(atoms);
+        return NULL;
+    }
+    atoms->y = atoms->x + nsolute + 1;
+    atoms->z = atoms->y + nsolute + 1;
+    atoms->cut = atoms->z + nsolute + 1;
+    atoms->lo2 = atoms->cut + nsolute + 1;
+    atoms->hi2 = atoms->lo2 + nsolute + 1;
+    if (single){
+        atoms->yf = atoms->xf + nsolute + 1;
+        atoms->zf = atoms->yf + nsolute + 1;
+        atoms->cut2f = atoms->zf + nsolute + 1;
+    }
+    for (i=0; i<nsolute; i++){
+        cut = solute_rad[i] + solvent_rad;
+        atoms->x[i] = solute_pos[3*i];
+        atoms->y[i] = solute_pos[3*i + 1];
+        atoms->z[i] = solute_pos[3*i + 2];
+        atoms->cut[i] = cut;
+        atoms->lo2[i] = cut*cut*(1 - BAND);
+        atoms->hi2[i] = cut*cut*(1 + BAND);
+        if (single){
+            atoms->xf[i] = (float)solute_pos[3*i];
+            atoms->yf[i] = (float)solute_pos[3*i + 1];
+            atoms->zf[i] = (float)solute_pos[3*i + 2];
+            atoms->cut2f[i] = (float)(cut*cut);
+        }
+    }
+    return atoms;
+}
+
+void delAtoms(struct Atoms* atoms)
+{
+    free(atoms->x);
+    free(atoms->xf);
+    free(atoms);
+    return;
+}
+
+// Bits 0...7 of the result are the lowest bits of bytes 0...7 of ``bytes``
+static inline uint64_t pack8(const unsigned char* bytes)
+{
+    uint64_t x;
+    memcpy(&x, bytes, 8);
+    return ((x & 0x0101010101010101ULL)*0x0102040810204080ULL) >> 56;
+}
+
+// Mark the voxels iz0 ... iz1 of ``row`` that are closer than ``cut`` to an
+// atom at height solz above the row, and at squared distance dxy2 from it in
+// the xy-plane. The voxels are done a word at a time, in passes that the
+// compiler can vectorize: the squared distances (with the same operations as
+// dist), then their comparison with lo2 and hi2. Only the distances between
+// lo2 and hi2 need a square root. Words that are blocked already are
+// skipped.
+static void row_double(uint64_t* row, int iz0, int iz1, double voxel_len,
+                       double solz, double dxy2, double cut, double lo2,
+                       double hi2)
+{
+    double s[64];
+    unsigned char in[64], near[64];
+    double dz;
+    uint64_t range, word, maybe;
+    int w, z0, n, k;
+
+    for (w = iz0 >> 6; w <= iz1 >> 6; w++){
+        z0 = (iz0 > (w << 6)) ? iz0 : (w << 6);
+        n = ((iz1 < (w << 6) + 63) ? iz1 : (w << 6) + 63) - z0 + 1;
+        range = ((n == 64) ? ~(uint64_t)0 : (((uint64_t)1 << n) - 1)) << (z0 & 63);
+        if ((row[w] & range) == range){
+            continue;
+        }
+        for (k = 0; k < n; k++){
+            dz = solz - (z0 + k)*voxel_len;
+            s[k] = dxy2 + dz*dz;
+        }
+        for (k = 0; k < n; k++){
+            in[k] = s[k] < lo2;
+            near[k] = s[k] < hi2;
+        }
+        // pad to a whole number of bytes of bits
+        for (k = n; k < ((n + 7) & ~7); k++){
+            in[k] = 0;
+            near[k] = 0;
+        }
+        word = 0;
+        maybe = 0;
+        for (k = 0; k < n; k += 8){
+            word |= pack8(in + k) << k;
+            maybe |= pack8(near + k) << k;
+        }
+        maybe &= ~word;
+        while (maybe){
+            k = __builtin_ctzll(maybe);
+            if (sqrt(s[k]) < cut){
+                word |= (uint64_t)1 << k;
+            }
+            maybe &= maybe - 1;
+        }
+        row[w] |= word << (z0 & 63);
+    }
+}
+
+// Same as row_double, in single precision, without the square roots
+static void row_single(uint64_t* row, int iz0, int iz1, float voxel_len,
+                       float solz, float dxy2, float cut2)
+{
+    float s[64];
+    unsigned char in[64];
+    float dz;
+    uint64_t range, word;
+    int w, z0, n, k;
+
+    for (w = iz0 >> 6; w <= iz1 >> 6; w++){
+        z0 = (iz0 > (w << 6)) ? iz0 : (w << 6);
+        n = ((iz1 < (w << 6) + 63) ? iz1 : (w << 6) + 63) - z0 + 1;
+        range = ((n == 64) ? ~(uint64_t)0 : (((uint64_t)1 << n) - 1)) << (z0 & 63);
+        if ((row[w] & range) == range){
+            continue;
+        }
+        for (k = 0; k < n; k++){
+            dz = solz - (z0 + k)*voxel_len;
+            s[k] = dxy2 + dz*dz;
+        }
+        for (k = 0; k < n; k++){
+            in[k] = s[k] < cut2;
+        }
+        for (k = n; k < ((n + 7) & ~7); k++){
+            in[k] = 0;
+        }
+        word = 0;
+        for (k = 0; k < n; k += 8){
+            word |= pack8(in + k) << k;
+        }
+        row[w] |= word << (z0 & 63);
+    }
+}
+
+void rasterize_batch_slab(double voxel_len, struct BitGrid* blocked,
+                          struct Atoms* atoms, int xstart, int xstop,
+                          long* nchecked)
+{
+    /*
+     * Same as rasterize_slab, with the atoms in ``atoms``: the voxels of each
+     * row in the bounding box of an atom's exclusion sphere are checked
+     * against the atom together (see row_double). In double precision, a
+     * voxel is marked exactly when is_free returns False for it.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * voxel_len: edge length of (cubic) voxel
+     * blocked: shape (nx, ny, nz) grid of bits; set to 1 for voxels that are
+     *     not accessible to solvent.  Other voxels are left untouched.
+     * atoms: the solute atoms, made with newAtoms
+     * xstart: first x index of the slab
+     * xstop: one past the last x index of the slab
+     * nchecked: if not NULL, the number of voxels checked against an atom is
+     *     added to it
+     */
+    double solx, soly, solz, cut;
+    double voxx, voxy;
+    double dx, dy, dxy2, zcut;
+    float dxf, dyf;
+    int isolute, ix, iy;
+    int ix0, ix1, iy0, iy1, iz0, iz1;
+    long n = 0;
+    int ny = blocked->ny;
+    int nz = blocked->nz;
+
+    for (isolute = 0; isolute < atoms->n; isolute++){
+        solx = atoms->x[isolute];
+        soly = atoms->y[isolute];
+        solz = atoms->z[isolute];
+        cut = atoms->cut[isolute];
+
+        // the same bounding box as in rasterize_slab
+        ix0 = (int)fmax(floor((solx - cut)/voxel_len), xstart);
+        ix1 = (int)fmin(ceil((solx + cut)/voxel_len), xstop - 1);
+        iy0 = (int)fmax(floor((soly - cut)/voxel_len), 0);
+        iy1 = (int)fmin(ceil((soly + cut)/voxel_len), ny - 1);
+        for (ix = ix0; ix <= ix1; ix++){
+            voxx = ix*voxel_len;
+            dx = solx - voxx;
+            for (iy = iy0; iy <= iy1; iy++){
+                voxy = iy*voxel_len;
+                dy = soly - voxy;
+                if (dx*dx + dy*dy > cut*cut*(1 + 1e-9)){
+                    continue;
+                }
+                zcut = sqrt(fmax(cut*cut - dx*dx - dy*dy, 0));
+                iz0 = (int)fmax(floor((solz - zcut)/voxel_len) - 1, 0);
+                iz1 = (int)fmin(ceil((solz + zcut)/voxel_len) + 1, nz - 1);
+                if (iz1 < iz0){
+                    continue;
+                }
+                n += iz1 - iz0 + 1;
+                if (atoms->single){
+                    dxf = atoms->xf[isolute] - ix*(float)voxel_len;
+                    dyf = atoms->yf[isolute] - iy*(float)voxel_len;
+                    row_single(getrow(blocked, ix, iy), iz0, iz1,
+                               (float)voxel_len, atoms->zf[isolute],
+                               dxf*dxf + dyf*dyf, atoms->cut2f[isolute]);
+                } else {
+                    // dist(voxx, voxy, voxz, solx, soly, solz) adds dx*dx
+                    // and dy*dy before dz*dz
+                    dxy2 = dx*dx + dy*dy;
+                    row_double(getrow(blocked, ix, iy), iz0, iz1, voxel_len,
+                               solz, dxy2, cut, atoms->lo2[isolute],
+                               atoms->hi2[isolute]);
+                }
+            }
+        }
+    }
+    if (nchecked){
+        *nchecked += n;
+    }
+}
+
+void rasterize_batch(double voxel_len, struct BitGrid* blocked,
+                     struct Atoms* atoms, int nthreads, long* nchecked)
+{
+    /*
+     * rasterize_batch_slab for the whole grid, with the planes split in slabs
+     * over ``nthreads`` threads (0 for the OpenMP default). Rows never share a
+     * word, so the slabs can be filled in at the same time.
+     */
+    int nx = blocked->nx;
+    int nslabs, slab;
+    long n = 0;
+
+#ifdef _OPENMP
+    if (nthreads <= 0){
+        nthreads = omp_get_max_threads();
+    }
+#else
+    nthreads = 1;
+#endif
+    nslabs = (nthreads < nx) ? nthreads : nx;
+    #pragma omp parallel for num_threads(nthreads) schedule(static, 1) reduction(+:n)
+    for (slab=0; slab<nslabs; slab++){
+        rasterize_batch_slab(voxel_len, blocked, atoms,
+                             (int)(((long)slab*nx)/nslabs),
+                             (int)(((long)(slab+1)*nx)/nslabs),
+                             nchecked ? &n : NULL);
+    }
+    if (nchecked){
+        *nchecked += n;
+    }
+}
+
+void blocked_run(double voxel_len, int nz, int ix, int iy, double* p,
+                 double cut, int* z0, int* z1)
+{
+    /*
+     * Find the voxels of row (ix, iy) of a grid with nz voxels along z that
+     * are closer than ``cut`` to an atom at p; the voxels that is_free
+     * returns False for, for this atom. Along the row, the squared distance to
+     * the atom first decreases and then increases, so those voxels form a
+     * run, [*z0, *z1]; *z0 > *z1 if there are none. The ends of the run are
+     * found by stepping from where the sphere crosses the row, which takes
+     * only a few tests.
+     */
+    double lo2 = cut*cut*(1 - BAND);
+    double hi2 = cut*cut*(1 + BAND);
+    double dx = p[0] - ix*voxel_len;
+    double dy = p[1] - iy*voxel_len;
+    double dxy2, zcut;
+    int f, c, c0, c1, lo, hi;
+
+    *z0 = 1;
+    *z1 = 0;
+    if (dx*dx + dy*dy > cut*cut*(1 + 1e-9)){
+        return;
+    }
+    dxy2 = dx*dx + dy*dy;
+    // the closest voxel of the row is one of those around the atom; if it is
+    // not blocked, none are
+    f = (int)fmin(fmax(floor(p[2]/voxel_len), -2), nz + 1);
+    c0 = (f - 1 < 0) ? 0 : ((f - 1 > nz - 1) ? nz - 1 : f - 1);
+    c1 = (f + 2 > nz - 1) ? nz - 1 : ((f + 2 < 0) ? 0 : f + 2);
+    for (c = c0; c <= c1; c++){
+        if (blocks(voxel_len, c, p[2], dxy2, cut, lo2, hi2)){
+            break;
+        }
+    }
+    if (c > c1){
+        return;
+    }
+    zcut = sqrt(fmax(cut*cut - dxy2, 0));
+    lo = (int)fmin(fmax(ceil((p[2] - zcut)/voxel_len), 0), c);
+    if (blocks(voxel_len, lo, p[2], dxy2, cut, lo2, hi2)){
+        while ((lo > 0) &&
+               blocks(voxel_len, lo - 1, p[2], dxy2, cut, lo2, hi2)){
+            lo--;
+        }
+    } else {
+        while (!blocks(voxel_len, lo, p[2], dxy2, cut, lo2, hi2)){
+            lo++;
+        }
+    }
+    hi = (int)fmax(fmin(floor((p[2] + zcut)/voxel_len), nz - 1), c);
+    if (blocks(voxel_len, hi, p[2], dxy2, cut, lo2, hi2)){
+        while ((hi < nz - 1) &&
+               blocks(voxel_len, hi + 1, p[2], dxy2, cut, lo2, hi2)){
+            hi++;
+        }
+    } else {
+        while (!blocks(voxel_len, hi, p[2], dxy2, cut, lo2, hi2)){
+            hi--;
+        }
+    }
+    *z0 = lo;
+    *z1 = hi;
+}
@@ -0,0 +1,77 @@
+#include "bitgrid.h"
+#include <stdlib.h>
+#include <string.h>
+
+// Make a new grid of bits, all set to zero. Returns NULL if memory could not
+// be allocated.
+struct BitGrid* newBitGrid(int nx, int ny, int nz)
+{
+    struct BitGrid* bitgrid = (struct BitGrid*)malloc(sizeof(struct BitGrid));
+    if (!bitgrid){
+        return NULL;
+    }
+    bitgrid->nx = nx;
+    bitgrid->ny = ny;
+    bitgrid->nz = nz;
+    bitgrid->rowwords = (nz + 63)/64;
+    bitgrid->capacity = (long)nx*ny*bitgrid->rowwords + 1;
+    // calloc hands back pages that are already zeroed, which is much cheaper
+    // than zeroing the grid ourselves
+    bitgrid->words = (uint64_t*)calloc(bitgrid->capacity, sizeof(uint64_t));
+    if (!bitgrid->words){
+        free(bitgrid);
+        return NULL;
+    }
+    return bitgrid;
+}
+
+void delBitGrid(struct BitGrid* bitgrid)
+{
+    free(bitgrid->words);
+    free(bitgrid);
+    return;
+}
+
+// Turn the grid into an (nx, ny, nz) grid of bits, all set to zero. The words
+// are reused if there are enough of them, so that a series of calculations
+// can share one grid. Returns 1 (and leaves the grid as it was) if memory
+// could not be allocated, 0 otherwise.
+int resizeBitGrid(struct BitGrid* bitgrid, int nx, int ny, int nz)
+{
+    long rowwords = (nz + 63)/64;
+    long nwords = (long)nx*ny*rowwords + 1;
+    uint64_t* words;
+    if (nwords > bitgrid->capacity){
+        words = (uint64_t*)calloc(nwords, sizeof(uint64_t));
+        if (!words){
+            return 1;
+        }
+        free(bitgrid->words);
+        bitgrid->words = words;
+        bitgrid->capacity = nwords;
+    } else {
+        memset(bitgrid->words, 0, nwords*sizeof(uint64_t));
+    }
+    bitgrid->nx = nx;
+    bitgrid->ny = ny;
+    bitgrid->nz = nz;
+    bitgrid->rowwords = rowwords;
+    return 0;
+}
+
+// Number of bits that are set
+long countBits(struct BitGrid* bitgrid)
+{
+    long count = 0;
+    long nwords = (long)bitgrid->nx*bitgrid->ny*bitgrid->rowwords;
+    for (long i=0; i<nwords; i++){
+        count += __builtin_popcountll(bitgrid->words[i]);
+    }
+    return count;
+}
+
+// Bytes of memory used by the words of an (nx, ny, nz) grid of bits
+unsigned long bitGridBytes(int nx, int ny, int nz)
+{
+    return ((unsigned long)nx*ny*((nz + 63)/64) + 1)*sizeof(uint64_t);
+}
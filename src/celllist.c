@@ -0,0 +1,188 @@
+#include "celllist.h"
+#include "floodfill3d.h"
+#include <math.h>
+#include <stdlib.h>
+
+// Never use (many) more cells than there are atoms; sparse systems would
+// otherwise allocate huge, mostly empty cell grids.
+#define MAX_CELLS_PER_ATOM 8
+#define MIN_MAX_CELLS 4096
+
+struct CellList* newCellList(double* solute_pos, double* solute_rad,
+                             int nsolute, double solvent_rad)
+{
+    /*
+     * Build a cell list over the solute atoms. The edge length of a cell is at
+     * least max(solute_rad) + solvent_rad, so every atom that can overlap a
+     * solvent molecule centered at some point lies in the cell of that point
+     * or in one of the 26 cells surrounding it.
+     *
+     * ---------------
+     * Parameters
+     * ---------------
+     * solute_pos: shape (n,3) array of positions of solute atoms
+     * solute_rad: shape (n,) array of radii of solute atoms
+     * nsolute: (int) The value ``n`` in the above two lines
+     * solvent_rad: (double) the radius of the solvent
+     *
+     * --------
+     * Returns
+     * -------
+     * A pointer to the new cell list, or NULL if memory could not be
+     * allocated.  Free with delCellList.
+     */
+    double lo[3], hi[3];
+    double maxcut = 0;
+    double ncells;
+    long maxcells;
+    int i, d, c, nc;
+    int* cellidx;
+    int* fill;
+
+    struct CellList* cells = (struct CellList*)malloc(sizeof(struct CellList));
+    if (!cells){
+        return NULL;
+    }
+
+    for (d=0; d<3; d++){
+        lo[d] = 0;
+        hi[d] = 0;
+    }
+    for (i=0; i<nsolute; i++){
+        for (d=0; d<3; d++){
+            if ((i == 0) || (solute_pos[3*i+d] < lo[d])) lo[d] = solute_pos[3*i+d];
+            if ((i == 0) || (solute_pos[3*i+d] > hi[d])) hi[d] = solute_pos[3*i+d];
+        }
+        if (solute_rad[i] + solvent_rad > maxcut){
+            maxcut = solute_rad[i] + solvent_rad;
+        }
+    }
+
+    // Pad the cell edge slightly, so that rounding in the cell index
+    // calculation can never push an overlapping atom two cells away.
+    cells->cell_len = maxcut*(1 + 1e-6);
+    if (cells->cell_len <= 0){
+        cells->cell_len = 1;
+    }
+    maxcells = MAX_CELLS_PER_ATOM*(long)nsolute;
+    if (maxcells < MIN_MAX_CELLS){
+        maxcells = MIN_MAX_CELLS;
+    }
+    while (1){
+        ncells = (floor((hi[0]-lo[0])/cells->cell_len) + 1)
+                *(floor((hi[1]-lo[1])/cells->cell_len) + 1)
+                *(floor((hi[2]-lo[2])/cells->cell_len) + 1);
+        if (ncells <= maxcells){
+            break;
+        }
+        // Larger cells are still correct; they just hold more atoms.
+        cells->cell_len *= cbrt(ncells/maxcells)*1.01;
+    }
+    for (d=0; d<3; d++){
+        cells->origin[d] = lo[d];
+    }
+    cells->ncx = (int)floor((hi[0]-lo[0])/cells->cell_len) + 1;
+    cells->ncy = (int)floor((hi[1]-lo[1])/cells->cell_len) + 1;
+    cells->ncz = (int)floor((hi[2]-lo[2])/cells->cell_len) + 1;
+    nc = cells->ncx*cells->ncy*cells->ncz;
+
+    cells->start = (int*)calloc(nc+1, sizeof(int));
+    cells->pos = (double*)malloc(3*(nsolute+1)*sizeof(double));
+    cells->rad = (double*)malloc((nsolute+1)*sizeof(double));
+    cellidx = (int*)malloc((nsolute+1)*sizeof(int));
+    fill = (int*)calloc(nc, sizeof(int));
+    if ((!cells->start) || (!cells->pos) || (!cells->rad) || (!cellidx) || (!fill)){
+        free(cellidx);
+        free(fill);
+        delCellList(cells);
+        return NULL;
+    }
+
+    // counting sort of the atoms by cell
+    for (i=0; i<nsolute; i++){
+        c = (int)floor((solute_pos[3*i]-lo[0])/cells->cell_len)*cells->ncy*cells->ncz
+          + (int)floor((solute_pos[3*i+1]-lo[1])/cells->cell_len)*cells->ncz
+          + (int)floor((solute_pos[3*i+2]-lo[2])/cells->cell_len);
+        cellidx[i] = c;
+        cells->start[c+1] += 1;
+    }
+    for (c=0; c<nc; c++){
+        cells->start[c+1] += cells->start[c];
+    }
+    for (i=0; i<nsolute; i++){
+        c = cells->start[cellidx[i]] + fill[cellidx[i]];
+        fill[cellidx[i]] += 1;
+        cells->pos[3*c]   = solute_pos[3*i];
+        cells->pos[3*c+1] = solute_pos[3*i+1];
+        cells->pos[3*c+2] = solute_pos[3*i+2];
+        cells->rad[c] = solute_rad[i];
+    }
+    free(cellidx);
+    free(fill);
+    return cells;
+}
+
+void delCellList(struct CellList* cells)
+{
+    free(cells->start);
+    free(cells->pos);
+    free(cells->rad);
+    free(cells);
+    return;
+}
+
+unsigned char is_free_cells(double voxx, double voxy, double voxz,
+                            struct CellList* cells, double solvent_rad,
+                            long* nchecked)
+{
+    /*
+     * Same as is_free, but only checks the atoms in the 27 cells surrounding
+     * (voxx, voxy, voxz).
+     */
+    double fx = floor((voxx - cells->origin[0])/cells->cell_len);
+    double fy = floor((voxy - cells->origin[1])/cells->cell_len);
+    double fz = floor((voxz - cells->origin[2])/cells->cell_len);
+    int cx0, cx1, cy0, cy1, cz0, cz1;
+    int cx, cy, c, iatom;
+    long n = 0;
+    double solx, soly, solz, cut;
+
+    // nothing to check if the point is more than a cell away from every atom
+    if ((fx < -1) || (fx > cells->ncx) || (fy < -1) || (fy > cells->ncy) ||
+        (fz < -1) || (fz > cells->ncz)){
+        return 1;
+    }
+    cx0 = (fx > 0) ? (int)fx - 1 : 0;
+    cy0 = (fy > 0) ? (int)fy - 1 : 0;
+    cz0 = (fz > 0) ? (int)fz - 1 : 0;
+    cx1 = ((int)fx + 1 < cells->ncx) ? (int)fx + 1 : cells->ncx - 1;
+    cy1 = ((int)fy + 1 < cells->ncy) ? (int)fy + 1 : cells->ncy - 1;
+    cz1 = ((int)fz + 1 < cells->ncz) ? (int)fz + 1 : cells->ncz - 1;
+
+    for (cx=cx0; cx<=cx1; cx++){
+        for (cy=cy0; cy<=cy1; cy++){
+            c = cx*cells->ncy*cells->ncz + cy*cells->ncz;
+            // the atoms of cells cz0...cz1 are contiguous
+            for (iatom=cells->start[c+cz0]; iatom<cells->start[c+cz1+1]; iatom++){
+                solx = cells->pos[3*iatom];
+                soly = cells->pos[3*iatom + 1];
+                solz = cells->pos[3*iatom + 2];
+                cut = cells->rad[iatom] + solvent_rad;
+                n++;
+                if ((fabs(solx - voxx)>cut) || (fabs(soly - voxy) > cut) || (fabs(solz - voxz) > cut)){
+                    continue;
+                }
+                else if (dist(voxx, voxy, voxz, solx, soly, solz) < cut) {
+                    if (nchecked){
+                        *nchecked += n;
+                    }
+                    return 0;
+                }
+            }
+        }
+    }
+    if (nchecked){
+        *nchecked += n;
+    }
+    return 1;
+}
@@ -1,7 +1,9 @@
 #include "queue.h"
+#include "celllist.h"
+#include "bitgrid.h"
+#include "stats.h"
 #include <math.h>
 #include <stdlib.h>
-#include <limits.h>
 
 double dist(double x1, double y1, double z1, double x2, double y2, double z2) {
     /*
@@ -15,7 +17,8 @@ double dist(double x1, double y1, double z1, double x2, double y2, double z2) {
 
 
 unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
-                      double* solute_rad, int nsolute, double solvent_rad)
+                      double* solute_rad, int nsolute, double solvent_rad,
+                      long* nchecked)
 {
     /*
      * ---------------
@@ -29,6 +32,8 @@ unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
      * nsolute: (int) The value ``n`` in the above two lines, ie, the number of
      *     solute atoms.
      * solvent_rad: (double) the radius of the solvent 
+     * nchecked: if not NULL, the number of solute atoms checked is added to
+     *     it
 
      * --------
      * Returns
@@ -45,8 +50,9 @@ unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
     double solz;
     double solrad;
     double cut;
+    int isolute;
 
-    for (int isolute = 0; isolute < nsolute; isolute++){
+    for (isolute = 0; isolute < nsolute; isolute++){
         solx = solute_pos[isolute*3];
         soly = solute_pos[isolute*3 + 1];
         solz = solute_pos[isolute*3 + 2];
@@ -63,82 +69,395 @@ unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
             break;
         }
     }
+    if (nchecked){
+        *nchecked += check ? nsolute : isolute + 1;
+    }
     return check;
 }
 
 
-void floodfill(int ix, int iy, int iz, int nx, int ny, int nz, double voxel_len,
-               unsigned char* visited_grid, unsigned char* grid, int* moves,
-               double* solute_pos, double* solute_rad, int nsolute, 
-               double solvent_rad)
+void rasterize_slab(double voxel_len, struct BitGrid* blocked,
+                    double* solute_pos, double* solute_rad, int nsolute,
+                    double solvent_rad, int xstart, int xstop,
+                    long* nchecked)
 {
     /*
+     * Mark every voxel that a solvent molecule centered on it would overlap
+     * with a solute atom, visiting only the voxels in the bounding box of each
+     * atom's exclusion sphere.  A voxel is marked exactly when is_free returns
+     * False for it.  Only voxels with x index in [xstart, xstop) are marked, so
+     * that different slabs of the grid can be filled in by different threads.
+     *
      * ----------
      * Parameters
      * ----------
-     * ix: x index of current grid position
-     * iy: y index of current grid position
-     * iz: z index of current grid position
-     * nx: length of grid along x-axis, in voxels
-     * ny: length of grid along y-axis, in voxels
-     * nz: length of grid along z-axis, in voxels
      * voxel_len: edge length of (cubic) voxel
-     * visited_grid: shape (nx, ny, nz) array; 1 if visited, 0 otherwise
-     * grid: shape (nx, ny, nz) array; 1 if accessible by moves on solvent; 
-     *     0 otherwise
-     * moves: shape (26,3) array; possible moves
+     * blocked: shape (nx, ny, nz) grid of bits; set to 1 for voxels that are
+     *     not accessible to solvent.  Other voxels are left untouched.
      * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
      *     atom
      * solute_rad: shape (nsolute,) array; radius of each solute atom
      * nsolute: number of solute atoms
      * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * xstart: first x index of the slab
+     * xstop: one past the last x index of the slab
+     * nchecked: if not NULL, the number of voxels checked against an atom is
+     *     added to it
      */
+    double solx, soly, solz, cut;
+    double voxx, voxy, voxz;
+    double dx, dy, zcut;
+    int isolute, ix, iy, iz;
+    int ix0, ix1, iy0, iy1, iz0, iz1;
+    long n = 0;
+    int ny = blocked->ny;
+    int nz = blocked->nz;
+    uint64_t* row;
+
+    for (isolute = 0; isolute < nsolute; isolute++){
+        solx = solute_pos[isolute*3];
+        soly = solute_pos[isolute*3 + 1];
+        solz = solute_pos[isolute*3 + 2];
+        cut = solute_rad[isolute] + solvent_rad;
+
+        // Pad the bounding box by a voxel; the exact test below decides.
+        ix0 = (int)fmax(floor((solx - cut)/voxel_len), xstart);
+        ix1 = (int)fmin(ceil((solx + cut)/voxel_len), xstop - 1);
+        iy0 = (int)fmax(floor((soly - cut)/voxel_len), 0);
+        iy1 = (int)fmin(ceil((soly + cut)/voxel_len), ny - 1);
+        for (ix = ix0; ix <= ix1; ix++){
+            voxx = ix*voxel_len;
+            dx = solx - voxx;
+            for (iy = iy0; iy <= iy1; iy++){
+                voxy = iy*voxel_len;
+                dy = soly - voxy;
+                if (dx*dx + dy*dy > cut*cut*(1 + 1e-9)){
+                    continue;
+                }
+                // half-length of the chord of the sphere along this row
+                zcut = sqrt(fmax(cut*cut - dx*dx - dy*dy, 0));
+                iz0 = (int)fmax(floor((solz - zcut)/voxel_len) - 1, 0);
+                iz1 = (int)fmin(ceil((solz + zcut)/voxel_len) + 1, nz - 1);
+                row = getrow(blocked, ix, iy);
+                for (iz = iz0; iz <= iz1; iz++){
+                    if ((row[iz >> 6] >> (iz & 63)) & 1){
+                        continue;
+                    }
+                    voxz = iz*voxel_len;
+                    n++;
+                    // same test as in is_free
+                    if ((fabs(solx - voxx)>cut) || (fabs(soly - voxy) > cut) || (fabs(solz - voxz) > cut)){
+                        continue;
+                    }
+                    else if (dist(voxx, voxy, voxz, solx, soly, solz) < cut) {
+                        row[iz >> 6] |= (uint64_t)1 << (iz & 63);
+                    }
+                }
+            }
+        }
+    }
+    if (nchecked){
+        *nchecked += n;
+    }
+}
 
-    // Create a *huge* queue
-    unsigned long nitems = nx;
-    nitems *= ny;
-    nitems *= nz;
-    struct Queue* queue = newQueue(nitems); 
-    struct Triple coord;
-    struct Triple newcoord;
-    int i;
-    coord.x = (unsigned short int)ix;
-    coord.y = (unsigned short int)iy;
-    coord.z = (unsigned short int)iz;
-    if (append(coord, queue)==1){
-        exit(1);
+
+void rasterize(double voxel_len, struct BitGrid* blocked, double* solute_pos,
+               double* solute_rad, int nsolute, double solvent_rad,
+               long* nchecked)
+{
+    // rasterize the whole grid
+    rasterize_slab(voxel_len, blocked, solute_pos, solute_rad, nsolute,
+                   solvent_rad, 0, blocked->nx, nchecked);
+}
+
+
+// Everything the flood fill needs to decide whether solvent fits at a voxel
+struct FillContext
+{
+    double voxel_len;
+    struct BitGrid* visited_grid;
+    struct BitGrid* grid;
+    double* solute_pos;
+    double* solute_rad;
+    int nsolute;
+    double solvent_rad;
+    struct CellList* cells;
+    struct BitGrid* blocked;
+    struct FillStats* stats;
+};
+
+static inline int claim(struct FillContext* fill, int x, int y, int z)
+{
+    /*
+     * Return 1 if voxel (x, y, z) is accessible to solvent and was not yet in
+     * ``fill->grid``, and add it to the grid. Return 0 otherwise. Each voxel
+     * is checked against the solute atoms at most once.
+     */
+    unsigned char voxfree;
+    long* nchecked = NULL;
+    if (getbit(fill->grid, x, y, z)){
+        return 0;
+    }
+    if (fill->blocked){
+        voxfree = !getbit(fill->blocked, x, y, z);
+    } else {
+        if (getbit(fill->visited_grid, x, y, z)){
+            return 0;
+        }
+        setbit(fill->visited_grid, x, y, z);
+        if (fill->stats){
+            fill->stats->is_free_calls++;
+            nchecked = &fill->stats->distance_evals;
+        }
+        if (fill->cells){
+            voxfree = is_free_cells(x*fill->voxel_len,
+                                    y*fill->voxel_len,
+                                    z*fill->voxel_len,
+                                    fill->cells,
+                                    fill->solvent_rad,
+                                    nchecked);
+        } else {
+            voxfree = is_free(x*fill->voxel_len,
+                              y*fill->voxel_len,
+                              z*fill->voxel_len,
+                              fill->solute_pos,
+                              fill->solute_rad,
+                              fill->nsolute,
+                              fill->solvent_rad,
+                              nchecked);
+        }
     }
-    visited_grid[coord.x*ny*nz + coord.y*nz + coord.z] = 1;
+    if (voxfree){
+        setbit(fill->grid, x, y, z);
+    }
+    return voxfree;
+}
+
+// Fill the spans in the queue, and every span that can be reached from them.
+// Returns 1 (with the queue emptied) if the queue could not grow, else 0.
+static int fill_spans(struct FillContext* fill, struct Queue* queue)
+{
+    int nx = fill->grid->nx;
+    int ny = fill->grid->ny;
+    int nz = fill->grid->nz;
+    struct Span span;
+    struct Span newspan;
+    int x, y, z, z0, z1, dx, dy;
+    int inspan;
+    int failed = 0;
+    // counted here rather than in claim, to keep the stores to fill->stats
+    // out of the inner loops
+    long visited = 0;
+    unsigned long queue_max = queue->size;
 
     // The main loop.
-    while (!isEmpty(queue)){
-        coord = pop(queue);
-        
-        if (is_free(coord.x*voxel_len,
-                   coord.y*voxel_len,
-                   coord.z*voxel_len,
-                   solute_pos,
-                   solute_rad,
-                   nsolute,
-                   solvent_rad))
-        {
-            grid[coord.x*ny*nz + coord.y*nz + coord.z] = 1;
-
-            for (i=0;i<26;i++) {
-                newcoord.x = coord.x+moves[3*i];
-                newcoord.y = coord.y+moves[3*i+1];
-                newcoord.z = coord.z+moves[3*i+2];
-                // check that x,y,z is in bounds of grid; 
-                if ((visited_grid[newcoord.x*ny*nz + newcoord.y*nz + newcoord.z]==0) 
-                     && (newcoord.x != USHRT_MAX) && (newcoord.x < nx) 
-                     && (newcoord.y != USHRT_MAX) && (newcoord.y < ny) 
-                     && (newcoord.z != USHRT_MAX) && (newcoord.z < nz))
-                {
-                    visited_grid[newcoord.x*ny*nz + newcoord.y*nz + newcoord.z] = 1;
-                    append(newcoord, queue);
-                } 
+    while (!failed && !isEmpty(queue)){
+        span = pop(queue);
+
+        // Extend the span in both directions
+        z0 = span.z0;
+        while ((z0 > 0) && claim(fill, span.x, span.y, z0-1)){
+            z0--;
+        }
+        z1 = span.z1;
+        while ((z1 < nz-1) && claim(fill, span.x, span.y, z1+1)){
+            z1++;
+        }
+        if (z0 > 0){
+            z0--;
+        }
+        if (z1 < nz-1){
+            z1++;
+        }
+        // claim was called for every voxel between the old and the new ends
+        visited += (span.z0 - z0) + (z1 - span.z1);
+
+        // Look for new spans in the neighboring rows
+        for (dx=-1; dx<=1; dx++){
+            x = span.x + dx;
+            if ((x < 0) || (x >= nx)){
+                continue;
+            }
+            for (dy=-1; dy<=1; dy++){
+                y = span.y + dy;
+                if ((y < 0) || (y >= ny) || ((dx == 0) && (dy == 0))){
+                    continue;
+                }
+                inspan = 0;
+                newspan.x = (unsigned short int)x;
+                newspan.y = (unsigned short int)y;
+                for (z=z0; z<=z1; z++){
+                    if (claim(fill, x, y, z)){
+                        if (!inspan){
+                            newspan.z0 = (unsigned short int)z;
+                            inspan = 1;
+                        }
+                        newspan.z1 = (unsigned short int)z;
+                    } else if (inspan){
+                        failed |= append(newspan, queue);
+                        inspan = 0;
+                    }
+                }
+                if (inspan){
+                    failed |= append(newspan, queue);
+                }
+                visited += z1 - z0 + 1;
             }
-        }  
+        }
+        if (queue->size > queue_max){
+            queue_max = queue->size;
+        }
+    }
+    if (fill->stats){
+        fill->stats->visited += visited;
+        if ((long)queue_max > fill->stats->queue_max){
+            fill->stats->queue_max = (long)queue_max;
+        }
+    }
+    if (failed){
+        queue->front = 0;
+        queue->rear = 0;
+        queue->size = 0;
     }
-    delQueue(queue);
+    return failed;
+}
+
+int floodfill_multi(int* seeds, int nseeds, double voxel_len,
+                    struct BitGrid* visited_grid, struct BitGrid* grid,
+                    double* solute_pos, double* solute_rad, int nsolute,
+                    double solvent_rad, struct CellList* cells,
+                    struct BitGrid* blocked, struct Queue* queue,
+                    struct FillStats* stats)
+{
+    /*
+     * Add every voxel that can be reached from any of the seed voxels by moves
+     * between neighboring voxels (including diagonal neighbors; 26 in total)
+     * that are accessible to solvent to ``grid``. Every voxel is checked at
+     * most once, however many seeds lie in the same region: the region of a
+     * seed is filled completely before moving on to the next seed, and seeds
+     * in regions that have been filled already are skipped right away.
+     *
+     * The fill works on spans: runs of accessible voxels along the z-axis.
+     * Filling a span takes it as far as it goes in both directions; then only
+     * the 8 neighboring rows need to be scanned (over the z-range of the span,
+     * plus one voxel on either end, for diagonal moves) for new spans.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * seeds: shape (nseeds, 3) array; (x,y,z) indices of the seed voxels.
+     *     Seeds that are blocked, outside the grid or already in ``grid`` are
+     *     skipped.
+     * nseeds: number of seed voxels
+     * voxel_len: edge length of (cubic) voxel
+     * visited_grid: shape (nx, ny, nz) grid of bits; 1 if the voxel has been
+     *     checked against the solute atoms, 0 otherwise. Not used (and may be
+     *     NULL) if ``blocked`` is given.
+     * grid: shape (nx, ny, nz) grid of bits; 1 if accessible by moves on
+     *     solvent; 0 otherwise
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * cells: cell list built over the solute atoms with newCellList, or NULL
+     *     to check every solute atom for each voxel
+     * blocked: shape (nx, ny, nz) grid of bits filled in by rasterize, or
+     *     NULL.  If given, it is used instead of checking distances to solute
+     *     atoms.
+     * queue: empty queue to hold the spans waiting to be filled, or NULL to
+     *     use a new one. The queue is empty again when floodfill_multi
+     *     returns, so it can be reused for many fills.
+     * stats: counters to add to, or NULL
+     *
+     * --------
+     * Returns
+     * -------
+     * 0 on success, 1 if memory for the queue could not be allocated (then
+     * ``grid`` holds only part of the fill).
+     */
+    struct FillContext fill = {voxel_len, visited_grid, grid, solute_pos,
+                               solute_rad, nsolute, solvent_rad, cells,
+                               blocked, stats};
+    int nx = grid->nx;
+    int ny = grid->ny;
+    int nz = grid->nz;
+    // The queue only ever holds spans waiting to be filled; start small and
+    // let it grow.
+    struct Queue* ownqueue = queue ? NULL : newQueue(1024);
+    struct Span span;
+    int i, x, y, z;
+    int failed = 0;
+
+    if (!queue){
+        if (!ownqueue){
+            return 1;
+        }
+        queue = ownqueue;
+    }
+    for (i=0; (i<nseeds) && !failed; i++){
+        x = seeds[3*i];
+        y = seeds[3*i+1];
+        z = seeds[3*i+2];
+        if ((x < 0) || (x >= nx) || (y < 0) || (y >= ny) || (z < 0) ||
+            (z >= nz)){
+            continue;
+        }
+        if (stats){
+            stats->visited++;
+        }
+        if (!claim(&fill, x, y, z)){
+            continue;
+        }
+        span.x = (unsigned short int)x;
+        span.y = (unsigned short int)y;
+        span.z0 = (unsigned short int)z;
+        span.z1 = (unsigned short int)z;
+        if (append(span, queue)==1){
+            failed = 1;
+            break;
+        }
+        if (stats){
+            stats->fills++;
+        }
+        failed = fill_spans(&fill, queue);
+    }
+    if (stats){
+        stats->seeds += nseeds;
+    }
+    if (ownqueue){
+        if (stats){
+            stats->bytes += ownqueue->capacity*sizeof(struct Span);
+        }
+        delQueue(ownqueue);
+    }
+    return failed;
+}
+
+int floodfill(int ix, int iy, int iz, double voxel_len,
+              struct BitGrid* visited_grid, struct BitGrid* grid,
+              double* solute_pos, double* solute_rad, int nsolute, 
+              double solvent_rad, struct CellList* cells,
+              struct BitGrid* blocked, struct Queue* queue,
+              struct FillStats* stats)
+{
+    /*
+     * Add every voxel that can be reached from (ix, iy, iz) by moves between
+     * neighboring voxels (including diagonal neighbors; 26 in total) that are
+     * accessible to solvent to ``grid``.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * ix: x index of current grid position
+     * iy: y index of current grid position
+     * iz: z index of current grid position
+     * the other parameters (and the return value) are those of
+     * floodfill_multi
+     */
+    int seed[3] = {ix, iy, iz};
+    return floodfill_multi(seed, 1, voxel_len, visited_grid, grid, solute_pos,
+                    solute_rad, nsolute, solvent_rad, cells, blocked, queue,
+                    stats);
 }
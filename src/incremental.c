@@ -0,0 +1,642 @@
+#include "incremental.h"
+#include "batch.h"
+#include "floodfill3d.h"
+#include <limits.h>
+#include <math.h>
+#include <stdlib.h>
+#include <string.h>
+
+struct Incremental* newIncremental(int nx, int ny, int nz, double voxel_len,
+                                   double* solute_rad, int nsolute,
+                                   double solvent_rad)
+{
+    /*
+     * Set up an (nx, ny, nz) grid for incremental volume calculations, with
+     * the voxel at (x, y, z) indices (i, j, k) centered at
+     * (i*voxel_len, j*voxel_len, k*voxel_len). Call incremental_full with the
+     * first frame, and incremental_update with each frame after that.
+     *
+     * ---------------
+     * Parameters
+     * ---------------
+     * nx, ny, nz: number of voxels along x, y and z
+     * voxel_len: edge length of (cubic) voxel
+     * solute_rad: shape (n,) array of radii of solute atoms
+     * nsolute: (int) The value ``n`` in the above line
+     * solvent_rad: (double) the radius of the solvent
+     *
+     * --------
+     * Returns
+     * -------
+     * A pointer to the new state, or NULL if memory could not be allocated.
+     * Free with delIncremental.
+     */
+    struct Incremental* inc;
+    long nbricks;
+
+    inc = (struct Incremental*)calloc(1, sizeof(struct Incremental));
+    if (!inc){
+        return NULL;
+    }
+    inc->nx = nx;
+    inc->ny = ny;
+    inc->nz = nz;
+    inc->voxel_len = voxel_len;
+    inc->nsolute = nsolute;
+    inc->solvent_rad = solvent_rad;
+    inc->nbx = (nx + BRICK_LEN - 1)/BRICK_LEN;
+    inc->nby = (ny + BRICK_LEN - 1)/BRICK_LEN;
+    inc->nbz = (nz + BRICK_LEN - 1)/BRICK_LEN;
+    nbricks = (long)inc->nbx*inc->nby*inc->nbz;
+    inc->seed_capacity = 1024;
+    // one extra element, so that nothing is allocated with size 0
+    inc->pos = (double*)malloc((3*(long)nsolute + 1)*sizeof(double));
+    inc->rad = (double*)malloc(((long)nsolute + 1)*sizeof(double));
+    inc->counts = (unsigned short*)calloc((long)nx*ny*nz,
+                                          sizeof(unsigned short));
+    inc->blocked = newBitGrid(nx, ny, nz);
+    inc->grid = newBitGrid(nx, ny, nz);
+    inc->mark = newBitGrid(nx, ny, nz);
+    inc->bricks = (int*)calloc(nbricks, sizeof(int));
+    inc->brick_stack = (int*)malloc(nbricks*sizeof(int));
+    inc->halo = (int*)calloc(nbricks, sizeof(int));
+    inc->halo_stack = (int*)malloc(nbricks*sizeof(int));
+    inc->saved = (unsigned char*)malloc(nbricks*BRICK_LEN*BRICK_LEN);
+    inc->seeds = (int*)malloc(3*inc->seed_capacity*sizeof(int));
+    inc->queue = newQueue(1024);
+    if ((!inc->pos) || (!inc->rad) || (!inc->counts) || (!inc->blocked) ||
+        (!inc->grid) || (!inc->mark) || (!inc->bricks) ||
+        (!inc->brick_stack) || (!inc->halo) || (!inc->halo_stack) ||
+        (!inc->saved) || (!inc->seeds) || (!inc->queue)){
+        delIncremental(inc);
+        return NULL;
+    }
+    memcpy(inc->rad, solute_rad, nsolute*sizeof(double));
+    return inc;
+}
+
+void delIncremental(struct Incremental* inc)
+{
+    free(inc->pos);
+    free(inc->rad);
+    free(inc->counts);
+    if (inc->blocked){
+        delBitGrid(inc->blocked);
+    }
+    if (inc->grid){
+        delBitGrid(inc->grid);
+    }
+    if (inc->mark){
+        delBitGrid(inc->mark);
+    }
+    free(inc->bricks);
+    free(inc->brick_stack);
+    free(inc->halo);
+    free(inc->halo_stack);
+    free(inc->saved);
+    free(inc->seeds);
+    if (inc->queue){
+        delQueue(inc->queue);
+    }
+    free(inc);
+    return;
+}
+
+static inline long brick_of(struct Incremental* inc, int x, int y, int z)
+{
+    return ((long)(x/BRICK_LEN)*inc->nby + y/BRICK_LEN)*inc->nbz + z/BRICK_LEN;
+}
+
+// Add delta (1 or -1) to the counts of voxels z0 ... z1 of row (x, y). The
+// voxels whose count goes to or from 0 are blocked or freed, and their
+// bricks are marked as changed (-1). Returns 1 if a count would go over
+// USHRT_MAX.
+static int add_run(struct Incremental* inc, int x, int y, int z0, int z1,
+                   int delta)
+{
+    unsigned short* count = inc->counts + ((long)x*inc->ny + y)*inc->nz;
+    uint64_t* row = getrow(inc->blocked, x, y);
+    long b;
+    int z;
+
+    for (z = z0; z <= z1; z++){
+        if (delta > 0){
+            if (count[z] == USHRT_MAX){
+                return 1;
+            }
+            if (count[z]++ > 0){
+                continue;
+            }
+        } else if (--count[z] > 0){
+            continue;
+        }
+        row[z >> 6] ^= (uint64_t)1 << (z & 63);
+        inc->changed++;
+        b = brick_of(inc, x, y, z);
+        if (!inc->bricks[b]){
+            inc->bricks[b] = -1;
+            inc->dirty_bricks++;
+        }
+    }
+    return 0;
+}
+
+// Move atom i from inc->pos to p, updating the counts of the voxels it
+// blocks. Returns 1 if a count would go over USHRT_MAX.
+static int move_atom(struct Incremental* inc, int i, double* p)
+{
+    double* old = inc->pos + 3*i;
+    double cut = inc->rad[i] + inc->solvent_rad;
+    double voxel_len = inc->voxel_len;
+    int ix, iy, ix0, ix1, iy0, iy1;
+    int a0, a1, b0, b1;
+
+    if ((old[0] == p[0]) && (old[1] == p[1]) && (old[2] == p[2])){
+        return 0;
+    }
+    // the rows of the bounding boxes of the atom, before and after
+    ix0 = (int)fmax(floor((fmin(old[0], p[0]) - cut)/voxel_len), 0);
+    ix1 = (int)fmin(ceil((fmax(old[0], p[0]) + cut)/voxel_len), inc->nx - 1);
+    iy0 = (int)fmax(floor((fmin(old[1], p[1]) - cut)/voxel_len), 0);
+    iy1 = (int)fmin(ceil((fmax(old[1], p[1]) + cut)/voxel_len), inc->ny - 1);
+    for (ix = ix0; ix <= ix1; ix++){
+        for (iy = iy0; iy <= iy1; iy++){
+            blocked_run(inc->voxel_len, inc->nz, ix, iy, old, cut, &a0, &a1);
+            blocked_run(inc->voxel_len, inc->nz, ix, iy, p, cut, &b0, &b1);
+            if ((a0 == b0) && (a1 == b1)){
+                continue;
+            }
+            if (b0 > b1){
+                add_run(inc, ix, iy, a0, a1, -1);
+            } else if (a0 > a1){
+                if (add_run(inc, ix, iy, b0, b1, 1)){
+                    return 1;
+                }
+            } else {
+                // only the voxels in one run but not the other change
+                if (add_run(inc, ix, iy, b0, (b1 < a0 - 1) ? b1 : a0 - 1, 1) ||
+                    add_run(inc, ix, iy, (b0 > a1 + 1) ? b0 : a1 + 1, b1, 1)){
+                    return 1;
+                }
+                add_run(inc, ix, iy, a0, (a1 < b0 - 1) ? a1 : b0 - 1, -1);
+                add_run(inc, ix, iy, (a0 > b1 + 1) ? a0 : b1 + 1, a1, -1);
+            }
+        }
+    }
+    old[0] = p[0];
+    old[1] = p[1];
+    old[2] = p[2];
+    return 0;
+}
+
+// Block the voxels of every atom at inc->pos without counting the atoms, for
+// when a count would go over USHRT_MAX. The counts are then not kept up, and
+// every frame after is done from scratch.
+static void block_all(struct Incremental* inc)
+{
+    double* p;
+    double cut;
+    int i, ix, iy, ix0, ix1, iy0, iy1, z0, z1;
+
+    resizeBitGrid(inc->blocked, inc->nx, inc->ny, inc->nz);
+    for (i = 0; i < inc->nsolute; i++){
+        p = inc->pos + 3*i;
+        cut = inc->rad[i] + inc->solvent_rad;
+        ix0 = (int)fmax(floor((p[0] - cut)/inc->voxel_len), 0);
+        ix1 = (int)fmin(ceil((p[0] + cut)/inc->voxel_len), inc->nx - 1);
+        iy0 = (int)fmax(floor((p[1] - cut)/inc->voxel_len), 0);
+        iy1 = (int)fmin(ceil((p[1] + cut)/inc->voxel_len), inc->ny - 1);
+        for (ix = ix0; ix <= ix1; ix++){
+            for (iy = iy0; iy <= iy1; iy++){
+                blocked_run(inc->voxel_len, inc->nz, ix, iy, p, cut, &z0, &z1);
+                if (z0 <= z1){
+                    setrun(getrow(inc->blocked, ix, iy), z0, z1);
+                }
+            }
+        }
+    }
+    inc->saturated = 1;
+}
+
+// Flood fill the grid from voxel (0, 0, 0), from scratch; returns 1 if memory
+// could not be allocated
+static int refill(struct Incremental* inc)
+{
+    resizeBitGrid(inc->grid, inc->nx, inc->ny, inc->nz);
+    return floodfill(0, 0, 0, inc->voxel_len, NULL, inc->grid, NULL, NULL, 0, 0,
+              NULL, inc->blocked, inc->queue, NULL);
+}
+
+int incremental_full(struct Incremental* inc, double* solute_pos)
+{
+    /*
+     * Find the voxels blocked by the atoms at ``solute_pos``, and those that
+     * can be reached from voxel (0, 0, 0) by moves between neighboring voxels
+     * (including diagonal neighbors; 26 in total) that are accessible to
+     * solvent, from scratch. The voxels are blocked exactly when is_free
+     * returns False for them.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * inc: the state, made with newIncremental
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom, on the grid
+     *
+     * --------
+     * Returns
+     * -------
+     * 0 on success, 1 if memory could not be allocated.
+     */
+    double* p;
+    double cut;
+    int i, ix, iy, ix0, ix1, iy0, iy1, z0, z1;
+
+    memcpy(inc->pos, solute_pos, 3*(long)inc->nsolute*sizeof(double));
+    memset(inc->counts, 0,
+           (long)inc->nx*inc->ny*inc->nz*sizeof(unsigned short));
+    resizeBitGrid(inc->blocked, inc->nx, inc->ny, inc->nz);
+    inc->saturated = 0;
+    for (i = 0; i < inc->nsolute; i++){
+        p = inc->pos + 3*i;
+        cut = inc->rad[i] + inc->solvent_rad;
+        ix0 = (int)fmax(floor((p[0] - cut)/inc->voxel_len), 0);
+        ix1 = (int)fmin(ceil((p[0] + cut)/inc->voxel_len), inc->nx - 1);
+        iy0 = (int)fmax(floor((p[1] - cut)/inc->voxel_len), 0);
+        iy1 = (int)fmin(ceil((p[1] + cut)/inc->voxel_len), inc->ny - 1);
+        for (ix = ix0; ix <= ix1; ix++){
+            for (iy = iy0; iy <= iy1; iy++){
+                blocked_run(inc->voxel_len, inc->nz, ix, iy, p, cut, &z0, &z1);
+                if (add_run(inc, ix, iy, z0, z1, 1)){
+                    block_all(inc);
+                    goto filled;
+                }
+            }
+        }
+    }
+filled:
+    // every voxel counts as changed
+    memset(inc->bricks, 0, (long)inc->nbx*inc->nby*inc->nbz*sizeof(int));
+    inc->changed = (long)inc->nx*inc->ny*inc->nz;
+    inc->dirty_bricks = (long)inc->nbx*inc->nby*inc->nbz;
+    return refill(inc);
+}
+
+// The byte of row (x, y) of a grid that brick bz along z holds
+static inline unsigned int getbyte(struct BitGrid* bitgrid, int x, int y,
+                                   int bz)
+{
+    return (getrow(bitgrid, x, y)[bz >> 3] >> ((bz & 7)*8)) & 0xff;
+}
+
+static inline void setbyte(struct BitGrid* bitgrid, int x, int y, int bz,
+                           unsigned int byte)
+{
+    uint64_t* word = getrow(bitgrid, x, y) + (bz >> 3);
+    *word = (*word & ~((uint64_t)0xff << ((bz & 7)*8))) |
+            ((uint64_t)byte << ((bz & 7)*8));
+}
+
+// Bit (dx+1)*9 + (dy+1)*3 + (dz+1) of the result is set if brick
+// b + (dx, dy, dz) is in the grid, and its label in ``labels`` is k (with
+// ``equal``) or is not (without it)
+static unsigned int neighbors(struct Incremental* inc, long b, int* labels,
+                              int k, int equal)
+{
+    int bz = (int)(b % inc->nbz);
+    int by = (int)((b / inc->nbz) % inc->nby);
+    int bx = (int)(b / ((long)inc->nbz*inc->nby));
+    unsigned int mask = 0;
+    int dx, dy, dz, u, v, w;
+
+    for (dx=-1; dx<=1; dx++){
+        u = bx + dx;
+        for (dy=-1; dy<=1; dy++){
+            v = by + dy;
+            for (dz=-1; dz<=1; dz++){
+                w = bz + dz;
+                if ((u < 0) || (u >= inc->nbx) || (v < 0) || (v >= inc->nby) ||
+                    (w < 0) || (w >= inc->nbz)){
+                    continue;
+                }
+                if ((labels[((long)u*inc->nby + v)*inc->nbz + w] == k) ==
+                    equal){
+                    mask |= 1u << ((dx+1)*9 + (dy+1)*3 + (dz+1));
+                }
+            }
+        }
+    }
+    return mask;
+}
+
+// The voxels of row (lx, ly) of a brick, as a byte, that are next to one of
+// the bricks around it in ``mask`` (bits as in neighbors); all of them if the
+// brick itself is in the mask
+static unsigned int facing(int lx, int ly, unsigned int mask)
+{
+    unsigned int byte = 0;
+    int dx, dy, bit;
+
+    for (dx=-1; dx<=1; dx++){
+        if (((dx == -1) && (lx != 0)) || ((dx == 1) && (lx != BRICK_LEN - 1))){
+            continue;
+        }
+        for (dy=-1; dy<=1; dy++){
+            if (((dy == -1) && (ly != 0)) ||
+                ((dy == 1) && (ly != BRICK_LEN - 1))){
+                continue;
+            }
+            bit = (dx+1)*9 + (dy+1)*3;
+            if (mask & (1u << bit)){
+                byte |= 0x01;
+            }
+            if (mask & (1u << (bit + 1))){
+                byte |= 0xff;
+            }
+            if (mask & (1u << (bit + 2))){
+                byte |= 0x80;
+            }
+        }
+    }
+    return byte;
+}
+
+static int add_seed(struct Incremental* inc, long nseeds, int x, int y, int z)
+{
+    int* seeds;
+    if (nseeds >= inc->seed_capacity){
+        seeds = (int*)realloc(inc->seeds, 6*inc->seed_capacity*sizeof(int));
+        if (!seeds){
+            return 1;
+        }
+        inc->seeds = seeds;
+        inc->seed_capacity *= 2;
+    }
+    inc->seeds[3*nseeds] = x;
+    inc->seeds[3*nseeds + 1] = y;
+    inc->seeds[3*nseeds + 2] = z;
+    return 0;
+}
+
+// Redo the bricks labelled k (listed in inc->brick_stack[0...nk-1]) after the
+// atoms moved.
+//
+// The reached voxels in the bricks are cleared. The region around them is
+// the bricks next to them (the halo), less the voxels next to bricks further
+// out; those are blocked for the time being, so that a fill in inc->mark from
+// a reached voxel next to the bricks stays in the region. If it marks every
+// reached voxel next to the bricks, every path that went through the bricks
+// can go around the changes, so the reached voxels outside them still are.
+// Then the marked voxels in the bricks are reached, and the marked voxels in
+// the halo that were not reached yet are added to the seeds.
+//
+// Returns the new number of seeds, -1 if some reached voxel next to the bricks
+// was not marked (then some voxels may have been cut off from the rest), or
+// -2 if memory could not be allocated.
+static long redo_bricks(struct Incremental* inc, int nk, int k, long nseeds)
+{
+    unsigned char* saved = inc->saved;
+    long b, nb, start = -1;
+    int nh = 0;
+    int ib, ih, bx, by, bz, x, y, lx, ly, dx, dy, dz, u, v, w;
+    unsigned int inner, outer, fence, byte, g, m;
+    int connected = 1;
+    int seed[3];
+
+    // find the halo, and clear the bricks
+    for (ib = 0; ib < nk; ib++){
+        b = inc->brick_stack[ib];
+        bz = (int)(b % inc->nbz);
+        by = (int)((b / inc->nbz) % inc->nby);
+        bx = (int)(b / ((long)inc->nbz*inc->nby));
+        for (dx=-1; dx<=1; dx++){
+            u = bx + dx;
+            for (dy=-1; dy<=1; dy++){
+                v = by + dy;
+                for (dz=-1; dz<=1; dz++){
+                    w = bz + dz;
+                    if ((u < 0) || (u >= inc->nbx) || (v < 0) ||
+                        (v >= inc->nby) || (w < 0) || (w >= inc->nbz)){
+                        continue;
+                    }
+                    nb = ((long)u*inc->nby + v)*inc->nbz + w;
+                    if ((inc->bricks[nb] != k) && (inc->halo[nb] != k)){
+                        inc->halo[nb] = k;
+                        inc->halo_stack[nh++] = (int)nb;
+                    }
+                }
+            }
+        }
+        for (x = bx*BRICK_LEN; (x < (bx + 1)*BRICK_LEN) && (x < inc->nx); x++){
+            for (y = by*BRICK_LEN; (y < (by + 1)*BRICK_LEN) && (y < inc->ny);
+                 y++){
+                setbyte(inc->grid, x, y, bz, 0);
+            }
+        }
+    }
+
+    // fence the region in, and find a reached voxel next to the bricks. The
+    // neighbors of a voxel next to the bricks are all in the region, so none
+    // of those voxels are fenced off.
+    for (ih = 0; ih < nh; ih++){
+        b = inc->halo_stack[ih];
+        bz = (int)(b % inc->nbz);
+        by = (int)((b / inc->nbz) % inc->nby);
+        bx = (int)(b / ((long)inc->nbz*inc->nby));
+        inner = neighbors(inc, b, inc->bricks, k, 1);
+        outer = neighbors(inc, b, inc->halo, k, 0) & ~inner;
+        for (lx = 0; (lx < BRICK_LEN) && (bx*BRICK_LEN + lx < inc->nx); lx++){
+            x = bx*BRICK_LEN + lx;
+            for (ly = 0; (ly < BRICK_LEN) && (by*BRICK_LEN + ly < inc->ny);
+                 ly++){
+                y = by*BRICK_LEN + ly;
+                byte = getbyte(inc->blocked, x, y, bz);
+                saved[((long)ih*BRICK_LEN + lx)*BRICK_LEN + ly] =
+                    (unsigned char)byte;
+                fence = facing(lx, ly, outer);
+                if (fence){
+                    setbyte(inc->blocked, x, y, bz, byte | fence);
+                }
+                if (start < 0){
+                    g = getbyte(inc->grid, x, y, bz) & facing(lx, ly, inner);
+                    if (g){
+                        start = ((long)x*inc->ny + y)*inc->nz +
+                                bz*BRICK_LEN + __builtin_ctz(g);
+                    }
+                }
+            }
+        }
+    }
+
+    if (start >= 0){
+        seed[0] = (int)(start / ((long)inc->ny*inc->nz));
+        seed[1] = (int)((start / inc->nz) % inc->ny);
+        seed[2] = (int)(start % inc->nz);
+        if (floodfill_multi(seed, 1, inc->voxel_len, NULL, inc->mark, NULL,
+                            NULL, 0, 0, NULL, inc->blocked, inc->queue, NULL)){
+            return -2;
+        }
+    }
+
+    // take the fence down, check the voxels next to the bricks, collect the
+    // seeds and clear the marks
+    for (ih = 0; ih < nh; ih++){
+        b = inc->halo_stack[ih];
+        bz = (int)(b % inc->nbz);
+        by = (int)((b / inc->nbz) % inc->nby);
+        bx = (int)(b / ((long)inc->nbz*inc->nby));
+        inner = neighbors(inc, b, inc->bricks, k, 1);
+        for (lx = 0; (lx < BRICK_LEN) && (bx*BRICK_LEN + lx < inc->nx); lx++){
+            x = bx*BRICK_LEN + lx;
+            for (ly = 0; (ly < BRICK_LEN) && (by*BRICK_LEN + ly < inc->ny);
+                 ly++){
+                y = by*BRICK_LEN + ly;
+                setbyte(inc->blocked, x, y, bz,
+                        saved[((long)ih*BRICK_LEN + lx)*BRICK_LEN + ly]);
+                if (start < 0){
+                    continue;
+                }
+                g = getbyte(inc->grid, x, y, bz);
+                m = getbyte(inc->mark, x, y, bz);
+                if (g & facing(lx, ly, inner) & ~m){
+                    connected = 0;
+                }
+                m &= ~g;
+                while (connected && m){
+                    if (add_seed(inc, nseeds, x, y,
+                                 bz*BRICK_LEN + __builtin_ctz(m))){
+                        return -2;
+                    }
+                    nseeds++;
+                    m &= m - 1;
+                }
+                setbyte(inc->mark, x, y, bz, 0);
+            }
+        }
+    }
+    if (start < 0){
+        // nothing next to the bricks is reached, so nothing in them is
+        return nseeds;
+    }
+
+    // the marked voxels in the bricks are reached
+    for (ib = 0; ib < nk; ib++){
+        b = inc->brick_stack[ib];
+        bz = (int)(b % inc->nbz);
+        by = (int)((b / inc->nbz) % inc->nby);
+        bx = (int)(b / ((long)inc->nbz*inc->nby));
+        for (x = bx*BRICK_LEN; (x < (bx + 1)*BRICK_LEN) && (x < inc->nx); x++){
+            for (y = by*BRICK_LEN; (y < (by + 1)*BRICK_LEN) && (y < inc->ny);
+                 y++){
+                if (connected){
+                    setbyte(inc->grid, x, y, bz, getbyte(inc->mark, x, y, bz));
+                }
+                setbyte(inc->mark, x, y, bz, 0);
+            }
+        }
+    }
+    return connected ? nseeds : -1;
+}
+
+int incremental_update(struct Incremental* inc, double* solute_pos,
+                       double max_dirty)
+{
+    /*
+     * Move the atoms to ``solute_pos``, and update the voxels they block and
+     * those reached from voxel (0, 0, 0), to the same as incremental_full
+     * would find.
+     *
+     * Only the voxels where an atom's sphere moved are checked again, and
+     * only the bricks with voxels that became blocked or accessible are
+     * filled again (see redo_bricks). That is only the same as a full fill if
+     * the voxels reached around each group of touching bricks are still
+     * connected to each other around the changes. Otherwise, or if more than
+     * max_dirty (a fraction) of the bricks changed, the whole grid is filled
+     * again.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * inc: the state, after incremental_full
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom, on the grid
+     * max_dirty: fraction of the bricks that may change before the grid is
+     *     filled again from scratch
+     *
+     * --------
+     * Returns
+     * -------
+     * 0 if the fill was updated, 3 if the grid was filled again from scratch,
+     * 1 if memory could not be allocated.
+     */
+    long nbricks = (long)inc->nbx*inc->nby*inc->nbz;
+    long b, nb, nseeds = 0;
+    int i, k, nk, head, dx, dy, dz, u, v, w, bx, by, bz;
+
+    if (inc->saturated){
+        return incremental_full(inc, solute_pos) ? 1 : 3;
+    }
+    memset(inc->bricks, 0, nbricks*sizeof(int));
+    memset(inc->halo, 0, nbricks*sizeof(int));
+    inc->changed = 0;
+    inc->dirty_bricks = 0;
+    for (i = 0; i < inc->nsolute; i++){
+        if (move_atom(inc, i, solute_pos + 3*i)){
+            // the counts are no longer consistent
+            return incremental_full(inc, solute_pos) ? 1 : 3;
+        }
+    }
+    if (inc->dirty_bricks == 0){
+        return 0;
+    }
+    if ((inc->dirty_bricks > max_dirty*nbricks) || inc->bricks[0]){
+        return refill(inc) ? 1 : 3;
+    }
+
+    // group the changed bricks into sets of touching bricks (labelled 1, 2,
+    // ...), and redo each set
+    k = 0;
+    for (b = 0; b < nbricks; b++){
+        if (inc->bricks[b] != -1){
+            continue;
+        }
+        k++;
+        inc->bricks[b] = k;
+        inc->brick_stack[0] = (int)b;
+        nk = 1;
+        for (head = 0; head < nk; head++){
+            nb = inc->brick_stack[head];
+            bz = (int)(nb % inc->nbz);
+            by = (int)((nb / inc->nbz) % inc->nby);
+            bx = (int)(nb / ((long)inc->nbz*inc->nby));
+            for (dx=-1; dx<=1; dx++){
+                u = bx + dx;
+                for (dy=-1; dy<=1; dy++){
+                    v = by + dy;
+                    for (dz=-1; dz<=1; dz++){
+                        w = bz + dz;
+                        if ((u < 0) || (u >= inc->nbx) || (v < 0) ||
+                            (v >= inc->nby) || (w < 0) || (w >= inc->nbz)){
+                            continue;
+                        }
+                        nb = ((long)u*inc->nby + v)*inc->nbz + w;
+                        if (inc->bricks[nb] == -1){
+                            inc->bricks[nb] = k;
+                            inc->brick_stack[nk++] = (int)nb;
+                        }
+                    }
+                }
+            }
+        }
+        nseeds = redo_bricks(inc, nk, k, nseeds);
+        if (nseeds == -2){
+            return 1;
+        }
+        if (nseeds == -1){
+            return refill(inc) ? 1 : 3;
+        }
+    }
+    return floodfill_multi(inc->seeds, (int)nseeds, inc->voxel_len, NULL,
+                           inc->grid, NULL, NULL, 0, 0, NULL, inc->blocked,
+                           inc->queue, NULL);
+}
@@ -0,0 +1,396 @@
+#include "label.h"
+#include "floodfill3d.h"
+#include <stdlib.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+// Find the label of the component that run i belongs to, halving the path
+// on the way. Only call this while no other thread touches the same trees.
+long find_root(long* parent, long i)
+{
+    while (parent[i] != i){
+        parent[i] = parent[parent[i]];
+        i = parent[i];
+    }
+    return i;
+}
+
+void merge_runs(long* parent, long i, long j)
+{
+    i = find_root(parent, i);
+    j = find_root(parent, j);
+    // the smaller label always becomes the root, so parent[i] <= i
+    if (i < j){
+        parent[j] = i;
+    } else if (j < i){
+        parent[i] = j;
+    }
+}
+
+// First voxel from z on of a row that is accessible (if ``blocked`` is 0) or
+// blocked (if 1), or nz if there is none
+static int next_voxel(uint64_t* row, int z, int nz, int blocked)
+{
+    long w = z >> 6;
+    long nwords = (nz + 63) >> 6;
+    uint64_t bits;
+    if (z >= nz){
+        return nz;
+    }
+    bits = (blocked ? row[w] : ~row[w]) & (~(uint64_t)0 << (z & 63));
+    while (!bits){
+        if (++w >= nwords){
+            return nz;
+        }
+        bits = blocked ? row[w] : ~row[w];
+    }
+    z = (int)(64*w + __builtin_ctzll(bits));
+    return (z < nz) ? z : nz;
+}
+
+// Count the runs of accessible voxels of a row, and store them if z0 is not
+// NULL
+long row_runs(uint64_t* row, int nz, unsigned short* z0, unsigned short* z1)
+{
+    long n = 0;
+    int a, b = 0;
+    while ((a = next_voxel(row, b, nz, 0)) < nz){
+        b = next_voxel(row, a, nz, 1);
+        if (z0){
+            z0[n] = (unsigned short)a;
+            z1[n] = (unsigned short)(b - 1);
+        }
+        n++;
+    }
+    return n;
+}
+
+// Merge the runs of row a with those of row b, where the rows are neighbors.
+// Runs are connected if they overlap after extending one of them by a voxel
+// on either end (for diagonal moves).
+void merge_rows(struct Runs* runs, long a, long b)
+{
+    long i = runs->rowstart[a];
+    long j = runs->rowstart[b];
+    long iend = runs->rowstart[a+1];
+    long jend = runs->rowstart[b+1];
+    while ((i < iend) && (j < jend)){
+        if ((runs->z0[i] <= runs->z1[j] + 1) && (runs->z0[j] <= runs->z1[i] + 1)){
+            merge_runs(runs->parent, i, j);
+        }
+        // advance whichever run ends first
+        if (runs->z1[i] < runs->z1[j]){
+            i++;
+        } else {
+            j++;
+        }
+    }
+}
+
+// Merge the runs of plane x with those of the neighboring rows in planes x
+// and x-1
+void merge_plane(struct Runs* runs, int x, int ny)
+{
+    int y, dy;
+    for (y=0; y<ny; y++){
+        if (y > 0){
+            merge_rows(runs, (long)x*ny + y, (long)x*ny + y - 1);
+        }
+        if (x > 0){
+            for (dy=-1; dy<=1; dy++){
+                if ((y + dy >= 0) && (y + dy < ny)){
+                    merge_rows(runs, (long)x*ny + y, (long)(x-1)*ny + y + dy);
+                }
+            }
+        }
+    }
+}
+
+// Find run of row (x, y) containing voxel z, or -1 if the voxel is blocked
+// or outside the grid
+long find_run(struct Runs* runs, int nx, int ny, int nz, int x, int y, int z)
+{
+    long lo, hi, mid;
+    if ((x < 0) || (x >= nx) || (y < 0) || (y >= ny) || (z < 0) || (z >= nz)){
+        return -1;
+    }
+    lo = runs->rowstart[(long)x*ny + y];
+    hi = runs->rowstart[(long)x*ny + y + 1];
+    while (lo < hi){
+        mid = (lo + hi)/2;
+        if (runs->z1[mid] < z){
+            lo = mid + 1;
+        } else {
+            hi = mid;
+        }
+    }
+    if ((lo < runs->rowstart[(long)x*ny + y + 1]) && (runs->z0[lo] <= z)){
+        return lo;
+    }
+    return -1;
+}
+
+int floodfill_parallel(int* seeds, int nseeds, double voxel_len,
+                       struct BitGrid* grid, double* solute_pos,
+                       double* solute_rad, int nsolute, double solvent_rad,
+                       struct CellList* cells, struct BitGrid* blocked,
+                       int nthreads, struct FillStats* stats)
+{
+    /*
+     * Add every voxel that can be reached from any of the seed voxels by moves
+     * between neighboring voxels (including diagonal neighbors; 26 in total)
+     * that are accessible to solvent to ``grid``, using ``nthreads`` threads.
+     * The result is the same as calling floodfill for every seed.
+     *
+     * Instead of a flood fill, this labels all connected components of
+     * accessible voxels: every thread finds the runs of accessible voxels
+     * along z in a slab of the grid, and merges connected runs within its
+     * slab (union-find). Runs at the boundaries between slabs are merged
+     * afterwards, and the components that contain a seed are added to
+     * ``grid``.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * seeds: shape (nseeds, 3) array; (x,y,z) indices of the seed voxels
+     * nseeds: number of seed voxels
+     * voxel_len: edge length of (cubic) voxel
+     * grid: shape (nx, ny, nz) grid of bits; 1 if accessible by moves on
+     *     solvent; 0 otherwise
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * cells: cell list built over the solute atoms with newCellList, or NULL
+     *     to check every solute atom for each voxel
+     * blocked: shape (nx, ny, nz) grid of bits, all zero; if not NULL, the
+     *     blocked voxels are found with rasterize instead of checking every
+     *     voxel against the solute atoms.
+     * nthreads: number of threads to use; 0 to use the OpenMP default
+     * stats: counters to add to, or NULL
+     *
+     * --------
+     * Returns
+     * -------
+     * 0 on success, 1 if memory could not be allocated.
+     */
+    int nx = grid->nx;
+    int ny = grid->ny;
+    int nz = grid->nz;
+    long nrows = (long)nx*ny;
+    long nruns, i, r;
+    long nchecked = 0;
+    int nslabs, slab;
+    int* slabstart;
+    unsigned char* reached;
+    struct Runs runs;
+    struct BitGrid* blocked_grid = blocked;
+    int x, y, z, dy, inrun;
+    uint64_t* row;
+    uint64_t* gridrow;
+
+#ifdef _OPENMP
+    if (nthreads <= 0){
+        nthreads = omp_get_max_threads();
+    }
+#else
+    nthreads = 1;
+#endif
+    // one slab of planes for each thread
+    nslabs = (nthreads < nx) ? nthreads : nx;
+    slabstart = (int*)malloc((nslabs+1)*sizeof(int));
+    if (!slabstart){
+        return 1;
+    }
+    for (slab=0; slab<=nslabs; slab++){
+        slabstart[slab] = (int)(((long)slab*nx)/nslabs);
+    }
+
+    // Find the voxels that are not accessible to solvent. Rows never share a
+    // word, so threads may fill in different planes at the same time.
+    if (blocked){
+        #pragma omp parallel for num_threads(nthreads) schedule(static, 1) reduction(+:nchecked)
+        for (slab=0; slab<nslabs; slab++){
+            rasterize_slab(voxel_len, blocked, solute_pos, solute_rad, nsolute,
+                           solvent_rad, slabstart[slab], slabstart[slab+1],
+                           stats ? &nchecked : NULL);
+        }
+    } else {
+        blocked_grid = newBitGrid(nx, ny, nz);
+        if (!blocked_grid){
+            free(slabstart);
+            return 1;
+        }
+        #pragma omp parallel for num_threads(nthreads) schedule(dynamic) private(y, z) reduction(+:nchecked)
+        for (x=0; x<nx; x++){
+            for (y=0; y<ny; y++){
+                for (z=0; z<nz; z++){
+                    if (cells ? !is_free_cells(x*voxel_len, y*voxel_len, z*voxel_len,
+                                               cells, solvent_rad,
+                                               stats ? &nchecked : NULL)
+                              : !is_free(x*voxel_len, y*voxel_len, z*voxel_len,
+                                         solute_pos, solute_rad, nsolute,
+                                         solvent_rad,
+                                         stats ? &nchecked : NULL)){
+                        setbit(blocked_grid, x, y, z);
+                    }
+                }
+            }
+        }
+    }
+    if (stats){
+        stats->distance_evals += nchecked;
+        stats->visited += nrows*nz;
+        if (!blocked){
+            stats->is_free_calls += nrows*nz;
+            stats->bytes += blocked_grid->capacity*sizeof(uint64_t);
+        }
+    }
+
+    // Count the runs in each row, then make room for them
+    runs.rowstart = (long*)malloc((nrows+1)*sizeof(long));
+    if (!runs.rowstart){
+        free(slabstart);
+        if (!blocked){
+            delBitGrid(blocked_grid);
+        }
+        return 1;
+    }
+    runs.rowstart[0] = 0;
+    #pragma omp parallel for num_threads(nthreads) schedule(static) private(y, z, row, inrun)
+    for (x=0; x<nx; x++){
+        for (y=0; y<ny; y++){
+            row = getrow(blocked_grid, x, y);
+            runs.rowstart[(long)x*ny + y + 1] = 0;
+            inrun = 0;
+            for (z=0; z<nz; z++){
+                if (!((row[z >> 6] >> (z & 63)) & 1)){
+                    if (!inrun){
+                        runs.rowstart[(long)x*ny + y + 1]++;
+                    }
+                    inrun = 1;
+                } else {
+                    inrun = 0;
+                }
+            }
+        }
+    }
+    for (r=0; r<nrows; r++){
+        runs.rowstart[r+1] += runs.rowstart[r];
+    }
+    nruns = runs.rowstart[nrows];
+    runs.z0 = (unsigned short*)malloc((nruns+1)*sizeof(unsigned short));
+    runs.z1 = (unsigned short*)malloc((nruns+1)*sizeof(unsigned short));
+    runs.parent = (long*)malloc((nruns+1)*sizeof(long));
+    reached = (unsigned char*)calloc(nruns+1, sizeof(unsigned char));
+    if ((!runs.z0) || (!runs.z1) || (!runs.parent) || (!reached)){
+        free(runs.rowstart);
+        free(runs.z0);
+        free(runs.z1);
+        free(runs.parent);
+        free(reached);
+        free(slabstart);
+        if (!blocked){
+            delBitGrid(blocked_grid);
+        }
+        return 1;
+    }
+
+    // Find the runs
+    #pragma omp parallel for num_threads(nthreads) schedule(static) private(y, z, row, inrun, r)
+    for (x=0; x<nx; x++){
+        for (y=0; y<ny; y++){
+            row = getrow(blocked_grid, x, y);
+            r = runs.rowstart[(long)x*ny + y];
+            inrun = 0;
+            for (z=0; z<nz; z++){
+                if (!((row[z >> 6] >> (z & 63)) & 1)){
+                    if (!inrun){
+                        runs.z0[r] = (unsigned short)z;
+                        runs.parent[r] = r;
+                        inrun = 1;
+                    }
+                    runs.z1[r] = (unsigned short)z;
+                } else if (inrun){
+                    r++;
+                    inrun = 0;
+                }
+            }
+        }
+    }
+    if (!blocked){
+        delBitGrid(blocked_grid);
+    }
+
+    // Merge connected runs within each slab of planes, then across the slab
+    // boundaries
+    #pragma omp parallel for num_threads(nthreads) schedule(static, 1) private(x, y)
+    for (slab=0; slab<nslabs; slab++){
+        for (x=slabstart[slab]; x<slabstart[slab+1]; x++){
+            if (x == slabstart[slab]){
+                // only merge within the plane for now
+                for (y=1; y<ny; y++){
+                    merge_rows(&runs, (long)x*ny + y, (long)x*ny + y - 1);
+                }
+            } else {
+                merge_plane(&runs, x, ny);
+            }
+        }
+    }
+    for (slab=1; slab<nslabs; slab++){
+        x = slabstart[slab];
+        for (y=0; y<ny; y++){
+            for (dy=-1; dy<=1; dy++){
+                if ((y + dy >= 0) && (y + dy < ny)){
+                    merge_rows(&runs, (long)x*ny + y, (long)(x-1)*ny + y + dy);
+                }
+            }
+        }
+    }
+
+    // Point every run directly at the root of its tree; since parent[r] <= r,
+    // a single pass in order suffices.
+    for (r=0; r<nruns; r++){
+        runs.parent[r] = runs.parent[runs.parent[r]];
+    }
+
+    // Mark the components containing a seed, and add them to the grid
+    for (i=0; i<nseeds; i++){
+        r = find_run(&runs, nx, ny, nz, seeds[3*i], seeds[3*i+1], seeds[3*i+2]);
+        if (r >= 0){
+            if (stats && !reached[runs.parent[r]]){
+                stats->fills++;
+            }
+            reached[runs.parent[r]] = 1;
+        }
+    }
+    if (stats){
+        stats->seeds += nseeds;
+        stats->bytes += (nslabs+1)*sizeof(int) + (nrows+1)*sizeof(long) +
+                        (nruns+1)*(2*sizeof(unsigned short) + sizeof(long) +
+                                   sizeof(unsigned char));
+    }
+    #pragma omp parallel for num_threads(nthreads) schedule(static) private(y, z, r, gridrow)
+    for (x=0; x<nx; x++){
+        for (y=0; y<ny; y++){
+            gridrow = getrow(grid, x, y);
+            for (r=runs.rowstart[(long)x*ny + y]; r<runs.rowstart[(long)x*ny + y + 1]; r++){
+                if (reached[runs.parent[r]]){
+                    for (z=runs.z0[r]; z<=runs.z1[r]; z++){
+                        gridrow[z >> 6] |= (uint64_t)1 << (z & 63);
+                    }
+                }
+            }
+        }
+    }
+
+    free(runs.rowstart);
+    free(runs.z0);
+    free(runs.z1);
+    free(runs.parent);
+    free(reached);
+    free(slabstart);
+    return 0;
+}
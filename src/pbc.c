@@ -0,0 +1,267 @@
+#include "pbc.h"
+#include "batch.h"
+#include "label.h"
+#include <math.h>
+#include <stdlib.h>
+
+// i modulo n, from 0 to n-1
+static inline long wrap(long i, long n)
+{
+    i %= n;
+    return (i < 0) ? i + n : i;
+}
+
+// Mark the voxels of a periodic grid with voxel edges h that are closer than
+// ``cut`` to any image of an atom at p. The voxels of a row that one image
+// blocks form a run, which is found by trimming the run around the sphere's
+// crossing of the row with the exact test; it may wrap around the ends of
+// the row.
+static long rasterize_periodic(struct BitGrid* blocked, double* h, double* p,
+                               double cut)
+{
+    double lo2 = cut*cut*(1 - BAND);
+    double hi2 = cut*cut*(1 + BAND);
+    double dx, dy, dxy2, zcut;
+    long ix, iy, ix0, ix1, iy0, iy1, n = 0;
+    int lo, hi, z0, z1, nz = blocked->nz;
+    uint64_t* row;
+
+    ix0 = (long)floor((p[0] - cut)/h[0]);
+    ix1 = (long)ceil((p[0] + cut)/h[0]);
+    iy0 = (long)floor((p[1] - cut)/h[1]);
+    iy1 = (long)ceil((p[1] + cut)/h[1]);
+    for (ix=ix0; ix<=ix1; ix++){
+        dx = p[0] - ix*h[0];
+        for (iy=iy0; iy<=iy1; iy++){
+            dy = p[1] - iy*h[1];
+            dxy2 = dx*dx + dy*dy;
+            n++;
+            if (dxy2 >= hi2){
+                continue;
+            }
+            zcut = sqrt(fmax(cut*cut - dxy2, 0));
+            lo = (int)floor((p[2] - zcut)/h[2]) - 1;
+            hi = (int)ceil((p[2] + zcut)/h[2]) + 1;
+            while ((lo <= hi) && !blocks(h[2], lo, p[2], dxy2, cut, lo2, hi2)){
+                lo++;
+            }
+            while ((hi >= lo) && !blocks(h[2], hi, p[2], dxy2, cut, lo2, hi2)){
+                hi--;
+            }
+            if (lo > hi){
+                continue;
+            }
+            row = getrow(blocked, (int)wrap(ix, blocked->nx),
+                         (int)wrap(iy, blocked->ny));
+            if (hi - lo + 1 >= nz){
+                setrun(row, 0, nz - 1);
+                continue;
+            }
+            z0 = (int)wrap(lo, nz);
+            z1 = (int)wrap(hi, nz);
+            if (z0 <= z1){
+                setrun(row, z0, z1);
+            } else {
+                setrun(row, z0, nz - 1);
+                setrun(row, 0, z1);
+            }
+        }
+    }
+    return n;
+}
+
+// Merge the runs of rows a and b (which may be the same row) that touch
+// across the ends of the rows, from voxel nz-1 to voxel 0
+static void merge_wrapped(struct Runs* runs, long a, long b, int nz)
+{
+    long afirst = runs->rowstart[a], alast = runs->rowstart[a+1] - 1;
+    long bfirst = runs->rowstart[b], blast = runs->rowstart[b+1] - 1;
+    if ((afirst > alast) || (bfirst > blast)){
+        return;
+    }
+    if ((runs->z0[afirst] == 0) && (runs->z1[blast] == nz - 1)){
+        merge_runs(runs->parent, afirst, blast);
+    }
+    if ((runs->z0[bfirst] == 0) && (runs->z1[alast] == nz - 1)){
+        merge_runs(runs->parent, bfirst, alast);
+    }
+}
+
+// Merge the runs of neighboring rows a and b of a periodic grid
+static void merge_neighbors(struct Runs* runs, long a, long b, int nz)
+{
+    merge_rows(runs, a, b);
+    merge_wrapped(runs, a, b, nz);
+}
+
+long floodfill_periodic(int* seeds, int nseeds, double* cell,
+                        double* solute_pos, double* solute_rad, int nsolute,
+                        double solvent_rad, struct BitGrid* blocked,
+                        struct BitGrid* grid, struct FillStats* stats)
+{
+    /*
+     * Count the voxels of a periodic grid that can be reached from any of the
+     * seed voxels by moves between neighboring voxels (including diagonal
+     * neighbors; 26 in total) that are accessible to solvent, where moves
+     * across a face of the grid come back in on the opposite face. Without
+     * seeds (NULL), the largest connected region of accessible voxels counts
+     * as reached instead: in a periodic box there is no corner outside the
+     * solute to start from, and the solvent around the solute is the largest
+     * region unless the solute fills most of the box.
+     *
+     * The grid covers an orthorhombic cell; voxel (x, y, z) is centered at
+     * (x*cell[0]/nx, y*cell[1]/ny, z*cell[2]/nz). A voxel is blocked if it is
+     * closer than solute_rad + solvent_rad to any periodic image of a solute
+     * atom. As in floodfill_parallel, the runs of accessible voxels along z
+     * are labelled by connected component, with the neighbors of the rows on
+     * the faces of the grid taken from the opposite faces, and the first and
+     * last voxels of each row next to each other.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * seeds: shape (nseeds, 3) array; (x,y,z) indices of the seed voxels, or
+     *     NULL to take the largest region. Seeds that are blocked or outside
+     *     the grid are skipped.
+     * nseeds: number of seed voxels
+     * cell: (3,) array; edge lengths of the cell
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom, in the cell or in any of its images
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * blocked: shape (nx, ny, nz) grid of bits, all zero, for the blocked
+     *     voxels; nz at most 65535
+     * grid: shape (nx, ny, nz) grid of bits, all zero; set to 1 where a voxel
+     *     is reached
+     * stats: counters to add to, or NULL
+     *
+     * --------
+     * Returns
+     * -------
+     * The number of voxels reached, or -1 if memory could not be allocated.
+     */
+    int nx = blocked->nx;
+    int ny = blocked->ny;
+    int nz = blocked->nz;
+    long nrows = (long)nx*ny;
+    long nruns, r, i, best = -1, count = 0, nchecked = 0;
+    long* size;
+    unsigned char* reached;
+    struct Runs runs;
+    double h[3];
+    int x, y, dy;
+
+    h[0] = cell[0]/nx;
+    h[1] = cell[1]/ny;
+    h[2] = cell[2]/nz;
+    for (i=0; i<nsolute; i++){
+        nchecked += rasterize_periodic(blocked, h, solute_pos + 3*i,
+                                       solute_rad[i] + solvent_rad);
+    }
+
+    // find the runs
+    runs.rowstart = (long*)malloc((nrows+1)*sizeof(long));
+    if (!runs.rowstart){
+        return -1;
+    }
+    runs.rowstart[0] = 0;
+    for (r=0; r<nrows; r++){
+        runs.rowstart[r+1] = runs.rowstart[r] +
+            row_runs(getrow(blocked, r/ny, r%ny), nz, NULL, NULL);
+    }
+    nruns = runs.rowstart[nrows];
+    runs.z0 = (unsigned short*)malloc((nruns+1)*sizeof(unsigned short));
+    runs.z1 = (unsigned short*)malloc((nruns+1)*sizeof(unsigned short));
+    runs.parent = (long*)malloc((nruns+1)*sizeof(long));
+    size = (long*)calloc(nruns+1, sizeof(long));
+    reached = (unsigned char*)calloc(nruns+1, sizeof(unsigned char));
+    if ((!runs.z0) || (!runs.z1) || (!runs.parent) || (!size) || (!reached)){
+        free(runs.rowstart);
+        free(runs.z0);
+        free(runs.z1);
+        free(runs.parent);
+        free(size);
+        free(reached);
+        return -1;
+    }
+    for (r=0; r<nrows; r++){
+        row_runs(getrow(blocked, r/ny, r%ny), nz,
+                 runs.z0 + runs.rowstart[r], runs.z1 + runs.rowstart[r]);
+    }
+    for (r=0; r<nruns; r++){
+        runs.parent[r] = r;
+    }
+
+    // Merge every row with itself (across the ends of the row) and with the
+    // neighboring rows before it, wrapping around the faces of the grid
+    for (x=0; x<nx; x++){
+        for (y=0; y<ny; y++){
+            r = (long)x*ny + y;
+            merge_wrapped(&runs, r, r, nz);
+            merge_neighbors(&runs, r, (long)x*ny + wrap(y - 1, ny), nz);
+            for (dy=-1; dy<=1; dy++){
+                merge_neighbors(&runs, r, wrap(x - 1, nx)*ny + wrap(y + dy, ny),
+                                nz);
+            }
+        }
+    }
+    // since parent[r] <= r, a single pass in order flattens the trees
+    for (r=0; r<nruns; r++){
+        runs.parent[r] = runs.parent[runs.parent[r]];
+    }
+
+    // Mark the components containing a seed, or the largest one
+    if (seeds){
+        for (i=0; i<nseeds; i++){
+            r = find_run(&runs, nx, ny, nz, seeds[3*i], seeds[3*i+1],
+                         seeds[3*i+2]);
+            if (r >= 0){
+                if (stats && !reached[runs.parent[r]]){
+                    stats->fills++;
+                }
+                reached[runs.parent[r]] = 1;
+            }
+        }
+    } else {
+        for (r=0; r<nruns; r++){
+            size[runs.parent[r]] += runs.z1[r] - runs.z0[r] + 1;
+            if ((best < 0) || (size[runs.parent[r]] > size[best])){
+                best = runs.parent[r];
+            }
+        }
+        if (best >= 0){
+            reached[best] = 1;
+            if (stats){
+                stats->fills++;
+            }
+        }
+    }
+    for (x=0; x<nx; x++){
+        for (y=0; y<ny; y++){
+            i = (long)x*ny + y;
+            for (r=runs.rowstart[i]; r<runs.rowstart[i+1]; r++){
+                if (reached[runs.parent[r]]){
+                    setrun(getrow(grid, x, y), runs.z0[r], runs.z1[r]);
+                    count += runs.z1[r] - runs.z0[r] + 1;
+                }
+            }
+        }
+    }
+    if (stats){
+        stats->seeds += nseeds;
+        stats->visited += nrows*nz;
+        stats->distance_evals += nchecked;
+        stats->bytes += (nrows+1)*sizeof(long) +
+                        (nruns+1)*(2*sizeof(unsigned short) + 2*sizeof(long) +
+                                   sizeof(unsigned char));
+    }
+
+    free(runs.rowstart);
+    free(runs.z0);
+    free(runs.z1);
+    free(runs.parent);
+    free(size);
+    free(reached);
+    return count;
+}
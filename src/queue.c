@@ -1,25 +1,27 @@
 #include "queue.h"
 #include <stdlib.h>
-#include <stdio.h>
+#include <string.h>
 
-// Make a new queue with maximum capacity of ``capacity`` Triples
+// Make a new queue with initial capacity of ``capacity`` Spans. The queue
+// grows as needed when items are appended. Returns NULL if memory could not
+// be allocated.
 struct Queue* newQueue(unsigned long capacity)
 {
     struct Queue* queue = (struct Queue*)malloc(sizeof(struct Queue));
     if (!queue) {
-        printf("Memory error. Failed to allocate memory.");
-        exit(1);
+        return NULL;
+    }
+    if (capacity < 1){
+        capacity = 1;
     }
     queue->front = 0;
     queue->size = 0;
     queue->rear = 0;
     queue->capacity = capacity;
-    queue->items = (struct Triple*)malloc(capacity*sizeof(struct Triple));
-    // check if pointer is null
+    queue->items = (struct Span*)malloc(capacity*sizeof(struct Span));
     if (!queue->items){
-        printf("Failed to allocate memory for queue; requested %lu bytes\n", 
-               capacity*sizeof(struct Triple));
-        exit(1);
+        free(queue);
+        return NULL;
     }
     return queue;
 }
@@ -51,24 +53,43 @@ int isEmpty(struct Queue* queue)
     
 }
 
-// Add a Triple to the queue
-int append(struct Triple coords, struct Queue* queue)
+// Double the capacity of a full queue
+static int grow(struct Queue* queue)
+{
+    unsigned long capacity = 2*queue->capacity;
+    struct Span* items = (struct Span*)realloc(queue->items,
+                                                   capacity*sizeof(struct Span));
+    if (!items){
+        return 1;
+    }
+    // The queue is full, so the items run from ``front`` to the end of the
+    // old array and then wrap around to ``front-1``; move the wrapped part
+    // after the end of the old array.
+    memcpy(items + queue->capacity, items, queue->front*sizeof(struct Span));
+    queue->rear = queue->capacity + queue->front;
+    queue->items = items;
+    queue->capacity = capacity;
+    return 0;
+}
+
+// Add a Span to the queue
+int append(struct Span span, struct Queue* queue)
 {
-    if (isFull(queue)){
-        return 1; // error; queue is full
+    if (isFull(queue) && grow(queue)){
+        return 1; // error; failed to allocate more memory
     }
     // Add the item to the rear of the queue
     // wrapping around to the beginning of the array if need be
-    queue->items[queue->rear % queue->capacity]  = coords;
+    queue->items[queue->rear % queue->capacity]  = span;
     queue->rear = (queue->rear+1) % queue->capacity;
     queue->size += 1;
     return 0;
 }
 
 // Always check that the queue is not empty before calling this!
-struct Triple pop(struct Queue* queue)
+struct Span pop(struct Queue* queue)
 {
-    struct Triple item = queue->items[queue->front];
+    struct Span item = queue->items[queue->front];
     queue->front = (queue->front+1)%(queue->capacity);
     if (queue->size > 0){
         queue->size -= 1;
@@ -12,7 +12,8 @@ ext_modules=[
         libraries=["m", "floodfill3d"],
         library_dirs=[floodfilldir],
         include_dirs=[include_dir],
-        extra_compile_args=["-O3"]
+        extra_compile_args=["-O3", "-fopenmp"],
+        extra_link_args=["-fopenmp"]
     )
 ]
 
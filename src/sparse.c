@@ -0,0 +1,580 @@
+#include "sparse.h"
+#include "floodfill3d.h"
+#include <math.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+// States of a brick, for bricks that are not stored voxel by voxel. Bricks
+// with index >= 0 are "mixed": they hold both accessible and blocked voxels,
+// and index their masks in the pool.
+#define BLOCKED -1
+#define FREE -2
+#define FILLED -3  // free brick that has been added to the accessible region
+
+// bits of the voxels with z = 0 and z = 7 in a plane of a brick
+#define Z0 0x0101010101010101ULL
+#define Z7 0x8080808080808080ULL
+
+// Atoms whose distance to a box of voxels is this much more (less) than the
+// cutoff are taken to miss (cover) all the voxels in it, without checking the
+// voxels one by one. The margin covers the rounding of dist().
+#define MARGIN 1e-7
+
+// The grid split into bricks of BRICK^3 voxels. Word x of the mask of a brick
+// holds plane x of the brick; bit 8*y + z of the word is voxel (x, y, z).
+struct Bricks
+{
+    int nx, ny, nz;
+    int nbx, nby, nbz;
+    int* index;
+    // masks of the mixed bricks: 8 words each for the accessible voxels
+    // (``free``) and for the voxels that have been reached (``filled``)
+    long nmixed, capacity;
+    uint64_t* free;
+    uint64_t* filled;
+    unsigned char* queued;
+    // stack of bricks waiting to spread to their neighbors
+    long nstack, stackcapacity;
+    long* stack;
+};
+
+struct Classify
+{
+    struct Bricks* bricks;
+    double voxel_len;
+    double* solute_pos;
+    double* solute_rad;
+    int nsolute;
+    double solvent_rad;
+    // candidate atoms for each level of the recursion
+    int* atoms;
+    struct FillStats* stats;
+};
+
+static long brick_index(struct Bricks* b, int bx, int by, int bz)
+{
+    return ((long)bx*b->nby + by)*b->nbz + bz;
+}
+
+// mask of the voxels of brick (bx, by, bz) that lie inside the grid
+static void ingrid_mask(struct Bricks* b, int bx, int by, int bz, uint64_t* mask)
+{
+    int xs = b->nx - BRICK*bx;
+    int ys = b->ny - BRICK*by;
+    int zs = b->nz - BRICK*bz;
+    uint64_t row, plane = 0;
+    int x, y;
+    xs = (xs < BRICK) ? xs : BRICK;
+    ys = (ys < BRICK) ? ys : BRICK;
+    zs = (zs < BRICK) ? zs : BRICK;
+    row = (zs == BRICK) ? 0xFF : (((uint64_t)1 << zs) - 1);
+    for (y=0; y<ys; y++){
+        plane |= row << (8*y);
+    }
+    for (x=0; x<BRICK; x++){
+        mask[x] = (x < xs) ? plane : 0;
+    }
+}
+
+// Dilate ``in`` by one voxel in every direction (26 neighbors), and keep the
+// part that falls into the brick at offset (dx, dy, dz) from it
+static void spill(uint64_t* in, int dx, int dy, int dz, uint64_t* out)
+{
+    uint64_t m[BRICK];
+    int x;
+    for (x=0; x<BRICK; x++){
+        // along z
+        if (dz == 0){
+            m[x] = in[x] | ((in[x] << 1) & ~Z0) | ((in[x] >> 1) & ~Z7);
+        } else if (dz > 0){
+            m[x] = (in[x] & Z7) >> 7;
+        } else {
+            m[x] = (in[x] & Z0) << 7;
+        }
+        // along y
+        if (dy == 0){
+            m[x] = m[x] | (m[x] << 8) | (m[x] >> 8);
+        } else if (dy > 0){
+            m[x] = m[x] >> 56;
+        } else {
+            m[x] = m[x] << 56;
+        }
+    }
+    // along x
+    for (x=0; x<BRICK; x++){
+        out[x] = 0;
+    }
+    if (dx == 0){
+        for (x=0; x<BRICK; x++){
+            out[x] = m[x];
+            if (x > 0) out[x] |= m[x-1];
+            if (x < BRICK-1) out[x] |= m[x+1];
+        }
+    } else if (dx > 0){
+        out[0] = m[BRICK-1];
+    } else {
+        out[BRICK-1] = m[0];
+    }
+}
+
+static void set_bricks(struct Bricks* b, int bx0, int bx1, int by0, int by1,
+                       int bz0, int bz1, int state)
+{
+    int bx, by, bz;
+    for (bx=bx0; bx<bx1; bx++){
+        for (by=by0; by<by1; by++){
+            for (bz=bz0; bz<bz1; bz++){
+                b->index[brick_index(b, bx, by, bz)] = state;
+            }
+        }
+    }
+}
+
+// Make room for one more mixed brick; returns 1 if memory could not be
+// allocated
+static int grow_pool(struct Bricks* b)
+{
+    long capacity;
+    uint64_t* words;
+    unsigned char* queued;
+    if (b->nmixed < b->capacity){
+        return 0;
+    }
+    capacity = 2*b->capacity + 64;
+    words = (uint64_t*)realloc(b->free, capacity*BRICK*sizeof(uint64_t));
+    if (!words){
+        return 1;
+    }
+    b->free = words;
+    words = (uint64_t*)realloc(b->filled, capacity*BRICK*sizeof(uint64_t));
+    if (!words){
+        return 1;
+    }
+    b->filled = words;
+    queued = (unsigned char*)realloc(b->queued, capacity*sizeof(unsigned char));
+    if (!queued){
+        return 1;
+    }
+    b->queued = queued;
+    b->capacity = capacity;
+    return 0;
+}
+
+// Check the voxels of brick (bx, by, bz) one by one, against the candidate
+// atoms; returns 1 if memory could not be allocated
+static int mix_brick(struct Classify* c, int bx, int by, int bz, int* cand,
+                     int ncand)
+{
+    struct Bricks* b = c->bricks;
+    uint64_t mask[BRICK], ingrid[BRICK];
+    uint64_t any = 0, all = 1;
+    double voxx, voxy, voxz, solx, soly, solz, cut;
+    int x, y, z, i, iatom;
+    long ncalls = 0, nchecked = 0;
+    char check;
+
+    ingrid_mask(b, bx, by, bz, ingrid);
+    for (x=0; x<BRICK; x++){
+        mask[x] = 0;
+        for (y=0; y<BRICK; y++){
+            for (z=0; z<BRICK; z++){
+                if (!((ingrid[x] >> (8*y + z)) & 1)){
+                    continue;
+                }
+                voxx = (BRICK*bx + x)*c->voxel_len;
+                voxy = (BRICK*by + y)*c->voxel_len;
+                voxz = (BRICK*bz + z)*c->voxel_len;
+                // the same check as is_free
+                check = 1;
+                ncalls++;
+                for (i=0; i<ncand; i++){
+                    iatom = cand[i];
+                    solx = c->solute_pos[3*iatom];
+                    soly = c->solute_pos[3*iatom + 1];
+                    solz = c->solute_pos[3*iatom + 2];
+                    cut = c->solute_rad[iatom] + c->solvent_rad;
+                    if ((fabs(solx - voxx)>cut) || (fabs(soly - voxy) > cut) || (fabs(solz - voxz) > cut)){
+                        continue;
+                    }
+                    else if (dist(voxx, voxy, voxz, solx, soly, solz) < cut) {
+                        check = 0;
+                        break;
+                    }
+                }
+                nchecked += check ? ncand : i + 1;
+                if (check){
+                    mask[x] |= (uint64_t)1 << (8*y + z);
+                }
+            }
+        }
+        any |= mask[x];
+        all &= (mask[x] == ingrid[x]);
+    }
+    if (c->stats){
+        c->stats->is_free_calls += ncalls;
+        c->stats->distance_evals += nchecked;
+    }
+
+    // only keep the masks of bricks that really are mixed
+    if (!any){
+        b->index[brick_index(b, bx, by, bz)] = BLOCKED;
+    } else if (all){
+        b->index[brick_index(b, bx, by, bz)] = FREE;
+    } else {
+        if (grow_pool(b)){
+            return 1;
+        }
+        memcpy(b->free + BRICK*b->nmixed, mask, BRICK*sizeof(uint64_t));
+        memset(b->filled + BRICK*b->nmixed, 0, BRICK*sizeof(uint64_t));
+        b->queued[b->nmixed] = 0;
+        b->index[brick_index(b, bx, by, bz)] = (int)b->nmixed;
+        b->nmixed++;
+    }
+    return 0;
+}
+
+// Classify the bricks [bx0, bx1) x [by0, by1) x [bz0, bz1), given the atoms
+// that may cover some of their voxels; returns 1 if memory could not be
+// allocated
+static int classify(struct Classify* c, int bx0, int bx1, int by0, int by1,
+                    int bz0, int bz1, int* cand, int ncand, int depth)
+{
+    struct Bricks* b = c->bricks;
+    int* next = c->atoms + (long)(depth + 1)*c->nsolute;
+    int nnext = 0;
+    double lo[3], hi[3], p[3], near2, far2, d, cut;
+    int i, k, iatom, mid;
+
+    // the voxels at the corners of the box
+    lo[0] = BRICK*bx0*c->voxel_len;
+    lo[1] = BRICK*by0*c->voxel_len;
+    lo[2] = BRICK*bz0*c->voxel_len;
+    hi[0] = (((BRICK*bx1 < b->nx) ? BRICK*bx1 : b->nx) - 1)*c->voxel_len;
+    hi[1] = (((BRICK*by1 < b->ny) ? BRICK*by1 : b->ny) - 1)*c->voxel_len;
+    hi[2] = (((BRICK*bz1 < b->nz) ? BRICK*bz1 : b->nz) - 1)*c->voxel_len;
+
+    for (i=0; i<ncand; i++){
+        iatom = cand[i];
+        cut = c->solute_rad[iatom] + c->solvent_rad;
+        near2 = 0;
+        far2 = 0;
+        for (k=0; k<3; k++){
+            p[k] = c->solute_pos[3*iatom + k];
+            d = (p[k] < lo[k]) ? lo[k] - p[k] : ((p[k] > hi[k]) ? p[k] - hi[k] : 0);
+            near2 += d*d;
+            d = (p[k] - lo[k] > hi[k] - p[k]) ? p[k] - lo[k] : hi[k] - p[k];
+            far2 += d*d;
+        }
+        if (near2 >= (cut + MARGIN)*(cut + MARGIN)){
+            continue;
+        }
+        if (far2 <= (cut - MARGIN)*(cut - MARGIN)){
+            set_bricks(b, bx0, bx1, by0, by1, bz0, bz1, BLOCKED);
+            return 0;
+        }
+        next[nnext++] = iatom;
+    }
+    if (nnext == 0){
+        set_bricks(b, bx0, bx1, by0, by1, bz0, bz1, FREE);
+        return 0;
+    }
+    if ((bx1 - bx0 == 1) && (by1 - by0 == 1) && (bz1 - bz0 == 1)){
+        return mix_brick(c, bx0, by0, bz0, next, nnext);
+    }
+
+    // split the longest side in two
+    if ((bx1 - bx0 >= by1 - by0) && (bx1 - bx0 >= bz1 - bz0)){
+        mid = (bx0 + bx1)/2;
+        return classify(c, bx0, mid, by0, by1, bz0, bz1, next, nnext, depth+1)
+            || classify(c, mid, bx1, by0, by1, bz0, bz1, next, nnext, depth+1);
+    } else if (by1 - by0 >= bz1 - bz0){
+        mid = (by0 + by1)/2;
+        return classify(c, bx0, bx1, by0, mid, bz0, bz1, next, nnext, depth+1)
+            || classify(c, bx0, bx1, mid, by1, bz0, bz1, next, nnext, depth+1);
+    } else {
+        mid = (bz0 + bz1)/2;
+        return classify(c, bx0, bx1, by0, by1, bz0, mid, next, nnext, depth+1)
+            || classify(c, bx0, bx1, by0, by1, mid, bz1, next, nnext, depth+1);
+    }
+}
+
+static int push(struct Bricks* b, long ibrick)
+{
+    long* stack;
+    if (b->nstack == b->stackcapacity){
+        stack = (long*)realloc(b->stack, (2*b->stackcapacity + 64)*sizeof(long));
+        if (!stack){
+            return 1;
+        }
+        b->stack = stack;
+        b->stackcapacity = 2*b->stackcapacity + 64;
+    }
+    b->stack[b->nstack++] = ibrick;
+    return 0;
+}
+
+// Spread the filled voxels of mixed brick m to all the accessible voxels of
+// the brick connected to them
+static void fill_brick(struct Bricks* b, long m)
+{
+    uint64_t* free = b->free + BRICK*m;
+    uint64_t* filled = b->filled + BRICK*m;
+    uint64_t grown[BRICK];
+    int x, changed = 1;
+    while (changed){
+        spill(filled, 0, 0, 0, grown);
+        changed = 0;
+        for (x=0; x<BRICK; x++){
+            grown[x] &= free[x];
+            if (grown[x] != filled[x]){
+                filled[x] = grown[x];
+                changed = 1;
+            }
+        }
+    }
+}
+
+// Add the voxels in ``reach`` (a mask of brick ``ibrick``) that are accessible
+// to the filled region; returns 1 if memory could not be allocated
+static int reach_brick(struct Bricks* b, int bx, int by, int bz,
+                       uint64_t* reach)
+{
+    long ibrick = brick_index(b, bx, by, bz);
+    int state = b->index[ibrick];
+    uint64_t mask[BRICK];
+    uint64_t* free;
+    uint64_t* filled;
+    uint64_t any = 0;
+    int x;
+    if ((state == BLOCKED) || (state == FILLED)){
+        return 0;
+    }
+    if (state == FREE){
+        ingrid_mask(b, bx, by, bz, mask);
+        for (x=0; x<BRICK; x++){
+            any |= reach[x] & mask[x];
+        }
+        if (any){
+            b->index[ibrick] = FILLED;
+            return push(b, ibrick);
+        }
+        return 0;
+    }
+    free = b->free + BRICK*state;
+    filled = b->filled + BRICK*state;
+    for (x=0; x<BRICK; x++){
+        reach[x] &= free[x] & ~filled[x];
+        any |= reach[x];
+    }
+    if (!any){
+        return 0;
+    }
+    for (x=0; x<BRICK; x++){
+        filled[x] |= reach[x];
+    }
+    fill_brick(b, state);
+    if (!b->queued[state]){
+        b->queued[state] = 1;
+        return push(b, ibrick);
+    }
+    return 0;
+}
+
+static void free_bricks(struct Bricks* b, struct Classify* c)
+{
+    free(b->index);
+    free(b->free);
+    free(b->filled);
+    free(b->queued);
+    free(b->stack);
+    free(c->atoms);
+}
+
+long floodfill_sparse(int* seeds, int nseeds, int nx, int ny, int nz,
+                      double voxel_len, double* solute_pos, double* solute_rad,
+                      int nsolute, double solvent_rad,
+                      struct FillStats* stats)
+{
+    /*
+     * Count the voxels of an (nx, ny, nz) grid that can be reached from any of
+     * the seed voxels by moves between neighboring voxels (including diagonal
+     * neighbors; 26 in total) that are accessible to solvent. The result is
+     * the same as the number of bits floodfill sets in the grid, but the grid
+     * is never stored as a whole.
+     *
+     * Instead, the grid is split into bricks of BRICK^3 voxels. Boxes of
+     * bricks are split in two until each box either lies inside a single
+     * atom (all blocked), is out of reach of every atom (all accessible), or
+     * is a single brick. Only the voxels of these last "mixed" bricks, near
+     * the surface of the solute, are checked and stored one by one. The fill
+     * then spreads from brick to brick: accessible bricks are filled as a
+     * whole, and mixed bricks voxel by voxel, 64 voxels at a time.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * seeds: shape (nseeds, 3) array; (x,y,z) indices of the seed voxels.
+     *     Seeds that are blocked or outside the grid are skipped.
+     * nseeds: number of seed voxels
+     * nx, ny, nz: number of voxels along x, y and z
+     * voxel_len: edge length of (cubic) voxel
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * stats: counters to add to, or NULL. A brick taken off the stack counts
+     *     as BRICK^3 voxels visited, and the stack as the queue.
+     *
+     * --------
+     * Returns
+     * -------
+     * The number of voxels reached, or -1 if memory could not be allocated.
+     */
+    struct Bricks b;
+    struct Classify c;
+    long nbricks, ibrick, count = 0;
+    uint64_t reach[BRICK], mask[BRICK];
+    int* all;
+    int i, x, y, z, bx, by, bz, dx, dy, dz, state, depth;
+
+    b.nx = nx;
+    b.ny = ny;
+    b.nz = nz;
+    b.nbx = (nx + BRICK - 1)/BRICK;
+    b.nby = (ny + BRICK - 1)/BRICK;
+    b.nbz = (nz + BRICK - 1)/BRICK;
+    nbricks = (long)b.nbx*b.nby*b.nbz;
+    b.nmixed = 0;
+    b.capacity = 0;
+    b.free = NULL;
+    b.filled = NULL;
+    b.queued = NULL;
+    b.nstack = 0;
+    b.stackcapacity = 0;
+    b.stack = NULL;
+    b.index = (int*)malloc((nbricks + 1)*sizeof(int));
+
+    // every split halves one side, so the recursion is at most this deep
+    depth = 2;
+    for (i=1; i<b.nbx; i*=2) depth++;
+    for (i=1; i<b.nby; i*=2) depth++;
+    for (i=1; i<b.nbz; i*=2) depth++;
+    c.bricks = &b;
+    c.voxel_len = voxel_len;
+    c.solute_pos = solute_pos;
+    c.solute_rad = solute_rad;
+    c.nsolute = nsolute;
+    c.solvent_rad = solvent_rad;
+    c.stats = stats;
+    c.atoms = (int*)malloc(((long)(depth + 1)*nsolute + 1)*sizeof(int));
+    if ((!b.index) || (!c.atoms)){
+        free_bricks(&b, &c);
+        return -1;
+    }
+
+    // classify the bricks
+    all = c.atoms;
+    for (i=0; i<nsolute; i++){
+        all[i] = i;
+    }
+    if (classify(&c, 0, b.nbx, 0, b.nby, 0, b.nbz, all, nsolute, 0)){
+        free_bricks(&b, &c);
+        return -1;
+    }
+
+    // fill from the seeds
+    for (i=0; i<nseeds; i++){
+        x = seeds[3*i];
+        y = seeds[3*i+1];
+        z = seeds[3*i+2];
+        if ((x < 0) || (x >= nx) || (y < 0) || (y >= ny) || (z < 0) || (z >= nz)){
+            continue;
+        }
+        for (dx=0; dx<BRICK; dx++){
+            reach[dx] = 0;
+        }
+        reach[x % BRICK] = (uint64_t)1 << (8*(y % BRICK) + z % BRICK);
+        if (reach_brick(&b, x/BRICK, y/BRICK, z/BRICK, reach)){
+            free_bricks(&b, &c);
+            return -1;
+        }
+        if (stats && (b.nstack > 0)){
+            stats->fills++;
+        }
+        while (b.nstack > 0){
+            if (stats){
+                stats->visited += BRICK*BRICK*BRICK;
+                if (b.nstack > stats->queue_max){
+                    stats->queue_max = b.nstack;
+                }
+            }
+            ibrick = b.stack[--b.nstack];
+            state = b.index[ibrick];
+            bz = ibrick % b.nbz;
+            by = (ibrick / b.nbz) % b.nby;
+            bx = ibrick / ((long)b.nbz*b.nby);
+            if (state == FILLED){
+                ingrid_mask(&b, bx, by, bz, mask);
+            } else {
+                b.queued[state] = 0;
+                memcpy(mask, b.filled + BRICK*state, BRICK*sizeof(uint64_t));
+            }
+            for (dx=-1; dx<=1; dx++){
+                for (dy=-1; dy<=1; dy++){
+                    for (dz=-1; dz<=1; dz++){
+                        if (((dx == 0) && (dy == 0) && (dz == 0)) ||
+                            (bx + dx < 0) || (bx + dx >= b.nbx) ||
+                            (by + dy < 0) || (by + dy >= b.nby) ||
+                            (bz + dz < 0) || (bz + dz >= b.nbz)){
+                            continue;
+                        }
+                        spill(mask, dx, dy, dz, reach);
+                        if (reach_brick(&b, bx+dx, by+dy, bz+dz, reach)){
+                            free_bricks(&b, &c);
+                            return -1;
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    // count the voxels reached
+    for (bx=0; bx<b.nbx; bx++){
+        for (by=0; by<b.nby; by++){
+            for (bz=0; bz<b.nbz; bz++){
+                state = b.index[brick_index(&b, bx, by, bz)];
+                if (state == FILLED){
+                    ingrid_mask(&b, bx, by, bz, mask);
+                } else if (state >= 0){
+                    memcpy(mask, b.filled + BRICK*state, BRICK*sizeof(uint64_t));
+                } else {
+                    continue;
+                }
+                for (x=0; x<BRICK; x++){
+                    count += __builtin_popcountll(mask[x]);
+                }
+            }
+        }
+    }
+    if (stats){
+        stats->seeds += nseeds;
+        stats->bytes += (nbricks + 1)*sizeof(int)
+                        + ((long)(depth + 1)*nsolute + 1)*sizeof(int)
+                        + b.capacity*(2*BRICK*sizeof(uint64_t) + 1)
+                        + b.stackcapacity*sizeof(long);
+    }
+    free_bricks(&b, &c);
+    return count;
+}
+
+// Bytes of memory used by the index of the bricks of an (nx, ny, nz) grid. The
+// masks of the mixed bricks (128 bytes each) come on top of this; how many
+// bricks are mixed depends on the surface of the solute.
+unsigned long sparseBytes(int nx, int ny, int nz)
+{
+    return ((unsigned long)((nx + BRICK - 1)/BRICK)*((ny + BRICK - 1)/BRICK)
+            *((nz + BRICK - 1)/BRICK) + 1)*sizeof(int);
+}
@@ -0,0 +1,212 @@
+#include "sweep.h"
+#include "bitgrid.h"
+#include "floodfill3d.h"
+#include "label.h"
+#include <math.h>
+#include <stdlib.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+void probe_levels(double voxel_len, int nx, int ny, int nz,
+                  unsigned char* levels, double* solute_pos,
+                  double* solute_rad, int nsolute, double* probe_rad,
+                  int nprobe, int xstart, int xstop)
+{
+    /*
+     * For every voxel, find how many of the probe radii fit on it: level
+     * k means that is_free returns True for the voxel with the k smallest
+     * probe radii, and False with the others. A probe that does not fit on a
+     * voxel does not fit with a larger radius either, so one level per voxel
+     * holds the accessibility for every radius.
+     *
+     * As in rasterize_slab, only the voxels in the bounding box of each
+     * atom's exclusion sphere (for the largest probe) are visited, and only
+     * those with x index in [xstart, xstop), so that different slabs of the
+     * grid can be filled in by different threads.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * voxel_len: edge length of (cubic) voxel
+     * nx, ny, nz: number of voxels along x, y and z
+     * levels: shape (nx, ny, nz) array; set to nprobe, then lowered for the
+     *     voxels in [xstart, xstop) that some probes do not fit on
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * probe_rad: shape (nprobe,) array of probe radii, in increasing order
+     * nprobe: number of probe radii; at most 255
+     * xstart: first x index of the slab
+     * xstop: one past the last x index of the slab
+     */
+    double solx, soly, solz, cut, pcut, d, m;
+    double voxx, voxy, voxz;
+    double dx, dy, zcut;
+    int isolute, ix, iy, iz, k;
+    int ix0, ix1, iy0, iy1, iz0, iz1;
+    long i;
+    unsigned char* level;
+
+    for (i = (long)xstart*ny*nz; i < (long)xstop*ny*nz; i++){
+        levels[i] = (unsigned char)nprobe;
+    }
+    for (isolute = 0; isolute < nsolute; isolute++){
+        solx = solute_pos[isolute*3];
+        soly = solute_pos[isolute*3 + 1];
+        solz = solute_pos[isolute*3 + 2];
+        cut = solute_rad[isolute] + probe_rad[nprobe-1];
+
+        // Pad the bounding box by a voxel; the exact test below decides.
+        ix0 = (int)fmax(floor((solx - cut)/voxel_len), xstart);
+        ix1 = (int)fmin(ceil((solx + cut)/voxel_len), xstop - 1);
+        iy0 = (int)fmax(floor((soly - cut)/voxel_len), 0);
+        iy1 = (int)fmin(ceil((soly + cut)/voxel_len), ny - 1);
+        for (ix = ix0; ix <= ix1; ix++){
+            voxx = ix*voxel_len;
+            dx = solx - voxx;
+            for (iy = iy0; iy <= iy1; iy++){
+                voxy = iy*voxel_len;
+                dy = soly - voxy;
+                if (dx*dx + dy*dy > cut*cut*(1 + 1e-9)){
+                    continue;
+                }
+                // half-length of the chord of the sphere along this row
+                zcut = sqrt(fmax(cut*cut - dx*dx - dy*dy, 0));
+                iz0 = (int)fmax(floor((solz - zcut)/voxel_len) - 1, 0);
+                iz1 = (int)fmin(ceil((solz + zcut)/voxel_len) + 1, nz - 1);
+                level = levels + ((long)ix*ny + iy)*nz;
+                for (iz = iz0; iz <= iz1; iz++){
+                    if (level[iz] == 0){
+                        continue;
+                    }
+                    voxz = iz*voxel_len;
+                    // the same test as in is_free, for each probe that still
+                    // fits; the test is monotonic in the probe radius
+                    m = fmax(fmax(fabs(solx - voxx), fabs(soly - voxy)),
+                             fabs(solz - voxz));
+                    d = dist(voxx, voxy, voxz, solx, soly, solz);
+                    k = level[iz];
+                    while (k > 0){
+                        pcut = solute_rad[isolute] + probe_rad[k-1];
+                        if ((m > pcut) || !(d < pcut)){
+                            break;
+                        }
+                        k--;
+                    }
+                    level[iz] = (unsigned char)k;
+                }
+            }
+        }
+    }
+}
+
+int probe_sweep(double voxel_len, int nx, int ny, int nz, double* solute_pos,
+                double* solute_rad, int nsolute, double* probe_rad,
+                int nprobe, int nthreads, long* counts)
+{
+    /*
+     * Count the voxels that can be reached from voxel (0, 0, 0) by moves
+     * between neighboring voxels (including diagonal neighbors; 26 in total)
+     * that are accessible to solvent, for each of several probe (solvent)
+     * radii. The counts are the same as those of floodfill with each radius.
+     *
+     * The levels of probe_levels are found once; for each radius, the
+     * voxels it does not fit on are marked in a grid of bits, and the voxels
+     * connected to (0, 0, 0) are labelled with floodfill_parallel.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * voxel_len: edge length of (cubic) voxel
+     * nx, ny, nz: number of voxels along x, y and z
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * probe_rad: shape (nprobe,) array of probe radii, in increasing order
+     * nprobe: number of probe radii; at most 255
+     * nthreads: number of threads to use; 0 to use the OpenMP default
+     * counts: shape (nprobe,) array; set to the number of voxels reached with
+     *     each probe radius
+     *
+     * --------
+     * Returns
+     * -------
+     * 0 on success, 1 if memory could not be allocated.
+     */
+    int nslabs, slab, k, x, y, z;
+    int seed[3] = {0, 0, 0};
+    int failed = 0;
+    unsigned char* levels;
+    unsigned char* level;
+    uint64_t* row;
+    struct BitGrid* blocked;
+    struct BitGrid* grid;
+
+#ifdef _OPENMP
+    if (nthreads <= 0){
+        nthreads = omp_get_max_threads();
+    }
+#else
+    nthreads = 1;
+#endif
+    nslabs = (nthreads < nx) ? nthreads : nx;
+    levels = (unsigned char*)malloc((long)nx*ny*nz*sizeof(unsigned char) + 1);
+    blocked = newBitGrid(nx, ny, nz);
+    grid = newBitGrid(nx, ny, nz);
+    if ((!levels) || (!blocked) || (!grid)){
+        free(levels);
+        if (blocked){
+            delBitGrid(blocked);
+        }
+        if (grid){
+            delBitGrid(grid);
+        }
+        return 1;
+    }
+
+    #pragma omp parallel for num_threads(nthreads) schedule(static, 1)
+    for (slab=0; slab<nslabs; slab++){
+        probe_levels(voxel_len, nx, ny, nz, levels, solute_pos, solute_rad,
+                     nsolute, probe_rad, nprobe,
+                     (int)(((long)slab*nx)/nslabs),
+                     (int)(((long)(slab+1)*nx)/nslabs));
+    }
+
+    for (k=0; k<nprobe; k++){
+        counts[k] = 0;
+        // (0, 0, 0) is the seed; nothing is reached if the probe does not fit
+        // there
+        if (levels[0] <= k){
+            continue;
+        }
+        resizeBitGrid(blocked, nx, ny, nz);
+        resizeBitGrid(grid, nx, ny, nz);
+        #pragma omp parallel for num_threads(nthreads) schedule(static) private(y, z, row, level)
+        for (x=0; x<nx; x++){
+            for (y=0; y<ny; y++){
+                row = getrow(blocked, x, y);
+                level = levels + ((long)x*ny + y)*nz;
+                for (z=0; z<nz; z++){
+                    if (level[z] <= k){
+                        row[z >> 6] |= (uint64_t)1 << (z & 63);
+                    }
+                }
+            }
+        }
+        // With no atoms, floodfill_parallel leaves the blocked grid as it is
+        if (floodfill_parallel(seed, 1, voxel_len, grid, solute_pos,
+                               solute_rad, 0, probe_rad[k], NULL, blocked,
+                               nthreads, NULL)){
+            failed = 1;
+            break;
+        }
+        counts[k] = countBits(grid);
+    }
+    free(levels);
+    delBitGrid(blocked);
+    delBitGrid(grid);
+    return failed;
+}
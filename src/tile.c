@@ -0,0 +1,476 @@
+#include "tile.h"
+#include "batch.h"
+#include "bitgrid.h"
+#include "label.h"
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+// Runs per row that a slab is sized for; rows with more runs only make the
+// slab use more memory than the budget
+#define RUNS_PER_ROW 4
+
+// flags of a component of runs
+#define REACHED 1
+#define OPEN 2      // has runs in the last plane of a slab
+#define CARRIED 4   // already given a label for the next slab
+
+// An atom, by its x coordinate, for sorting
+struct XAtom
+{
+    double x;
+    int i;
+};
+
+// What a slab hands on to the next: the runs of its last plane, labelled by
+// component, and the size of each component and whether it was reached.
+struct Carry
+{
+    long* rowstart;
+    unsigned short* z0;
+    unsigned short* z1;
+    long* label;
+    long nlabels;
+    long* count;
+    unsigned char* reached;
+    long capacity;
+};
+
+static int compare_x(const void* a, const void* b)
+{
+    double xa = ((const struct XAtom*)a)->x;
+    double xb = ((const struct XAtom*)b)->x;
+    return (xa > xb) - (xa < xb);
+}
+
+// Bytes of a plane of the blocked grid and of its runs
+static unsigned long plane_bytes(int ny, int nz)
+{
+    return (unsigned long)ny*((nz + 63)/64)*sizeof(uint64_t) +
+           (unsigned long)ny*(sizeof(long) + RUNS_PER_ROW*(
+               2*sizeof(unsigned short) + 2*sizeof(long) + 1));
+}
+
+// Bytes of memory a tiled fill of an (nx, ny, nz) grid needs at least, with
+// slabs of a single plane: that plane and the plane handed on from the slab
+// before it.
+unsigned long tiledBytes(int nx, int ny, int nz)
+{
+    return 2*plane_bytes(ny, nz);
+}
+
+// Allocate ``bytes`` bytes of zeros in a file in ``dir``, which is removed
+// as soon as it is mapped. Returns NULL on failure.
+static void* map_scratch(const char* dir, size_t bytes)
+{
+    char* path;
+    void* p;
+    int fd;
+
+    path = (char*)malloc(strlen(dir) + 32);
+    if (!path){
+        return NULL;
+    }
+    sprintf(path, "%s/floodfill3d-XXXXXX", dir);
+    fd = mkstemp(path);
+    if (fd < 0){
+        free(path);
+        return NULL;
+    }
+    unlink(path);
+    free(path);
+    if (ftruncate(fd, (off_t)bytes)){
+        close(fd);
+        return NULL;
+    }
+    p = mmap(NULL, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    return (p == MAP_FAILED) ? NULL : p;
+}
+
+// Mark the voxels of planes xa ... xb-1 that atoms[first] ... atoms[last-1]
+// block in ``blocked``, which holds planes x0 ... of the grid
+static void rasterize_planes(double voxel_len, struct BitGrid* blocked, int x0,
+                             int xa, int xb, double* solute_pos,
+                             double* solute_rad, struct XAtom* atoms,
+                             long first, long last, double solvent_rad,
+                             long* nchecked)
+{
+    long k, n = 0;
+    int i, ix, iy, ix0, ix1, iy0, iy1, z0, z1;
+    double* p;
+    double cut;
+    for (k=first; k<last; k++){
+        i = atoms[k].i;
+        p = solute_pos + 3*i;
+        cut = solute_rad[i] + solvent_rad;
+        ix0 = (int)fmax(floor((p[0] - cut)/voxel_len), xa);
+        ix1 = (int)fmin(ceil((p[0] + cut)/voxel_len), xb - 1);
+        iy0 = (int)fmax(floor((p[1] - cut)/voxel_len), 0);
+        iy1 = (int)fmin(ceil((p[1] + cut)/voxel_len), blocked->ny - 1);
+        for (ix=ix0; ix<=ix1; ix++){
+            for (iy=iy0; iy<=iy1; iy++){
+                blocked_run(voxel_len, blocked->nz, ix, iy, p, cut, &z0, &z1);
+                n++;
+                if (z0 <= z1){
+                    setrun(getrow(blocked, ix - x0, iy), z0, z1);
+                }
+            }
+        }
+    }
+    if (nchecked){
+        *nchecked += n;
+    }
+}
+
+// Resize *p to ``n`` elements of ``size`` bytes. Returns 1 on failure, and
+// leaves *p as it was.
+static int grow(void** p, long n, size_t size)
+{
+    void* q = realloc(*p, n*size);
+    if (!q){
+        return 1;
+    }
+    *p = q;
+    return 0;
+}
+
+long floodfill_tiled(int* seeds, int nseeds, int nx, int ny, int nz,
+                     double voxel_len, double* solute_pos, double* solute_rad,
+                     int nsolute, double solvent_rad, unsigned long budget,
+                     const char* scratch_dir, int nthreads,
+                     struct FillStats* stats)
+{
+    /*
+     * Count the voxels of an (nx, ny, nz) grid that can be reached from any of
+     * the seed voxels by moves between neighboring voxels (including diagonal
+     * neighbors; 26 in total) that are accessible to solvent. The result is
+     * the same as the number of bits floodfill sets in the grid, but only a
+     * slab of planes of the grid is held in memory at a time.
+     *
+     * The slabs are taken in order of x. In each, the blocked voxels are
+     * rasterized, and the runs of accessible voxels along z are labelled by
+     * connected component as in floodfill_parallel. The runs of the plane
+     * before the slab come along as a halo, labelled by the components they
+     * belonged to; runs with the same label are merged, so components join
+     * up across slabs. A component with no runs in the last plane of the
+     * slab cannot grow any more, and is counted if it was reached; the others
+     * are handed on to the next slab.
+     *
+     * ----------
+     * Parameters
+     * ----------
+     * seeds: shape (nseeds, 3) array; (x,y,z) indices of the seed voxels.
+     *     Seeds that are blocked or outside the grid are skipped.
+     * nseeds: number of seed voxels
+     * nx, ny, nz: number of voxels along x, y and z; nz at most 65535
+     * voxel_len: edge length of (cubic) voxel
+     * solute_pos: shape (nsolute, 3) array; (x,y,z) coordinates of each solute
+     *     atom
+     * solute_rad: shape (nsolute,) array; radius of each solute atom
+     * nsolute: number of solute atoms
+     * solvent_rad: radius of solvent (which is approximated as a sphere)
+     * budget: bytes of memory to size the slabs by; slabs are at least one
+     *     plane thick, see tiledBytes
+     * scratch_dir: directory to keep the blocked voxels of a slab in a
+     *     memory-mapped file in, or NULL to keep them in memory
+     * nthreads: number of threads to rasterize with; 0 to use the OpenMP
+     *     default
+     * stats: counters to add to, or NULL. The largest number of runs in a
+     *     slab counts as the queue.
+     *
+     * --------
+     * Returns
+     * -------
+     * The number of voxels reached, or -1 if memory could not be allocated.
+     */
+    long rowwords = (nz + 63)/64;
+    long nrows, nruns, nhalo, r, root, i, k, c;
+    long first = 0, last = 0, count = 0, nchecked = 0;
+    long runcapacity = 0, rowcapacity = 0, repcapacity = 0;
+    long maxbytes = 0, bytes;
+    size_t gridbytes;
+    int thick, x0, x1, nplanes, x, y, t, nparts, failed = 0;
+    double reach, maxcut = 0;
+    struct XAtom* atoms;
+    struct BitGrid slab;
+    struct Runs runs;
+    struct Carry carry, next, swap;
+    long* count_of = NULL;
+    long* rep = NULL;
+    unsigned char* flags = NULL;
+    uint64_t* words;
+
+#ifdef _OPENMP
+    if (nthreads <= 0){
+        nthreads = omp_get_max_threads();
+    }
+#else
+    nthreads = 1;
+#endif
+
+    // as many planes as fit in the budget, next to the halo plane
+    thick = (int)fmin(fmax((double)(budget/plane_bytes(ny, nz)) - 1, 1), nx);
+
+    atoms = (struct XAtom*)malloc((nsolute + 1)*sizeof(struct XAtom));
+    if (!atoms){
+        return -1;
+    }
+    for (i=0; i<nsolute; i++){
+        atoms[i].x = solute_pos[3*i];
+        atoms[i].i = (int)i;
+        if (solute_rad[i] + solvent_rad > maxcut){
+            maxcut = solute_rad[i] + solvent_rad;
+        }
+    }
+    qsort(atoms, nsolute, sizeof(struct XAtom), compare_x);
+    // atoms further than this from a slab along x cannot block any of it
+    reach = maxcut + 2*voxel_len;
+
+    slab.nx = thick;
+    slab.ny = ny;
+    slab.nz = nz;
+    slab.rowwords = rowwords;
+    slab.capacity = (long)thick*ny*rowwords;
+    gridbytes = (slab.capacity + 1)*sizeof(uint64_t);
+    if (scratch_dir){
+        words = (uint64_t*)map_scratch(scratch_dir, gridbytes);
+    } else {
+        words = (uint64_t*)malloc(gridbytes);
+    }
+    slab.words = words;
+
+    memset(&carry, 0, sizeof(struct Carry));
+    memset(&next, 0, sizeof(struct Carry));
+    memset(&runs, 0, sizeof(struct Runs));
+    carry.rowstart = (long*)calloc(ny + 1, sizeof(long));
+    next.rowstart = (long*)calloc(ny + 1, sizeof(long));
+    if ((!words) || (!carry.rowstart) || (!next.rowstart)){
+        failed = 1;
+    }
+
+    for (x0=0; (x0<nx) && (!failed); x0=x1){
+        x1 = (x0 + thick < nx) ? x0 + thick : nx;
+        nplanes = x1 - x0;
+        nrows = (long)(nplanes + 1)*ny;
+
+        // rasterize the slab, with each thread taking some of the planes
+        while ((first < nsolute) && (atoms[first].x < x0*voxel_len - reach)){
+            first++;
+        }
+        while ((last < nsolute) && (atoms[last].x <= x1*voxel_len + reach)){
+            last++;
+        }
+        slab.nx = nplanes;
+        memset(slab.words, 0, (long)nplanes*ny*rowwords*sizeof(uint64_t));
+        nparts = (nthreads < nplanes) ? nthreads : nplanes;
+        #pragma omp parallel for num_threads(nthreads) schedule(static, 1) reduction(+:nchecked)
+        for (t=0; t<nparts; t++){
+            rasterize_planes(voxel_len, &slab, x0,
+                             x0 + (int)(((long)t*nplanes)/nparts),
+                             x0 + (int)(((long)(t+1)*nplanes)/nparts),
+                             solute_pos, solute_rad, atoms, first, last,
+                             solvent_rad, stats ? &nchecked : NULL);
+        }
+
+        // find the runs, with those handed on from the slab before as plane 0
+        if ((nrows + 1 > rowcapacity) &&
+            grow((void**)&runs.rowstart, nrows + 1, sizeof(long))){
+            failed = 1;
+            break;
+        }
+        rowcapacity = (nrows + 1 > rowcapacity) ? nrows + 1 : rowcapacity;
+        nhalo = carry.rowstart[ny];
+        for (y=0; y<=ny; y++){
+            runs.rowstart[y] = carry.rowstart[y];
+        }
+        #pragma omp parallel for num_threads(nthreads) schedule(static) private(y)
+        for (x=0; x<nplanes; x++){
+            for (y=0; y<ny; y++){
+                runs.rowstart[(long)(x + 1)*ny + y + 1] =
+                    row_runs(getrow(&slab, x, y), nz, NULL, NULL);
+            }
+        }
+        for (r=ny; r<nrows; r++){
+            runs.rowstart[r+1] += runs.rowstart[r];
+        }
+        nruns = runs.rowstart[nrows];
+        if (nruns + 1 > runcapacity){
+            if (grow((void**)&runs.z0, nruns + 1, sizeof(unsigned short)) ||
+                grow((void**)&runs.z1, nruns + 1, sizeof(unsigned short)) ||
+                grow((void**)&runs.parent, nruns + 1, sizeof(long)) ||
+                grow((void**)&count_of, nruns + 1, sizeof(long)) ||
+                grow((void**)&flags, nruns + 1, sizeof(unsigned char))){
+                failed = 1;
+                break;
+            }
+            runcapacity = nruns + 1;
+        }
+        if (carry.nlabels + 1 > repcapacity){
+            if (grow((void**)&rep, carry.nlabels + 1, sizeof(long))){
+                failed = 1;
+                break;
+            }
+            repcapacity = carry.nlabels + 1;
+        }
+        if (nhalo > 0){
+            memcpy(runs.z0, carry.z0, nhalo*sizeof(unsigned short));
+            memcpy(runs.z1, carry.z1, nhalo*sizeof(unsigned short));
+        }
+        #pragma omp parallel for num_threads(nthreads) schedule(static) private(y, r)
+        for (x=0; x<nplanes; x++){
+            for (y=0; y<ny; y++){
+                r = runs.rowstart[(long)(x + 1)*ny + y];
+                row_runs(getrow(&slab, x, y), nz, runs.z0 + r, runs.z1 + r);
+            }
+        }
+        for (r=0; r<nruns; r++){
+            runs.parent[r] = r;
+            count_of[r] = 0;
+            flags[r] = 0;
+        }
+
+        // merge connected runs, then the halo runs of the same component
+        for (x=1; x<=nplanes; x++){
+            merge_plane(&runs, x, ny);
+        }
+        for (c=0; c<carry.nlabels; c++){
+            rep[c] = -1;
+        }
+        for (r=0; r<nhalo; r++){
+            c = carry.label[r];
+            if (rep[c] < 0){
+                rep[c] = r;
+            } else {
+                merge_runs(runs.parent, r, rep[c]);
+            }
+        }
+        for (r=0; r<nruns; r++){
+            runs.parent[r] = runs.parent[runs.parent[r]];
+        }
+
+        // size up the components, and find the reached ones
+        for (r=nhalo; r<nruns; r++){
+            count_of[runs.parent[r]] += runs.z1[r] - runs.z0[r] + 1;
+        }
+        for (c=0; c<carry.nlabels; c++){
+            if (rep[c] >= 0){
+                root = runs.parent[rep[c]];
+                count_of[root] += carry.count[c];
+                flags[root] |= carry.reached[c];
+            }
+        }
+        for (i=0; i<nseeds; i++){
+            if ((seeds[3*i] < x0) || (seeds[3*i] >= x1)){
+                continue;
+            }
+            r = find_run(&runs, nplanes + 1, ny, nz, seeds[3*i] - x0 + 1,
+                         seeds[3*i+1], seeds[3*i+2]);
+            if (r >= 0){
+                if (stats && !(flags[runs.parent[r]] & REACHED)){
+                    stats->fills++;
+                }
+                flags[runs.parent[r]] |= REACHED;
+            }
+        }
+        if (x1 < nx){
+            for (r=runs.rowstart[(long)nplanes*ny]; r<nruns; r++){
+                flags[runs.parent[r]] |= OPEN;
+            }
+        }
+
+        // count the components that are done, and hand on the others
+        for (r=0; r<nruns; r++){
+            if ((runs.parent[r] == r) && ((flags[r] & (OPEN | REACHED)) == REACHED)){
+                count += count_of[r];
+            }
+        }
+        if (x1 < nx){
+            k = runs.rowstart[(long)nplanes*ny];
+            if (nruns - k + 1 > next.capacity){
+                if (grow((void**)&next.z0, nruns - k + 1, sizeof(unsigned short)) ||
+                    grow((void**)&next.z1, nruns - k + 1, sizeof(unsigned short)) ||
+                    grow((void**)&next.label, nruns - k + 1, sizeof(long)) ||
+                    grow((void**)&next.count, nruns - k + 1, sizeof(long)) ||
+                    grow((void**)&next.reached, nruns - k + 1,
+                         sizeof(unsigned char))){
+                    failed = 1;
+                    break;
+                }
+                next.capacity = nruns - k + 1;
+            }
+            next.nlabels = 0;
+            for (r=k; r<nruns; r++){
+                root = runs.parent[r];
+                if (!(flags[root] & CARRIED)){
+                    next.count[next.nlabels] = count_of[root];
+                    next.reached[next.nlabels] = flags[root] & REACHED;
+                    // the root's count is no longer needed; keep its label
+                    count_of[root] = next.nlabels++;
+                    flags[root] |= CARRIED;
+                }
+                next.z0[r - k] = runs.z0[r];
+                next.z1[r - k] = runs.z1[r];
+                next.label[r - k] = count_of[root];
+            }
+            for (y=0; y<=ny; y++){
+                next.rowstart[y] = runs.rowstart[(long)nplanes*ny + y] - k;
+            }
+            swap = carry;
+            carry = next;
+            next = swap;
+        }
+
+        bytes = (long)gridbytes + rowcapacity*sizeof(long) +
+                runcapacity*(2*sizeof(unsigned short) + 2*sizeof(long) + 1) +
+                (carry.capacity + next.capacity)*
+                    (2*sizeof(unsigned short) + 2*sizeof(long) + 1);
+        if (bytes > maxbytes){
+            maxbytes = bytes;
+        }
+        if (stats && (nruns > stats->queue_max)){
+            stats->queue_max = nruns;
+        }
+    }
+
+    if (stats){
+        stats->seeds += nseeds;
+        stats->visited += (long)nx*ny*nz;
+        stats->distance_evals += nchecked;
+        stats->bytes += maxbytes + (nsolute + 1)*sizeof(struct XAtom);
+    }
+    if (words){
+        if (scratch_dir){
+            munmap(words, gridbytes);
+        } else {
+            free(words);
+        }
+    }
+    free(atoms);
+    free(runs.rowstart);
+    free(runs.z0);
+    free(runs.z1);
+    free(runs.parent);
+    free(count_of);
+    free(flags);
+    free(rep);
+    free(carry.rowstart);
+    free(carry.z0);
+    free(carry.z1);
+    free(carry.label);
+    free(carry.count);
+    free(carry.reached);
+    free(next.rowstart);
+    free(next.z0);
+    free(next.z1);
+    free(next.label);
+    free(next.count);
+    free(next.reached);
+    return failed ? -1 : count;
+}
@@ -4,32 +4,1372 @@
 cimport cython
 cimport numpy
 cimport libc.limits
+import asyncio
+import functools
+import multiprocessing
+import os
 import numpy
 from libc.math cimport floor, ceil, sqrt
+from libc.stdint cimport uint64_t
 from libc.stdlib cimport malloc, free
+from libc.string cimport memset
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
 '''
 Make sure that the solute is whole (rather than split over a periodic boundary)
-before running this.
+before running this, unless the periodic box is given with ``box``.
 '''
 
+cdef extern from "stats.h":
+    struct FillStats:
+        long visited
+        long is_free_calls
+        long distance_evals
+        long seeds
+        long fills
+        long queue_max
+        long bytes
+
+cdef extern from "celllist.h":
+    struct CellList:
+        int ncx, ncy, ncz
+
+    CellList* newCellList(double* solute_pos, double* solute_rad, int nsolute,
+                          double solvent_rad) nogil
+
+    void delCellList(CellList* cells) nogil
+
+    unsigned char is_free_cells(double voxx, double voxy, double voxz,
+                                CellList* cells, double solvent_rad,
+                                long* nchecked) nogil
+
+cdef extern from "queue.h":
+    struct Span:
+        unsigned short x, y, z0, z1
+
+    struct Queue:
+        unsigned long capacity
+
+    Queue* newQueue(unsigned long capacity) nogil
+
+    void delQueue(Queue* queue) nogil
+
+cdef extern from "bitgrid.h":
+    struct BitGrid:
+        int nx, ny, nz
+        long rowwords
+        long capacity
+        uint64_t* words
+
+    BitGrid* newBitGrid(int nx, int ny, int nz) nogil
+
+    void delBitGrid(BitGrid* bitgrid) nogil
+
+    int resizeBitGrid(BitGrid* bitgrid, int nx, int ny, int nz) nogil
+
+    long countBits(BitGrid* bitgrid) nogil
+
+    unsigned long bitGridBytes(int nx, int ny, int nz) nogil
+
+    int getbit(BitGrid* bitgrid, int x, int y, int z) nogil
+
 cdef extern from "floodfill3d.h":
     double dist(double x1, double y1, double z1, double x2, double y2, double z2) nogil
     
     unsigned char is_free(double voxx, double voxy, double voxz, double* solute_pos,
-                          double* solute_rad, int nsolute, double solvent_rad) nogil
-    
-    void floodfill(int ix, int iy, int iz, int nx, int ny, int nz, double voxel_len,
-                   unsigned char* visited_grid, unsigned char* grid, int* moves,
-                   double* solute_pos, double* solute_rad, int nsolute, 
-                   double solvent_rad) nogil
+                          double* solute_rad, int nsolute, double solvent_rad,
+                          long* nchecked) nogil
     
+    void rasterize(double voxel_len, BitGrid* blocked, double* solute_pos,
+                   double* solute_rad, int nsolute, double solvent_rad,
+                   long* nchecked) nogil
+
+    int floodfill(int ix, int iy, int iz, double voxel_len,
+                  BitGrid* visited_grid, BitGrid* grid,
+                  double* solute_pos, double* solute_rad, int nsolute, 
+                  double solvent_rad, CellList* cells,
+                  BitGrid* blocked, Queue* queue, FillStats* stats) nogil
+
+    int floodfill_multi(int* seeds, int nseeds, double voxel_len,
+                        BitGrid* visited_grid, BitGrid* grid,
+                        double* solute_pos, double* solute_rad, int nsolute,
+                        double solvent_rad, CellList* cells,
+                        BitGrid* blocked, Queue* queue,
+                        FillStats* stats) nogil
+
+cdef extern from "sparse.h":
+    long floodfill_sparse(int* seeds, int nseeds, int nx, int ny, int nz,
+                          double voxel_len, double* solute_pos,
+                          double* solute_rad, int nsolute,
+                          double solvent_rad, FillStats* stats) nogil
+
+    unsigned long sparseBytes(int nx, int ny, int nz) nogil
+
+cdef extern from "tile.h":
+    long floodfill_tiled(int* seeds, int nseeds, int nx, int ny, int nz,
+                         double voxel_len, double* solute_pos,
+                         double* solute_rad, int nsolute, double solvent_rad,
+                         unsigned long budget, const char* scratch_dir,
+                         int nthreads, FillStats* stats) nogil
+
+    unsigned long tiledBytes(int nx, int ny, int nz) nogil
+
+cdef extern from "pbc.h":
+    long floodfill_periodic(int* seeds, int nseeds, double* cell,
+                            double* solute_pos, double* solute_rad,
+                            int nsolute, double solvent_rad, BitGrid* blocked,
+                            BitGrid* grid, FillStats* stats) nogil
+
+cdef extern from "sweep.h":
+    int probe_sweep(double voxel_len, int nx, int ny, int nz,
+                    double* solute_pos, double* solute_rad, int nsolute,
+                    double* probe_rad, int nprobe, int nthreads,
+                    long* counts) nogil
+
+cdef extern from "batch.h":
+    struct Atoms:
+        pass
+
+    Atoms* newAtoms(double* solute_pos, double* solute_rad, int nsolute,
+                    double solvent_rad, int single) nogil
+
+    void delAtoms(Atoms* atoms) nogil
+
+    void rasterize_batch(double voxel_len, BitGrid* blocked, Atoms* atoms,
+                         int nthreads, long* nchecked) nogil
+
+cdef extern from "incremental.h":
+    struct Incremental:
+        int nx, ny, nz
+        BitGrid* grid
+        long changed
+        long dirty_bricks
+
+    Incremental* newIncremental(int nx, int ny, int nz, double voxel_len,
+                                double* solute_rad, int nsolute,
+                                double solvent_rad) nogil
+
+    void delIncremental(Incremental* inc) nogil
+
+    int incremental_full(Incremental* inc, double* solute_pos) nogil
+
+    int incremental_update(Incremental* inc, double* solute_pos,
+                           double max_dirty) nogil
+
+cdef extern from "label.h":
+    int floodfill_parallel(int* seeds, int nseeds, double voxel_len,
+                           BitGrid* grid, double* solute_pos,
+                           double* solute_rad, int nsolute, double solvent_rad,
+                           CellList* cells, BitGrid* blocked,
+                           int nthreads, FillStats* stats) nogil
+
+# engines for deciding whether a voxel is accessible to solvent:
+#   'celllist': check only the solute atoms in nearby cells of a cell list
+#   'linear':   check every solute atom for every voxel
+#   'raster':   mark the voxels inside each atom's exclusion sphere before the
+#               flood fill, which then needs no distance checks
+#   'sparse':   only store the voxels near the surface of the solute, in bricks
+#               of 8x8x8 voxels; for fine grids that do not fit in memory
+#   'tiled':    go through the grid in slabs of planes that fit in a memory
+#               budget, joining up the accessible regions from slab to slab
+ENGINES = ('celllist', 'linear', 'raster', 'sparse', 'tiled')
+
+# default memory budget of the tiled engine, in bytes
+MEMORY_BUDGET = 256*1024*1024
+
+# kernels with which the raster engine checks the voxels against the atoms:
+#   'batch':   the voxels of a row together, with squared distances; the same
+#              voxels as 'scalar'
+#   'batch32': the same in single precision; faster, but voxels within about
+#              1e-6 (relative) of an exclusion sphere can come out differently
+#   'scalar':  one voxel at a time, as is_free does
+KERNELS = ('batch', 'batch32', 'scalar')
+
+# phases of a calculation that are timed, in order; see VolumeStats
+PHASES = ('setup', 'allocate', 'cells', 'rasterize', 'seeds', 'fill', 'count')
+
+cdef inline double _now() noexcept nogil:
+    # seconds on a monotonic clock
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + 1e-9*ts.tv_nsec
+
+cdef inline unsigned char _is_free(double x, double y, double z,
+                                   double* solute_pos, double* solute_rad,
+                                   int nsolute, double solvent_rad,
+                                   CellList* cells, FillStats* stats) nogil:
+    cdef long* nchecked = NULL
+    if stats:
+        stats.is_free_calls += 1
+        nchecked = &stats.distance_evals
+    if cells:
+        return is_free_cells(x, y, z, cells, solvent_rad, nchecked)
+    return is_free(x, y, z, solute_pos, solute_rad, nsolute, solvent_rad,
+                   nchecked)
+
+cdef inline int _add_seed(int* seeds, int nseeds, double x, double y,
+                          double z, double voxel_len, double* solute_pos,
+                          double* solute_rad, int nsolute, double solvent_rad,
+                          CellList* cells, FillStats* stats) noexcept nogil:
+    # Add the voxel at (x, y, z) to the seeds if solvent fits at (x, y, z), and
+    # return the new number of seeds.
+    #
+    # the index of ``grid`` corresponding to the given voxel
+    cdef int ix = int(x/voxel_len)
+    cdef int iy = int(y/voxel_len)
+    cdef int iz = int(z/voxel_len)
+    # The flood fill checks whether solvent fits at the voxel itself; unless
+    # rounding moved (x, y, z) off the voxel, that is the same check.
+    if ((ix*voxel_len == x) and (iy*voxel_len == y) and (iz*voxel_len == z))\
+            or _is_free(x, y, z, solute_pos, solute_rad, nsolute, solvent_rad,
+                        cells, stats):
+        seeds[3*nseeds]   = ix
+        seeds[3*nseeds+1] = iy
+        seeds[3*nseeds+2] = iz
+        return nseeds + 1
+    return nseeds
+
+cdef CellList* _build_cells(str engine, double* solute_pos, double* solute_rad,
+                            int nsolute, double solvent_rad) except? NULL:
+    cdef CellList* cells = NULL
+    # the raster, sparse and tiled engines still check the solvent positions
+    # in volume_explicit_sol, which need not lie on voxel centers
+    if engine in ('celllist', 'raster', 'sparse', 'tiled'):
+        with nogil:
+            cells = newCellList(solute_pos, solute_rad, nsolute, solvent_rad)
+        if not cells:
+            raise MemoryError("Failed to allocate cell list")
+    return cells
+
+cdef int _reuse_grid(BitGrid** bitgrid, int nx, int ny, int nz) nogil:
+    # make *bitgrid an empty (nx, ny, nz) grid, allocating it if it is NULL;
+    # returns 1 if memory could not be allocated
+    if bitgrid[0]:
+        return resizeBitGrid(bitgrid[0], nx, ny, nz)
+    bitgrid[0] = newBitGrid(nx, ny, nz)
+    return not bitgrid[0]
+
+cdef int _rasterize(str engine, str kernel, BitGrid** blocked, int nx, int ny,
+                    int nz, double voxel_len, double* solute_pos,
+                    double* solute_rad, int nsolute, double solvent_rad,
+                    int nthreads, bint fill=True, long* nchecked=NULL) except -1:
+    # For the raster engine, make *blocked an (nx, ny, nz) grid of the voxels
+    # that are not accessible to solvent. With ``fill`` false and the scalar
+    # kernel, the grid is left empty, for floodfill_parallel to rasterize in
+    # parallel. Returns the number of atoms still to be rasterized.
+    cdef Atoms* atoms
+    cdef bint single = kernel == 'batch32'
+    if engine != 'raster':
+        return nsolute
+    if _reuse_grid(blocked, nx, ny, nz):
+        raise MemoryError("Failed to allocate voxel arrays")
+    if kernel != 'scalar':
+        with nogil:
+            atoms = newAtoms(solute_pos, solute_rad, nsolute, solvent_rad,
+                             single)
+        if not atoms:
+            raise MemoryError("Failed to allocate atom arrays")
+        with nogil:
+            rasterize_batch(voxel_len, blocked[0], atoms,
+                            nthreads if not fill else 1, nchecked)
+            delAtoms(atoms)
+        return 0
+    if fill:
+        with nogil:
+            rasterize(voxel_len, blocked[0], solute_pos, solute_rad, nsolute,
+                      solvent_rad, nchecked)
+        return 0
+    return nsolute
+
+cdef unsigned long _cells_bytes(CellList* cells, int nsolute):
+    # bytes of memory held by a cell list over nsolute atoms
+    if not cells:
+        return 0
+    return ((<long>cells.ncx*cells.ncy*cells.ncz + 1)*sizeof(int) +
+            4*(nsolute + 1)*sizeof(double))
+
+cdef class _BitGridOwner:
+    # Owns a BitGrid, and frees it when the last array of its words is gone
+    cdef BitGrid* bitgrid
+
+    def __cinit__(self):
+        self.bitgrid = NULL
+
+    def __dealloc__(self):
+        if self.bitgrid:
+            delBitGrid(self.bitgrid)
+
+cdef numpy.ndarray _words_array(BitGrid* bitgrid):
+    # shape (nx, ny, rowwords) array of the words of bitgrid, without copying
+    # them; the array takes over the grid, and frees it when it goes away
+    cdef numpy.npy_intp dims[3]
+    cdef _BitGridOwner owner = _BitGridOwner()
+    owner.bitgrid = bitgrid
+    dims[0] = bitgrid.nx
+    dims[1] = bitgrid.ny
+    dims[2] = bitgrid.rowwords
+    cdef numpy.ndarray words = numpy.PyArray_SimpleNewFromData(
+            3, dims, numpy.NPY_UINT64, <void*>bitgrid.words)
+    numpy.set_array_base(words, owner)
+    return words
+
+class AccessibleGrid(object):
+    '''
+    The voxels accessible to solvent, from a calculation with
+    ``return_grid=True``. Voxel (i, j, k) is centered at ``origin + (i, j,
+    k)*spacing``, in the coordinates of the solute.
+
+    bits: shape (nx, ny, nwords) array of uint64; the grid as the calculation
+        left it, one bit per voxel. Bit k % 64 of bits[i, j, k // 64] is 1 if
+        voxel (i, j, k) is accessible. The array holds the buffer of the
+        calculation itself, not a copy.
+    shape: (nx, ny, nz)
+    origin: (x, y, z) of voxel (0, 0, 0)
+    spacing: edge length of the voxels
+    '''
+    def __init__(self, bits, shape, origin, spacing):
+        self.bits = bits
+        self.shape = tuple(int(n) for n in shape)
+        self.origin = numpy.asarray(origin, dtype=numpy.float64)
+        self.spacing = float(spacing)
+
+    def __repr__(self):
+        return "AccessibleGrid(shape={}, origin={}, spacing={})"\
+               .format(self.shape, tuple(float(x) for x in self.origin),
+                       self.spacing)
+
+    def unpack(self):
+        '''
+        shape (nx, ny, nz) boolean array; True where a voxel is accessible
+        '''
+        # bytes of little-endian words hold the voxels in order of k
+        octets = self.bits.astype('<u8', copy=False).view(numpy.uint8)
+        unpacked = numpy.unpackbits(octets, axis=-1, bitorder='little')
+        return unpacked[:,:,:self.shape[2]].view(numpy.bool_)
+
+    def count(self):
+        '''
+        Number of accessible voxels
+        '''
+        return int(numpy.unpackbits(self.bits.view(numpy.uint8)).sum())
+
+    def save(self, path):
+        '''
+        Write the grid to ``path``, a compressed .npz file that ``load`` reads
+        back.
+        '''
+        numpy.savez_compressed(path, bits=self.bits.astype('<u8', copy=False),
+                               shape=numpy.array(self.shape),
+                               origin=self.origin,
+                               spacing=numpy.array(self.spacing))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        The grid saved to ``path`` with ``save``
+        '''
+        with numpy.load(path) as f:
+            return cls(f['bits'].astype(numpy.uint64), f['shape'], f['origin'],
+                       f['spacing'])
+
+class VolumeStats(object):
+    '''
+    Counters and timings of one volume calculation, from a calculation with
+    ``stats=True``.
+
+    shape: (nx, ny, nz) of the voxel grid
+    voxels_visited: times the flood fill looked at a voxel. The parallel
+        labelling looks at every voxel once; the sparse engine counts every
+        brick it spreads from as 512 voxels.
+    voxels_accessible: voxels reached from the solvent
+    is_free_calls: voxels checked against the solute atoms, one by one
+    distance_evals: solute atoms checked against a voxel; for the raster
+        engine, the voxels checked against an atom
+    seeds: seed voxels the fill started from
+    fills: seeds that reached voxels no earlier seed had
+    queue_max: most spans (bricks for the sparse engine) waiting in the
+        queue of the flood fill at once
+    bytes_allocated: bytes of memory held by the buffers of the calculator,
+        the cell list, and the scratch memory of the fill
+    times: seconds spent in each of PHASES, and the 'total'
+    '''
+    def __init__(self, shape, voxels_visited, voxels_accessible,
+                 is_free_calls, distance_evals, seeds, fills, queue_max,
+                 bytes_allocated, times):
+        self.shape = shape
+        self.voxels_visited = voxels_visited
+        self.voxels_accessible = voxels_accessible
+        self.is_free_calls = is_free_calls
+        self.distance_evals = distance_evals
+        self.seeds = seeds
+        self.fills = fills
+        self.queue_max = queue_max
+        self.bytes_allocated = bytes_allocated
+        self.times = times
+
+    def __repr__(self):
+        return "VolumeStats(shape={}, voxels_visited={:d}, "\
+               "voxels_accessible={:d}, is_free_calls={:d}, "\
+               "distance_evals={:d}, seeds={:d}, fills={:d}, queue_max={:d}, "\
+               "bytes_allocated={:d}, total={:.6f} s)"\
+               .format(self.shape, self.voxels_visited,
+                       self.voxels_accessible, self.is_free_calls,
+                       self.distance_evals, self.seeds, self.fills,
+                       self.queue_max, self.bytes_allocated,
+                       self.times['total'])
+
+def grid_memory(int nx, int ny, int nz, str engine='celllist'):
+    '''
+    Bytes of memory used by the voxel grids of an (nx, ny, nz) calculation.
+    Each of the two grids stores one bit per voxel.  The queue of the flood
+    fill only holds its frontier, and is not included.  For the sparse engine,
+    this is the memory of the index of the bricks; the bricks near the surface
+    of the solute take 128 bytes each on top of that.  For the tiled engine,
+    this is the least memory budget it can work in, with slabs of one plane.
+    '''
+    _check_engine(engine)
+    if engine == 'sparse':
+        return sparseBytes(nx, ny, nz)
+    if engine == 'tiled':
+        return tiledBytes(nx, ny, nz)
+    return 2*bitGridBytes(nx, ny, nz)
+
+def _check_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine {!r}; choose one of {}"\
+                         .format(engine, ", ".join(ENGINES)))
+
+def _check_solute(solute_pos, solute_rad):
+    if (solute_pos.shape[1] != 3) or (solute_rad.shape[0] != solute_pos.shape[0]):
+        raise ValueError("Expected solute positions of shape (n, 3) and radii "\
+                         "of shape (n,), got {} and {}"\
+                         .format(solute_pos.shape, solute_rad.shape))
+
+def _check_kernel(kernel):
+    if kernel not in KERNELS:
+        raise ValueError("Unknown kernel {!r}; choose one of {}"\
+                         .format(kernel, ", ".join(KERNELS)))
+
+def _check_return_grid(engine, return_grid, box=None):
+    if return_grid and (engine in ('sparse', 'tiled')):
+        raise ValueError("The {} engine does not store the grid; use "\
+                         "another engine to return it".format(engine))
+    if return_grid and (box is not None):
+        raise ValueError("The grid of a periodic box cannot be returned")
+
+def _check_box(box):
+    # the edge lengths of a periodic box, given as (3,) edge lengths or as a
+    # (3, 3) matrix of box vectors
+    cell = numpy.array(box, dtype=numpy.float64)
+    if cell.shape == (3, 3):
+        if (cell[~numpy.eye(3, dtype=bool)] != 0).any():
+            raise ValueError("Only orthorhombic boxes are supported; the box "\
+                             "vectors must lie along x, y and z")
+        cell = cell.diagonal().copy()
+    if cell.shape != (3,):
+        raise ValueError("Expected a box of shape (3,) or (3, 3), got {}"\
+                         .format(cell.shape))
+    if not (cell > 0).all():
+        raise ValueError("The edges of the box must be positive, not {}"\
+                         .format(tuple(cell)))
+    return cell
+
+def _results(vol, VolumeCalculator calc, bint return_grid, bint stats):
+    # vol, followed by the grid and the stats of the last calculation of calc
+    # if they were asked for; the grid is None if the calculation failed
+    if not (return_grid or stats):
+        return vol
+    results = (vol,)
+    if return_grid:
+        results += (calc.take_grid() if calc.has_grid else None,)
+    if stats:
+        results += (calc.stats,)
+    return results
+
+cdef numpy.ndarray _near_solute(double* solute_pos, double* solute_rad,
+                                int nsolute,
+                                numpy.ndarray[numpy.float64_t, ndim=2] points,
+                                double shell):
+    # whether each point lies within ``shell`` of the surface of a solute
+    # atom, looking up the atoms near it in a cell list
+    cdef CellList* cells
+    cdef numpy.ndarray[numpy.uint8_t, ndim=1] near = \
+            numpy.zeros(points.shape[0], dtype=numpy.uint8)
+    cdef int i
+    with nogil:
+        cells = newCellList(solute_pos, solute_rad, nsolute, shell)
+    if not cells:
+        raise MemoryError("Failed to allocate cell list")
+    with nogil:
+        for i in range(points.shape[0]):
+            near[i] = not is_free_cells(points[i,0], points[i,1], points[i,2],
+                                        cells, shell, NULL)
+    delCellList(cells)
+    return near.view(bool)
+
+cdef object _solvation_shell(double* solute_pos, double* solute_rad,
+                             int nsolute, solute, solvent, double solvent_rad,
+                             double voxel_len, double shell, shape):
+    # The solvent molecules of volume_explicit_sol to keep, and the window of
+    # the grid to fill: (keep, origin, shape), with the origin and shape of the
+    # window in voxels, or None to keep every molecule. Positions are in the
+    # frame of the grid (voxel (0, 0, 0) at the origin).
+    #
+    # The window covers the solute and ``shell``, and at least the exclusion
+    # spheres of the atoms and two voxels more. Every voxel outside the window
+    # is then accessible and connected to the exterior, as are the voxels
+    # around molecules that are not near the solute. So the molecules inside
+    # the window that are inside the box of the exclusion spheres (which
+    # includes internal cavities) or within ``shell`` of an atom's surface are
+    # kept; the others only mark the exterior as reached, which one seed at
+    # the corner of the window does instead.
+    max_rad = solute[1].max()
+    cut = max_rad + solvent_rad
+    margin = max(max_rad + shell, cut) + 2*voxel_len
+    lo = solute[0].min(axis=0)
+    hi = solute[0].max(axis=0)
+    start = numpy.maximum(numpy.floor((lo - margin)/voxel_len), 0).astype(int)
+    stop = numpy.minimum(numpy.ceil((hi + margin)/voxel_len),
+                         numpy.array(shape) - 1).astype(int)
+    inside = ((solvent >= (start + 1)*voxel_len) &
+              (solvent <= (stop - 1)*voxel_len)).all(axis=1)
+    inner = ((solvent > lo - cut) & (solvent < hi + cut)).all(axis=1)
+    keep = inside & (inner | _near_solute(solute_pos, solute_rad, nsolute,
+                                          numpy.ascontiguousarray(solvent),
+                                          shell))
+    if keep.all():
+        return None
+    return keep, tuple(start), tuple(stop - start + 1)
+
+def _check_grid_shape(nx, ny, nz):
+    if max(nx, ny, nz) >= libc.limits.USHRT_MAX:
+        raise ValueError("The voxel grid contains too many voxels in the x, y, "\
+                         "or z dimension. The max number of voxels in any "\
+                         "direction is {:d} and the requested numbers of "\
+                         "voxels are ({:d},{:d},{:d})."\
+                         .format(libc.limits.USHRT_MAX - 1, nx, ny, nz))
+
+def _check_nthreads(nthreads):
+    if nthreads < 0:
+        raise ValueError("nthreads must be 0 (all cores) or a positive number "\
+                         "of threads, not {}".format(nthreads))
+
+cdef class VolumeCalculator:
+    '''
+    Volume calculations for a fixed solvent radius and voxel length. The
+    calculator keeps its buffers (voxel grids, copies of the coordinates and
+    the queue of the flood fill) from one calculation to the next, and only
+    grows them when a calculation needs a bigger box than any before. Call
+    ``close`` (or use the calculator in a ``with`` statement) to release them.
+
+    -----------
+    Parameters
+    -----------
+    solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    voxel_len: edge length of voxels
+    engine: see ``volume``
+    nthreads: see ``volume``
+    kernel: see ``volume``
+    grid_shape: (nx, ny, nz) of the largest grid expected, to allocate the
+        voxel grids up front; by default they are allocated by the first
+        calculation
+    stats: collect counters and timings; after each calculation, ``stats``
+        is the VolumeStats of the calculation (None if not collected)
+    memory_budget: see ``volume``
+    scratch_dir: see ``volume``
+
+    After a calculation, ``take_grid`` hands over its grid of accessible voxels.
+
+    A calculator must not be used by two threads at once, since its buffers
+    are shared between its calculations; give every thread a calculator of its
+    own. Failures raise MemoryError (buffers that could not be allocated) or
+    ValueError (grids too large to index).
+    '''
+    cdef readonly double solvent_rad
+    cdef readonly double voxel_len
+    cdef readonly str engine
+    cdef readonly int nthreads
+    cdef readonly str kernel
+    cdef readonly bint collect_stats
+    cdef readonly object stats
+    cdef readonly unsigned long memory_budget
+    cdef readonly object scratch_dir
+    cdef bytes scratch_path
+    cdef int solute_capacity
+    cdef double* solute_pos
+    cdef double* solute_rad
+    cdef long seed_capacity
+    cdef int* seeds
+    cdef BitGrid* grid
+    cdef BitGrid* visited_grid
+    cdef BitGrid* blocked
+    cdef Queue* queue
+    # whether self.grid holds the result of the last calculation, and the
+    # coordinates of its voxel (0, 0, 0)
+    cdef bint has_grid
+    cdef double origin[3]
+
+    def __cinit__(self):
+        self.solute_capacity = 0
+        self.solute_pos = NULL
+        self.solute_rad = NULL
+        self.seed_capacity = 0
+        self.seeds = NULL
+        self.grid = NULL
+        self.visited_grid = NULL
+        self.blocked = NULL
+        self.queue = NULL
+        self.has_grid = False
+
+    def __init__(self, double solvent_rad, double voxel_len,
+                 str engine='celllist', int nthreads=1, grid_shape=None,
+                 bint stats=False, str kernel='batch',
+                 memory_budget=MEMORY_BUDGET, scratch_dir=None):
+        _check_engine(engine)
+        _check_nthreads(nthreads)
+        _check_kernel(kernel)
+        if memory_budget <= 0:
+            raise ValueError("memory_budget must be a positive number of "\
+                             "bytes, not {}".format(memory_budget))
+        if (scratch_dir is not None) and not os.path.isdir(scratch_dir):
+            raise ValueError("scratch_dir {!r} is not a directory"\
+                             .format(scratch_dir))
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.scratch_path = None if scratch_dir is None\
+                            else os.fsencode(scratch_dir)
+        self.solvent_rad = solvent_rad
+        self.voxel_len = voxel_len
+        self.engine = engine
+        self.nthreads = nthreads
+        self.kernel = kernel
+        self.collect_stats = stats
+        self.stats = None
+        if grid_shape is not None:
+            nx, ny, nz = grid_shape
+            if self._reserve_grids(nx, ny, nz):
+                raise MemoryError("Failed to allocate voxel arrays")
+
+    def __dealloc__(self):
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Free the buffers. The calculator can still be used afterwards; it
+        allocates them again as needed.
+        '''
+        self._release()
+
+    def take_grid(self):
+        '''
+        The voxels accessible to solvent in the last calculation, as an
+        AccessibleGrid. The grid is handed over without copying it; the
+        calculator allocates a new one for its next calculation. The sparse
+        and tiled engines never store the whole grid, so they have none to
+        hand over.
+        '''
+        if not self.has_grid:
+            if self.engine in ('sparse', 'tiled'):
+                raise ValueError("The {} engine does not store the grid"\
+                                 .format(self.engine))
+            raise ValueError("No grid; it was taken already, or there was no "\
+                             "calculation yet")
+        bits = _words_array(self.grid)
+        shape = (self.grid.nx, self.grid.ny, self.grid.nz)
+        self.grid = NULL
+        self.has_grid = False
+        return AccessibleGrid(bits, shape, (self.origin[0], self.origin[1],
+                                            self.origin[2]), self.voxel_len)
+
+    property grid_capacity:
+        '''
+        Bytes of memory currently held by the voxel grids
+        '''
+        def __get__(self):
+            cdef unsigned long nbytes = 0
+            for bitgrid in (<long>self.grid, <long>self.visited_grid,
+                            <long>self.blocked):
+                if bitgrid:
+                    nbytes += (<BitGrid*>bitgrid).capacity*8
+            return nbytes
+
+    cdef void _release(self):
+        self.has_grid = False
+        free(self.solute_pos)
+        free(self.solute_rad)
+        free(self.seeds)
+        self.solute_pos = NULL
+        self.solute_rad = NULL
+        self.seeds = NULL
+        self.solute_capacity = 0
+        self.seed_capacity = 0
+        if self.grid:
+            delBitGrid(self.grid)
+            self.grid = NULL
+        if self.visited_grid:
+            delBitGrid(self.visited_grid)
+            self.visited_grid = NULL
+        if self.blocked:
+            delBitGrid(self.blocked)
+            self.blocked = NULL
+        if self.queue:
+            delQueue(self.queue)
+            self.queue = NULL
+
+    cdef int _reserve_solute(self, int nsolute):
+        # make room for nsolute solute atoms; returns 1 if memory could not be
+        # allocated
+        if nsolute <= self.solute_capacity:
+            return 0
+        free(self.solute_pos)
+        free(self.solute_rad)
+        self.solute_capacity = 0
+        self.solute_pos = <double *>malloc(nsolute*3*sizeof(double))
+        self.solute_rad = <double *>malloc(nsolute*sizeof(double))
+        if (not self.solute_pos) or (not self.solute_rad):
+            return 1
+        self.solute_capacity = nsolute
+        return 0
+
+    cdef int _reserve_seeds(self, long nseeds):
+        # make room for nseeds seed voxels of floodfill_parallel
+        if nseeds <= self.seed_capacity:
+            return 0
+        free(self.seeds)
+        self.seed_capacity = 0
+        self.seeds = <int *>malloc(3*nseeds*sizeof(int))
+        if not self.seeds:
+            return 1
+        self.seed_capacity = nseeds
+        return 0
+
+    cdef int _reserve_grids(self, int nx, int ny, int nz):
+        # make the grids needed by the engine empty (nx, ny, nz) grids; returns
+        # 1 if memory could not be allocated. The raster engine keeps track of
+        # blocked voxels in a grid of its own instead of visited_grid, and the
+        # parallel labelling needs no visited_grid either. The sparse and tiled
+        # engines need no grids at all.
+        if self.engine in ('sparse', 'tiled'):
+            return 0
+        if _reuse_grid(&self.grid, nx, ny, nz):
+            return 1
+        if (self.engine != 'raster') and (self.nthreads == 1):
+            if _reuse_grid(&self.visited_grid, nx, ny, nz):
+                return 1
+        if self.engine == 'raster':
+            if _reuse_grid(&self.blocked, nx, ny, nz):
+                return 1
+        if (self.nthreads == 1) and (not self.queue):
+            self.queue = newQueue(1024)
+            if not self.queue:
+                return 1
+        return 0
+
+    cdef void _record(self, FillStats* counters, int nx, int ny, int nz,
+                      long ptcnt, unsigned long cells_bytes, double* t):
+        # make self.stats the VolumeStats of a calculation, with the times
+        # t[0] ... t[len(PHASES)] at the start and end of each phase
+        cdef unsigned long nbytes = self.grid_capacity + cells_bytes +\
+                counters.bytes
+        nbytes += 4*self.solute_capacity*sizeof(double)
+        nbytes += 3*self.seed_capacity*sizeof(int)
+        if self.queue:
+            nbytes += self.queue.capacity*sizeof(Span)
+        times = dict((phase, t[i+1] - t[i]) for i, phase in enumerate(PHASES))
+        times['total'] = t[len(PHASES)] - t[0]
+        self.stats = VolumeStats((nx, ny, nz), counters.visited, ptcnt,
+                                 counters.is_free_calls,
+                                 counters.distance_evals, counters.seeds,
+                                 counters.fills, counters.queue_max, nbytes,
+                                 times)
+
+    cdef int _load_radii(self,
+                         numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad):
+        # make room for the solute and copy the radii; the positions are
+        # copied later, once the shift of the grid is known. Returns 1 if
+        # memory could not be allocated.
+        cdef int i
+        if self._reserve_solute(_solute_rad.shape[0]):
+            return 1
+        for i in range(_solute_rad.shape[0]):
+            self.solute_rad[i] = _solute_rad[i]
+        return 0
+
+    cpdef double volume(self,
+                        numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                        numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad,
+                        box=None) except? -1:
+        '''
+        Same as the ``volume`` function of this module, with the solvent
+        radius, voxel length, engine and number of threads of the calculator.
+        '''
+        _check_solute(_solute_pos, _solute_rad)
+        if self._load_radii(_solute_rad):
+            raise MemoryError("Failed to allocate arrays")
+        if box is not None:
+            return self._volume_periodic(_solute_pos, _check_box(box), None)
+        return self._volume(_solute_pos, _solute_rad.max())
+
+    cdef double _volume_periodic(self,
+                        numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                        numpy.ndarray[numpy.float64_t, ndim=1] cell,
+                        solvent_pos) except? -1:
+        # volume() (if solvent_pos is None) or volume_explicit_sol() of the
+        # solute, with radii already in self.solute_rad, in a periodic box with
+        # edge lengths ``cell``. The grid is the box itself, with voxel
+        # (0, 0, 0) at the origin; the voxels are shrunk along each edge to fit
+        # a whole number of them into the box.
+        cdef:
+            int nx, ny, nz
+            int nsolute = _solute_pos.shape[0]
+            int nseeds = 0
+            int i
+            double solvent_rad = self.solvent_rad
+            double* solute_pos = self.solute_pos
+            double* solute_rad = self.solute_rad
+            double* cellp = <double*>cell.data
+            int* seeds = NULL
+            long ptcnt = 0
+            double vol
+            numpy.ndarray[numpy.float64_t, ndim=2] wrapped
+            numpy.ndarray[numpy.int32_t, ndim=2] corners
+            FillStats counters
+            FillStats* stats = NULL
+            double t[8]
+
+        t[0] = _now()
+        if self.collect_stats:
+            memset(&counters, 0, sizeof(FillStats))
+            stats = &counters
+        self.stats = None
+        self.has_grid = False
+
+        shape = numpy.maximum(numpy.ceil(cell/self.voxel_len), 1).astype(int)
+        nx, ny, nz = shape
+        if nz >= libc.limits.USHRT_MAX:
+            raise ValueError("A periodic box takes at most {:d} voxels along "\
+                             "z, not {:d}".format(libc.limits.USHRT_MAX - 1, nz))
+        spacing = cell/shape
+
+        # Every atom goes into the box; the images of an atom all block the
+        # same voxels.
+        wrapped = numpy.ascontiguousarray(numpy.mod(_solute_pos, cell))
+        for i in range(nsolute):
+            solute_pos[3*i]   = wrapped[i,0]
+            solute_pos[3*i+1] = wrapped[i,1]
+            solute_pos[3*i+2] = wrapped[i,2]
+
+        # As without a box, each water seeds the (up to) 8 voxels around it,
+        # wrapped into the box.
+        if solvent_pos is not None:
+            frac = numpy.mod(solvent_pos, cell)/spacing
+            ends = (numpy.floor(frac).astype(int), numpy.ceil(frac).astype(int))
+            corners = numpy.ascontiguousarray(numpy.concatenate(
+                [numpy.column_stack((ends[a][:,0], ends[b][:,1], ends[c][:,2]))
+                 for a in (0, 1) for b in (0, 1) for c in (0, 1)]) % shape,
+                dtype=numpy.int32)
+            nseeds = corners.shape[0]
+            seeds = <int*>corners.data
+
+        t[1] = _now()
+        if _reuse_grid(&self.grid, nx, ny, nz) or\
+                _reuse_grid(&self.blocked, nx, ny, nz):
+            raise MemoryError("Failed to allocate voxel arrays")
+        t[2] = _now()
+        t[3] = t[2]
+        t[4] = t[2]
+        t[5] = t[2]
+        cdef BitGrid* grid = self.grid
+        cdef BitGrid* blocked = self.blocked
+
+        with nogil:
+            # rasterizing the atoms and labelling the runs are done together
+            ptcnt = floodfill_periodic(seeds, nseeds, cellp, solute_pos,
+                                       solute_rad, nsolute, solvent_rad,
+                                       blocked, grid, stats)
+            t[6] = _now()
+            vol = (1-float(ptcnt)/(float(nx)*ny*nz))*cellp[0]*cellp[1]*cellp[2]
+            t[7] = _now()
+
+        if ptcnt < 0:
+            raise MemoryError("Failed to allocate voxel arrays")
+        if stats:
+            self._record(stats, nx, ny, nz, ptcnt, 0, t)
+        return vol
+
+    cdef double _volume(self,
+                        numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                        double max_rad) except? -1:
+        # volume() of the solute with radii already in self.solute_rad
+        cdef:
+            double box_buffer 
+            double x_min, y_min, z_min
+            double x_max, y_max, z_max
+            int nx, ny, nz
+            double x, y, z
+            int ix, iy, iz
+            int nsolute = _solute_pos.shape[0]
+            int i
+            double voxel_len = self.voxel_len
+            double solvent_rad = self.solvent_rad
+            int nthreads = self.nthreads
+            int nraster
+            bint sparse = self.engine == 'sparse'
+            bint tiled = self.engine == 'tiled'
+            bint parallel = (nthreads != 1) and not (sparse or tiled)
+            unsigned long budget = self.memory_budget
+            const char* scratch = NULL
+            double* solute_pos = self.solute_pos
+            double* solute_rad = self.solute_rad
+            FillStats counters
+            FillStats* stats = NULL
+            double t[8]
+
+        t[0] = _now()
+        if self.collect_stats:
+            memset(&counters, 0, sizeof(FillStats))
+            stats = &counters
+        self.stats = None
+        self.has_grid = False
+
+        # We want the grids to be large enough that solvent can completely
+        # surround the solute; calculate a buffer size to do this.
+        box_buffer = 2*(max_rad + solvent_rad)
+        x_min = _solute_pos[:,0].min()
+        y_min = _solute_pos[:,1].min()
+        z_min = _solute_pos[:,2].min()
+
+        x_max = _solute_pos[:,0].max()
+        y_max = _solute_pos[:,1].max()
+        z_max = _solute_pos[:,2].max()
+
+        # assign solute_pos, shifted by the appropriate amount
+        with nogil:
+            for i in range(nsolute):
+                solute_pos[3*i]   = _solute_pos[i,0]
+                solute_pos[3*i+1] = _solute_pos[i,1]
+                solute_pos[3*i+2] = _solute_pos[i,2]
+                solute_pos[3*i]   += (-1*x_min + box_buffer)
+                solute_pos[3*i+1] += (-1*y_min + box_buffer)
+                solute_pos[3*i+2] += (-1*z_min + box_buffer)
+
+        # the extreme values for the (rectangular) grid
+        x_min -= box_buffer
+        y_min -= box_buffer
+        z_min -= box_buffer
+        x_max += box_buffer
+        y_max += box_buffer
+        z_max += box_buffer
+
+        # Find the number of voxels to use; avoid fencepost error
+        #
+        #        * -- * -- * -- * -- * -- * -- *
+        #        1    2    3    4    5    6    7 
+        # 
+        nx = numpy.ceil((x_max - x_min)/voxel_len) + 1
+        ny = numpy.ceil((y_max - y_min)/voxel_len) + 1
+        nz = numpy.ceil((z_max - z_min)/voxel_len) + 1
+        if tiled and (nz >= libc.limits.USHRT_MAX):
+            raise ValueError("The tiled engine takes at most {:d} voxels along "\
+                             "z, not {:d}".format(libc.limits.USHRT_MAX - 1, nz))
+        if not (sparse or tiled):
+            _check_grid_shape(nx, ny, nz)
+        if self.scratch_path is not None:
+            scratch = self.scratch_path
+
+        t[1] = _now()
+        # one bit per voxel; the grids start out zeroed
+        if self._reserve_grids(nx, ny, nz):
+            raise MemoryError("Failed to allocate voxel arrays")
+
+        t[2] = _now()
+        cdef CellList* cells = _build_cells(self.engine, solute_pos, solute_rad,
+                                            nsolute, solvent_rad)
+        t[3] = _now()
+        nraster = _rasterize(self.engine, self.kernel, &self.blocked, nx, ny,
+                             nz, voxel_len, solute_pos, solute_rad, nsolute,
+                             solvent_rad, nthreads, not parallel,
+                             &counters.distance_evals if stats else NULL)
+        t[4] = _now()
+        cdef BitGrid* grid = self.grid
+        cdef BitGrid* visited_grid = self.visited_grid
+        cdef BitGrid* blocked = self.blocked
+        cdef Queue* queue = self.queue
+
+        cdef int seed[3]
+        cdef bint start
+        cdef int failed = 0
+        cdef long ptcnt = 0
+        cdef double vol
+
+        with nogil:
+            # flood-fill from the corner
+            ix = 0
+            iy = 0
+            iz = 0
+            x = 0
+            y = 0
+            z = 0
+
+            seed[0] = ix
+            seed[1] = iy
+            seed[2] = iz
+            start = _is_free(x, y, z, solute_pos, solute_rad, nsolute,
+                             solvent_rad, cells, stats)
+            t[5] = _now()
+            if start:
+                if sparse:
+                    ptcnt = floodfill_sparse(seed, 1, nx, ny, nz, voxel_len,
+                                             solute_pos, solute_rad, nsolute,
+                                             solvent_rad, stats)
+                    failed = ptcnt < 0
+                elif tiled:
+                    ptcnt = floodfill_tiled(seed, 1, nx, ny, nz, voxel_len,
+                                            solute_pos, solute_rad, nsolute,
+                                            solvent_rad, budget, scratch,
+                                            nthreads, stats)
+                    failed = ptcnt < 0
+                elif parallel:
+                    failed = floodfill_parallel(seed, 1, voxel_len, grid,
+                                                solute_pos, solute_rad, nraster,
+                                                solvent_rad, cells, blocked,
+                                                nthreads, stats)
+                else:
+                    failed = floodfill(ix, iy, iz, voxel_len, visited_grid,
+                                       grid, solute_pos, solute_rad, nsolute,
+                                       solvent_rad, cells, blocked, queue,
+                                       stats)
+            t[6] = _now()
+
+            #find the volume
+            if not (sparse or tiled):
+                ptcnt = countBits(grid)
+
+            vol = (1-float(ptcnt)/(float(nx)*ny*nz))*(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
+            t[7] = _now()
+
+        if failed:
+            if cells:
+                delCellList(cells)
+            raise MemoryError("Failed to allocate voxel arrays")
+        if stats:
+            self._record(stats, nx, ny, nz, ptcnt, _cells_bytes(cells, nsolute),
+                         t)
+        if cells:
+            delCellList(cells)
+        self.has_grid = not (sparse or tiled)
+        self.origin[0] = x_min
+        self.origin[1] = y_min
+        self.origin[2] = z_min
+        return vol
+
+    cpdef double volume_explicit_sol(self,
+                        numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos, 
+                        numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad, 
+                        numpy.ndarray[numpy.float64_t, ndim=2] _solvent_pos,
+                        solvent_shell=None, box=None) except? -1:
+        '''
+        Same as the ``volume_explicit_sol`` function of this module, with the
+        solvent radius, voxel length, engine and number of threads of the
+        calculator.
+        '''
+        cdef:
+            double box_buffer 
+            double x_min, y_min, z_min
+            double x_max, y_max, z_max
+            int nx, ny, nz
+            double x, y, z, X, Y, Z
+            double solx, soly, solz
+            double shiftx, shifty, shiftz
+            int ox = 0, oy = 0, oz = 0
+            double offx = 0, offy = 0, offz = 0
+            double nfull
+            long outside = 0
+            bint cropped = False
+            int nsolute = _solute_pos.shape[0]
+            int nsolvent = _solvent_pos.shape[0]
+            int i
+            double voxel_len = self.voxel_len
+            double solvent_rad = self.solvent_rad
+            int nthreads = self.nthreads
+            int nraster
+            bint sparse = self.engine == 'sparse'
+            bint tiled = self.engine == 'tiled'
+            bint parallel = (nthreads != 1) and not (sparse or tiled)
+            unsigned long budget = self.memory_budget
+            const char* scratch = NULL
+            FillStats counters
+            FillStats* stats = NULL
+            double t[8]
+
+        t[0] = _now()
+        if self.collect_stats:
+            memset(&counters, 0, sizeof(FillStats))
+            stats = &counters
+        self.stats = None
+        self.has_grid = False
+        _check_solute(_solute_pos, _solute_rad)
+        if self._load_radii(_solute_rad):
+            raise MemoryError("Failed to allocate arrays")
+        if _solvent_pos.shape[1] != 3:
+            raise ValueError("Expected solvent positions of shape (m, 3), got "\
+                             "{}".format((_solvent_pos.shape[0],
+                                          _solvent_pos.shape[1])))
+        if box is not None:
+            if solvent_shell is not None:
+                raise ValueError("solvent_shell cannot be used with a "\
+                                 "periodic box")
+            return self._volume_periodic(_solute_pos, _check_box(box),
+                                         _solvent_pos)
+
+        # We want the grids to be large enough that solvent can completely
+        # surround the solute; calculate a buffer size to do this.
+        box_buffer = 2*(_solute_rad.max() + solvent_rad)
+        x_min = min(_solute_pos[:,0].min(), _solvent_pos[:,0].min())
+        y_min = min(_solute_pos[:,1].min(), _solvent_pos[:,1].min())
+        z_min = min(_solute_pos[:,2].min(), _solvent_pos[:,2].min())
+
+        x_max = max(_solute_pos[:,0].max(), _solvent_pos[:,0].max())
+        y_max = max(_solute_pos[:,1].max(), _solvent_pos[:,1].max())
+        z_max = max(_solute_pos[:,2].max(), _solvent_pos[:,2].max())
+
+        cdef double* solute_pos = self.solute_pos
+        cdef double* solute_rad = self.solute_rad
+
+        # assign solute_pos, shifted by the appropriate amount; the solvent
+        # positions are shifted by the same amount below
+        shiftx = -1*x_min + box_buffer
+        shifty = -1*y_min + box_buffer
+        shiftz = -1*z_min + box_buffer
+        with nogil:
+            for i in range(nsolute):
+                solute_pos[3*i]   = _solute_pos[i,0]
+                solute_pos[3*i+1] = _solute_pos[i,1]
+                solute_pos[3*i+2] = _solute_pos[i,2]
+                solute_pos[3*i]   += shiftx
+                solute_pos[3*i+1] += shifty
+                solute_pos[3*i+2] += shiftz
+
+        # the extreme values for the (rectangular) grid
+        x_min -= box_buffer
+        y_min -= box_buffer
+        z_min -= box_buffer
+        x_max += box_buffer
+        y_max += box_buffer
+        z_max += box_buffer
+
+        # Find the number of voxels to use; avoid fencepost error
+        #
+        #        * -- * -- * -- * -- * -- * -- *
+        #        1    2    3    4    5    6    7 
+        # 
+        nx = numpy.ceil((x_max - x_min)/voxel_len) + 1
+        ny = numpy.ceil((y_max - y_min)/voxel_len) + 1
+        nz = numpy.ceil((z_max - z_min)/voxel_len) + 1
+        nfull = float(nx)*ny*nz
+
+        # only fill the part of the grid around the solute and the solvent
+        # near it; the voxels outside are added back to the count below
+        if solvent_shell is not None:
+            crop = _solvation_shell(solute_pos, solute_rad, nsolute,
+                                    (_solute_pos + (shiftx, shifty, shiftz),
+                                     _solute_rad),
+                                    _solvent_pos + (shiftx, shifty, shiftz),
+                                    solvent_rad, voxel_len, solvent_shell,
+                                    (nx, ny, nz))
+            if crop is not None:
+                keep, (ox, oy, oz), (nx, ny, nz) = crop
+                cropped = True
+                outside = <long>nfull - <long>nx*ny*nz
+                _solvent_pos = numpy.ascontiguousarray(_solvent_pos[keep])
+                nsolvent = _solvent_pos.shape[0]
+                offx = ox*voxel_len
+                offy = oy*voxel_len
+                offz = oz*voxel_len
+                for i in range(nsolute):
+                    solute_pos[3*i]   -= offx
+                    solute_pos[3*i+1] -= offy
+                    solute_pos[3*i+2] -= offz
+        if tiled and (nz >= libc.limits.USHRT_MAX):
+            raise ValueError("The tiled engine takes at most {:d} voxels along "\
+                             "z, not {:d}".format(libc.limits.USHRT_MAX - 1, nz))
+        if not (sparse or tiled):
+            _check_grid_shape(nx, ny, nz)
+        if self.scratch_path is not None:
+            scratch = self.scratch_path
+
+        t[1] = _now()
+        # one bit per voxel; the grids start out zeroed. Every water gives up
+        # to 8 seed voxels.
+        if self._reserve_grids(nx, ny, nz) or\
+                self._reserve_seeds(8*nsolvent + 1):
+            raise MemoryError("Failed to allocate voxel arrays")
+
+        t[2] = _now()
+        cdef CellList* cells = _build_cells(self.engine, solute_pos, solute_rad,
+                                            nsolute, solvent_rad)
+        t[3] = _now()
+        nraster = _rasterize(self.engine, self.kernel, &self.blocked, nx, ny,
+                             nz, voxel_len, solute_pos, solute_rad, nsolute,
+                             solvent_rad, nthreads, not parallel,
+                             &counters.distance_evals if stats else NULL)
+        t[4] = _now()
+        cdef BitGrid* grid = self.grid
+        cdef BitGrid* visited_grid = self.visited_grid
+        cdef BitGrid* blocked = self.blocked
+        cdef Queue* queue = self.queue
+        cdef int* seeds = self.seeds
+        cdef int nseeds = 0
+        cdef int failed = 0
+        cdef long ptcnt = 0
+        cdef double vol
+
+        with nogil:
+            # 
+            # The algorithm:
+            #   For each water molecule, consider which grid points are possible
+            #   by moving that molecule around. The molecule is approximated by
+            #   a sphere of size ``solvent_rad``, and it cannot move to voxel
+            #   centers where the sphere of radius ``solvent_rad`` centered at
+            #   that point would overlap with any of the spheres centered at a
+            #   coordinate in ``solute_pos``, with the corresponding radius
+            #   from ``solute_rad``. This process is repeated for every water
+            #   molecule.
+            # 
+            for i in range(nsolvent):
+                solx = _solvent_pos[i,0] + shiftx - offx
+                soly = _solvent_pos[i,1] + shifty - offy
+                solz = _solvent_pos[i,2] + shiftz - offz
+
+                # The water falls between 8 voxel coordinates
+                #
+                #
+                #          * -------- *
+                #          |\         |\
+                #          | \     |  | \
+                #          |  \    |  |  \ 
+                #          |   * -------- *
+                #          * --|---w--*   |
+                #           \  |   |   \  |
+                #            \ |   |    \ |
+                #             \|         \|
+                #              * -------- *
+                #
+                x = floor(solx/voxel_len)*voxel_len
+                X = ceil(solx/voxel_len)*voxel_len
+                y = floor(soly/voxel_len)*voxel_len
+                Y = ceil(soly/voxel_len)*voxel_len
+                z = floor(solz/voxel_len)*voxel_len
+                Z = ceil(solz/voxel_len)*voxel_len
+
+                # the water can move to any of the following, unless a
+                # solute molecule would overlap a solvent placed there:
+                #  (x,y,z)
+                #  (x,y,Z)
+                #  (x,Y,z)
+                #  (x,Y,Z)
+                #  (X,y,z)
+                #  (X,y,Z)
+                #  (X,Y,z)
+                #  (X,Y,Z)
+                # Collect these seeds first, and flood fill from all of them
+                # at once.
+                nseeds = _add_seed(seeds, nseeds, x, y, z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, x, y, Z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, x, Y, z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, x, Y, Z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, X, y, z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, X, y, Z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, X, Y, z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+                nseeds = _add_seed(seeds, nseeds, X, Y, Z, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+            # the solvent left out of the cropped grid reaches the exterior
+            if cropped:
+                nseeds = _add_seed(seeds, nseeds, 0, 0, 0, voxel_len,
+                                   solute_pos, solute_rad, nsolute,
+                                   solvent_rad, cells, stats)
+
+            t[5] = _now()
+            if sparse:
+                ptcnt = floodfill_sparse(seeds, nseeds, nx, ny, nz, voxel_len,
+                                         solute_pos, solute_rad, nsolute,
+                                         solvent_rad, stats)
+                failed = ptcnt < 0
+            elif tiled:
+                ptcnt = floodfill_tiled(seeds, nseeds, nx, ny, nz, voxel_len,
+                                        solute_pos, solute_rad, nsolute,
+                                        solvent_rad, budget, scratch, nthreads,
+                                        stats)
+                failed = ptcnt < 0
+            elif parallel:
+                failed = floodfill_parallel(seeds, nseeds, voxel_len, grid,
+                                            solute_pos, solute_rad, nraster,
+                                            solvent_rad, cells, blocked,
+                                            nthreads, stats)
+            else:
+                failed = floodfill_multi(seeds, nseeds, voxel_len,
+                                         visited_grid, grid, solute_pos,
+                                         solute_rad, nsolute, solvent_rad,
+                                         cells, blocked, queue, stats)
+            t[6] = _now()
+
+            #find the volume
+            if not (sparse or tiled):
+                ptcnt = countBits(grid)
 
-cpdef double volume_explicit_sol(
+            vol = (1-float(ptcnt + outside)/nfull)*(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
+            t[7] = _now()
+
+        if failed:
+            if cells:
+                delCellList(cells)
+            raise MemoryError("Failed to allocate voxel arrays")
+        if stats:
+            self._record(stats, nx, ny, nz, ptcnt, _cells_bytes(cells, nsolute),
+                         t)
+        if cells:
+            delCellList(cells)
+        self.has_grid = not (sparse or tiled)
+        self.origin[0] = x_min + offx
+        self.origin[1] = y_min + offy
+        self.origin[2] = z_min + offz
+        return vol
+
+def volume_explicit_sol(
                     numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos, 
                     numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad, 
                     numpy.ndarray[numpy.float64_t, ndim=2] _solvent_pos, 
                     double _solvent_rad,
-                    double _voxel_len) except -1:
+                    double _voxel_len,
+                    str engine='celllist',
+                    int nthreads=1,
+                    bint return_grid=False,
+                    bint stats=False,
+                    str kernel='batch',
+                    memory_budget=MEMORY_BUDGET,
+                    scratch_dir=None,
+                    solvent_shell=None,
+                    box=None):
     '''
     -----------
     Parameters
@@ -39,332 +1379,223 @@ cpdef double volume_explicit_sol(
     _solvent_pos: shape (m,3) array of (x,y,z) coordinates of solvent atoms
     _solvent_rad: solvent molecule radius; solvent is approximated as sphere
     _voxel_len: edge length of voxels
+    engine: how to decide whether solvent fits at a voxel; 'celllist' (default)
+        checks only solute atoms in neighboring cells of a cell list, 'linear'
+        checks every solute atom, 'raster' marks the voxels covered by each
+        solute atom before the flood fill, 'sparse' only stores the voxels
+        near the surface of the solute, for grids too fine to fit in memory,
+        'tiled' goes through the grid in slabs that fit in ``memory_budget``
+    nthreads: number of threads; with more than one thread, the connected
+        regions of accessible voxels are labelled in parallel instead of flood
+        filled. 0 uses all cores. The volume does not depend on nthreads.
+        Ignored by the sparse engine.
+    return_grid: also return the AccessibleGrid of the voxels accessible to
+        solvent; not for the sparse and tiled engines
+    stats: also return the VolumeStats (counters and timings) of the
+        calculation
+    kernel: how the raster engine checks voxels against the atoms; 'batch'
+        (default) checks the voxels of a row together, with squared distances
+        that the compiler vectorizes, 'scalar' one voxel at a time. Both give
+        the same volume. 'batch32' is the same as 'batch' in single precision:
+        faster, but voxels within about 1e-6 (relative) of an exclusion
+        sphere can be decided differently. Ignored by the other engines.
+    memory_budget: bytes of memory the tiled engine sizes its slabs by
+        (default MEMORY_BUDGET); it needs at least ``grid_memory(nx, ny, nz,
+        'tiled')``, and uses more if the budget is below that. Ignored by the
+        other engines.
+    scratch_dir: directory in which the tiled engine keeps the blocked voxels
+        of a slab, in a memory-mapped file that is removed right away; by
+        default they are kept in memory. Ignored by the other engines.
+    solvent_shell: only seed the fill from the solvent molecules within this
+        distance of the surface of a solute atom (or inside the box around
+        the exclusion spheres of the solute, where internal cavities lie),
+        and only fill the part of the grid around the solute and this shell.
+        The molecules left out all lie in the exterior, so the volume is the
+        same as without it, which for a full box of water takes a grid many
+        times larger. A returned grid only covers the part that was filled.
+        Not with ``box``.
+    box: edge lengths (x, y, z) of a periodic box, or its (3, 3) matrix of
+        box vectors, which must lie along x, y and z; see ``volume``
 
     -------------
     Returns
     -------------
-    The volume that is accessible to the centers of the water molecules
+    The volume that is accessible to the centers of the water molecules; if
+    ``return_grid`` or ``stats``, a tuple of the volume, the AccessibleGrid (if
+    ``return_grid``) and the VolumeStats (if ``stats``)
     '''
-    cdef:
-        double box_buffer 
-        double x_min, y_min, z_min
-        double x_max, y_max, z_max
-        int nx, ny, nz
-        double x, y, z, X, Y, Z
-        int ix, iy, iz, iX, iY, iZ
-        double solx, soly, solz
-        int nsolute = _solute_pos.shape[0]
-        int nsolvent = _solvent_pos.shape[0]
-        int i, j, k
-        double voxel_len = _voxel_len
-        double solvent_rad = _solvent_rad
-
-    # We want the grids to be large enough that solvent can completely surround
-    # the solute; calculate a buffer size to do this.
-    box_buffer = 2*(_solute_rad.max() + solvent_rad)
-    x_min = min(_solute_pos[:,0].min(), _solvent_pos[:,0].min())
-    y_min = min(_solute_pos[:,1].min(), _solvent_pos[:,1].min())
-    z_min = min(_solute_pos[:,2].min(), _solvent_pos[:,2].min())
-
-    x_max = max(_solute_pos[:,0].max(), _solvent_pos[:,0].max())
-    y_max = max(_solute_pos[:,1].max(), _solvent_pos[:,1].max())
-    z_max = max(_solute_pos[:,2].max(), _solvent_pos[:,2].max())
-
-    cdef:
-        # Have Cython convert the arrays with a leading underscore from numpy
-        # arrays to c-style arrays
-        double *solute_pos = <double *>malloc(nsolute*3*sizeof(double))
-        double *solute_rad = <double *>malloc(nsolute*sizeof(double))
-        double *solvent_pos = <double *>malloc(nsolvent*3*sizeof(double))
-        double *solvent_floor = <double *>malloc(nsolvent*3*sizeof(double))
-        double *solvent_ceil = <double *>malloc(nsolvent*3*sizeof(double))
-    if (not solute_pos) or (not solute_rad) or (not solvent_pos) or\
-            (not solvent_floor) or (not solvent_ceil):
-        print("Failed to allocate arrays")
-        return -1
-    
+    _check_return_grid(engine, return_grid, box)
+    with VolumeCalculator(_solvent_rad, _voxel_len, engine=engine,
+                          nthreads=nthreads, stats=stats,
+                          kernel=kernel, memory_budget=memory_budget,
+                          scratch_dir=scratch_dir) as calc:
+        vol = calc.volume_explicit_sol(_solute_pos, _solute_rad, _solvent_pos,
+                                       solvent_shell, box)
+        return _results(vol, calc, return_grid, stats)
 
-    # assign solute_pos, solute_rad, and solvent_pos
-    with nogil:
-        for i in range(nsolute):
-            solute_pos[3*i]   = _solute_pos[i,0]
-            solute_pos[3*i+1] = _solute_pos[i,1]
-            solute_pos[3*i+2] = _solute_pos[i,2]
-            solute_rad[i] = _solute_rad[i]
-        for i in range(nsolvent):
-            solvent_pos[3*i]   = _solvent_pos[i,0]
-            solvent_pos[3*i+1] = _solvent_pos[i,1]
-            solvent_pos[3*i+2] = _solvent_pos[i,2]
-            solvent_floor[3*i]   = 0
-            solvent_floor[3*i+1] = 0
-            solvent_floor[3*i+2] = 0
-            solvent_ceil[3*i]   = 0
-            solvent_ceil[3*i+1] = 0
-            solvent_ceil[3*i+2] = 0
-
-
-
-    # shift the solute positions by the appropriate amount
-    with nogil:
-        for i in range(nsolute):
-            solute_pos[3*i]   += (-1*x_min + box_buffer)
-            solute_pos[3*i+1] += (-1*y_min + box_buffer)
-            solute_pos[3*i+2] += (-1*z_min + box_buffer)
-        for i in range(nsolvent):
-            solvent_pos[3*i]   += (-1*x_min + box_buffer)
-            solvent_pos[3*i+1] += (-1*y_min + box_buffer)
-            solvent_pos[3*i+2] += (-1*z_min + box_buffer)
-    
+def volume(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos, 
+           numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad, 
+           double _solvent_rad,
+           double _voxel_len,
+           str engine='celllist',
+           int nthreads=1,
+           bint return_grid=False,
+           bint stats=False,
+           str kernel='batch',
+           memory_budget=MEMORY_BUDGET,
+           scratch_dir=None,
+           box=None):
+    '''
+    -----------
+    Parameters
+    -----------
+    _solute_pos: shape (n,3) array of (x,y,z) coordinates of solute atoms
+    _solute_rad: shape (n,) array of solute atom radii
+    _solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    _voxel_len: edge length of voxels
+    engine: how to decide whether solvent fits at a voxel; 'celllist' (default)
+        checks only solute atoms in neighboring cells of a cell list, 'linear'
+        checks every solute atom, 'raster' marks the voxels covered by each
+        solute atom before the flood fill, 'sparse' only stores the voxels
+        near the surface of the solute, for grids too fine to fit in memory,
+        'tiled' goes through the grid in slabs that fit in ``memory_budget``
+    nthreads: number of threads; with more than one thread, the connected
+        regions of accessible voxels are labelled in parallel instead of flood
+        filled. 0 uses all cores. The volume does not depend on nthreads.
+        Ignored by the sparse engine.
+    return_grid: also return the AccessibleGrid of the voxels accessible to
+        solvent; not for the sparse and tiled engines
+    stats: also return the VolumeStats (counters and timings) of the
+        calculation
+    kernel: how the raster engine checks voxels against the atoms; 'batch'
+        (default) checks the voxels of a row together, with squared distances
+        that the compiler vectorizes, 'scalar' one voxel at a time. Both give
+        the same volume. 'batch32' is the same as 'batch' in single precision:
+        faster, but voxels within about 1e-6 (relative) of an exclusion
+        sphere can be decided differently. Ignored by the other engines.
+    memory_budget: bytes of memory the tiled engine sizes its slabs by
+        (default MEMORY_BUDGET); it needs at least ``grid_memory(nx, ny, nz,
+        'tiled')``, and uses more if the budget is below that. Ignored by the
+        other engines.
+    scratch_dir: directory in which the tiled engine keeps the blocked voxels
+        of a slab, in a memory-mapped file that is removed right away; by
+        default they are kept in memory. Ignored by the other engines.
+    box: edge lengths (x, y, z) of a periodic box, or its (3, 3) matrix of
+        box vectors, which must lie along x, y and z (triclinic boxes are not
+        supported). The grid is then the box, with the voxels shrunk to fit a
+        whole number of them along each edge; solute atoms block voxels
+        through their nearest image, and solvent moves across the faces of
+        the box, so the solute need not be whole. The exterior is the largest
+        connected region accessible to solvent. The engine, kernel, nthreads
+        and the tiled engine's options are ignored, and the grid cannot be
+        returned.
 
-    # the extreme values for the (rectangular) grid
-    x_min -= box_buffer
-    y_min -= box_buffer
-    z_min -= box_buffer
-    x_max += box_buffer
-    y_max += box_buffer
-    z_max += box_buffer
+    -------------
+    Returns
+    -------------
+    The volume that is accessible to the centers of a water molecule on the 
+    exterior of the protein; if ``return_grid`` or ``stats``, a tuple of the
+    volume, the AccessibleGrid (if ``return_grid``) and the VolumeStats (if
+    ``stats``)
+    '''
+    _check_return_grid(engine, return_grid, box)
+    with VolumeCalculator(_solvent_rad, _voxel_len, engine=engine,
+                          nthreads=nthreads, stats=stats,
+                          kernel=kernel, memory_budget=memory_budget,
+                          scratch_dir=scratch_dir) as calc:
+        vol = calc.volume(_solute_pos, _solute_rad, box)
+        return _results(vol, calc, return_grid, stats)
 
-    # Find the number of voxels to use; avoid fencepost error
-    #
-    #        * -- * -- * -- * -- * -- * -- *
-    #        1    2    3    4    5    6    7 
-    # 
-    nx = numpy.ceil((x_max - x_min)/voxel_len) + 1
-    ny = numpy.ceil((y_max - y_min)/voxel_len) + 1
-    nz = numpy.ceil((z_max - z_min)/voxel_len) + 1
-    if (nx>=libc.limits.USHRT_MAX) or (ny>=libc.limits.USHRT_MAX) or (nx>=libc.limits.USHRT_MAX):
-        print("The voxel grid contains too many voxels in the x, y, or z "\
-              "dimension. The max number of voxels in any direction is {:d} "\
-              "and the requested numbers of voxels are ({:d},{:d},{:d}). "
-              "ERROR.".format(libc.limits.USHRT_MAX, nx, ny, nz))
-        return -1
-
-    # unsigned char is 8-bit; I use it as a bool 
-    cdef long size = 1
-    size *= nx
-    size *= ny
-    size *= nz
-    size *= sizeof(unsigned char)
-    cdef unsigned char *grid = <unsigned char *>malloc(size)
-    cdef unsigned char *visited_grid = <unsigned char *>malloc(size)
-    if (not grid) or (not visited_grid):
-        print("Failed to allocate voxel arrays")
-        return -1
-    with nogil:
-        for i in range(nx*ny*nz):
-            grid[i] = 0
-            visited_grid[i] = 0
-
-
-        # Find the positions of the voxels surround each solvent 
-        for i in range(nsolvent):
-            solx = solvent_pos[3*i+0]
-            soly = solvent_pos[3*i+1]
-            solz = solvent_pos[3*i+2]
-
-            solvent_floor[3*i+0] = floor(solx/voxel_len)*voxel_len
-            solvent_ceil[3*i+0] = ceil(solx/voxel_len)*voxel_len
-
-            solvent_floor[3*i+1] = floor(soly/voxel_len)*voxel_len
-            solvent_ceil[3*i+1] = ceil(soly/voxel_len)*voxel_len
-
-            solvent_floor[3*i+2] = floor(solz/voxel_len)*voxel_len
-            solvent_ceil[3*i+2] = ceil(solz/voxel_len)*voxel_len
-
-
-    # possible directions to move; first we make _moves, which is a memoryview
-    # then we convert the memoryview to a true C-style array
-    cdef int[:,:] _moves = numpy.array([[0,0,-1],
-                                        [0,0,1],
-                                                   
-                                        [0,-1,-1],
-                                        [0,-1,0],
-                                        [0,-1,1],
-                                                   
-                                        [0,1,-1],
-                                        [0,1,0],
-                                        [0,1,1],
-                                                   
-                                        [-1,-1,-1],
-                                        [-1,-1,0],
-                                        [-1,-1,1],
-                                                   
-                                        [-1,0,-1],
-                                        [-1,0,0],
-                                        [-1,0,1],
-                                                   
-                                        [-1,1,-1],
-                                        [-1,1,0],
-                                        [-1,1,1],
-                                                   
-                                        [1,-1,-1],
-                                        [1,-1,0],
-                                        [1,-1,1],
-                                                   
-                                        [1,0,-1],
-                                        [1,0,0],
-                                        [1,0,1],
-                                                   
-                                        [1,1,-1],
-                                        [1,1,0],
-                                        [1,1,1]], dtype=numpy.int32)
-    # Start making the true c-style array
-    cdef int *moves = <int *>malloc(3*26*sizeof(int))
-    if not moves:
-        print("Failed to allocate ``moves`` array")
-        return -1
-    with nogil:
-        for i in range(26):
-            moves[3*i+0] = _moves[i,0]
-            moves[3*i+1] = _moves[i,1]
-            moves[3*i+2] = _moves[i,2]
+async def volume_async(_solute_pos, _solute_rad, _solvent_rad, _voxel_len,
+                 executor=None, **kwargs):
+    '''
+    ``volume`` run in ``executor``, as a coroutine: ``vol = await
+    volume_async(...)``, or ``asyncio.run(volume_async(...))``. The arguments
+    are those of ``volume``; the calculation starts when the coroutine is
+    awaited.
 
-    cdef int ptcnt = 0
-    cdef double vol
+    ``executor`` is a concurrent.futures.Executor, by default the one of the
+    running event loop. The calculations release the GIL, so those in a
+    ThreadPoolExecutor run in parallel, sharing the (read-only) inputs.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(volume, _solute_pos, _solute_rad,
+                                    _solvent_rad, _voxel_len, **kwargs))
 
-    with nogil:
-        # 
-        # The algorithm:
-        #   For each water molecule, consider which grid points are possible by
-        #   moving that molecule around. The molecule is approximated by a
-        #   sphere of size ``solvent_rad``, and it cannot move to voxel centers
-        #   where the sphere of radius ``solvent_rad`` centered at that point
-        #   would overlap with any of the spheres centered at a coordinate in
-        #   ``solute_pos``, with the corresponding radius from ``solute_rad``.
-        #   This process is repeated for every water molecule.
-        # 
-        for i in range(nsolvent):
-            # The water falls between 8 voxel coordinates
-            #
-            #
-            #          * -------- *
-            #          |\         |\
-            #          | \     |  | \
-            #          |  \    |  |  \ 
-            #          |   * -------- *
-            #          * --|---w--*   |
-            #           \  |   |   \  |
-            #            \ |   |    \ |
-            #             \|         \|
-            #              * -------- *
-            #
-            x = solvent_floor[3*i+0]
-            X = solvent_ceil[3*i+0]
-            y = solvent_floor[3*i+1]
-            Y = solvent_ceil[3*i+1]
-            z = solvent_floor[3*i+2]
-            Z = solvent_ceil[3*i+2]
-
-            # the index of ``grid`` corresponding to the given voxel
-            ix = int(x/voxel_len)
-            iX = int(X/voxel_len)
-            iy = int(y/voxel_len)
-            iY = int(Y/voxel_len)
-            iz = int(z/voxel_len)
-            iZ = int(Z/voxel_len)
-            # check if any solute molecule would overlap a solvent placed at
-            # any of the following:
-            #  (x,y,z)
-            #  (x,y,Z)
-            #  (x,Y,z)
-            #  (x,Y,Z)
-            #  (X,y,z)
-            #  (X,y,Z)
-            #  (X,Y,z)
-            #  (X,Y,Z)
-            # 
+async def volume_explicit_sol_async(_solute_pos, _solute_rad, _solvent_pos,
+                              _solvent_rad, _voxel_len, executor=None,
+                              **kwargs):
+    '''
+    ``volume_explicit_sol`` run in ``executor``; see ``volume_async``.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(volume_explicit_sol, _solute_pos,
+                                    _solute_rad, _solvent_pos, _solvent_rad,
+                                    _voxel_len, **kwargs))
 
-            if is_free(x, y, z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(ix, iy, iz, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(x, y, Z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(ix, iy, iZ, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(x, Y, z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(ix, iY, iz, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(x, Y, Z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(ix, iY, iZ, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(X, y, z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(iX, iy, iz, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(X, y, Z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(iX, iy, iZ, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(X, Y, z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(iX, iY, iz, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-            if is_free(X, Y, Z, solute_pos, solute_rad, nsolute, solvent_rad):
-                floodfill(iX, iY, iZ, nx, ny, nz, voxel_len, visited_grid, grid, 
-                        moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-        #find the volume
-        for i in range(nx):
-            for j in range(ny):
-                for k in range(nz):
-                    ptcnt += grid[i*ny*nz+j*nz+k]
-
-        vol = (1-float(ptcnt)/float(nx*ny*nz))*(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
-
-    ### for debugging ###
-    #_grid = numpy.zeros((int(nx),int(ny),int(nz)))
-    #for i in range(nx):
-    #    for j in range(ny):
-    #        for k in range(nz):
-    #            _grid[i,j,k] = grid[i*ny*nz+j*nz+k]
-    free(grid)
-    free(visited_grid)
-    free(solute_pos)
-    free(solute_rad)
-    free(solvent_pos)
-    free(solvent_floor)
-    free(solvent_ceil)
-    free(moves)
-    return vol#, _grid
-
-cpdef double volume(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos, 
-                    numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad, 
-                    double _solvent_rad,
-                    double _voxel_len):
+def volume_probe_sweep(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                       numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad,
+                       probe_radii,
+                       double _voxel_len,
+                       int nthreads=1):
     '''
+    Same as ``volume``, for each of several solvent (probe) radii at once.
+
+    Which of the probes fit on a voxel is decided for all of them in one pass
+    over the atoms, with the same test as ``volume``; each radius then only
+    needs its own labelling of the voxels connected to the exterior. All
+    radii share the grid of the largest one. The volume for the largest
+    radius is the same as that of ``volume``. For the smaller radii, the
+    number of blocked voxels is scaled to the box ``volume`` would use for
+    them, but the voxels lie elsewhere, so the volumes can differ from those
+    of ``volume`` by about the discretization error.
+
     -----------
     Parameters
     -----------
     _solute_pos: shape (n,3) array of (x,y,z) coordinates of solute atoms
     _solute_rad: shape (n,) array of solute atom radii
-    _solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    probe_radii: sequence of up to 255 solvent molecule radii
     _voxel_len: edge length of voxels
+    nthreads: number of threads; 0 uses all cores. The volumes do not depend
+        on nthreads.
 
     -------------
     Returns
     -------------
-    The volume that is accessible to the centers of a water molecule on the 
-    exterior of the protein.
+    shape (len(probe_radii),) array of the volume for each probe radius, in
+    the order of ``probe_radii``
     '''
     cdef:
-        double box_buffer 
+        numpy.ndarray[numpy.float64_t, ndim=1] radii
+        numpy.ndarray[numpy.float64_t, ndim=2] solute_pos
+        numpy.ndarray[numpy.float64_t, ndim=1] solute_rad
+        numpy.ndarray[long, ndim=1] counts
+        double box_buffer
         double x_min, y_min, z_min
         double x_max, y_max, z_max
         int nx, ny, nz
-        double x, y, z, X, Y, Z
-        int ix, iy, iz, iX, iY, iZ
-        double solx, soly, solz
         int nsolute = _solute_pos.shape[0]
-        int i, j, k
-        double voxel_len = _voxel_len
-        double solvent_rad = _solvent_rad
+        int nprobe
+        int failed
+        int i
+        long nvoxels, nblocked
+
+    _check_solute(_solute_pos, _solute_rad)
+    _check_nthreads(nthreads)
+    probe_radii = numpy.asarray(probe_radii, dtype=numpy.float64)
+    if (probe_radii.ndim != 1) or not (0 < probe_radii.shape[0] <= 255):
+        raise ValueError("Expected a sequence of 1 to 255 probe radii, got {}"\
+                         .format(probe_radii))
+    # the probes in increasing order of radius
+    order = numpy.argsort(probe_radii, kind='stable')
+    radii = numpy.ascontiguousarray(probe_radii[order])
+    nprobe = radii.shape[0]
 
-    # We want the grids to be large enough that solvent can completely surround
-    # the solute; calculate a buffer size to do this.
-    box_buffer = 2*(_solute_rad.max() + solvent_rad)
+    # the grid of ``volume`` for the largest probe
+    box_buffer = 2*(_solute_rad.max() + radii[nprobe-1])
     x_min = _solute_pos[:,0].min()
     y_min = _solute_pos[:,1].min()
     z_min = _solute_pos[:,2].min()
@@ -373,32 +1604,16 @@ cpdef double volume(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
     y_max = _solute_pos[:,1].max()
     z_max = _solute_pos[:,2].max()
 
-    cdef:
-        # Have Cython convert the arrays with a leading underscore from numpy
-        # arrays to c-style arrays
-        double *solute_pos = <double *>malloc(nsolute*3*sizeof(double))
-        double *solute_rad = <double *>malloc(nsolute*sizeof(double))
-
-    if (not solute_pos) or (not solute_rad):
-        print("Failed to allocate arrays")
-        return -1
-
-    # assign solute_pos, solute_rad
-    with nogil:
-        for i in range(nsolute):
-            solute_pos[3*i]   = _solute_pos[i,0]
-            solute_pos[3*i+1] = _solute_pos[i,1]
-            solute_pos[3*i+2] = _solute_pos[i,2]
-            solute_rad[i] = _solute_rad[i]
-
-    # shift the solute positions by the appropriate amount
-    with nogil:
-        for i in range(nsolute):
-            solute_pos[3*i]   += (-1*x_min + box_buffer)
-            solute_pos[3*i+1] += (-1*y_min + box_buffer)
-            solute_pos[3*i+2] += (-1*z_min + box_buffer)
+    solute_pos = numpy.empty((nsolute, 3), dtype=numpy.float64)
+    solute_rad = numpy.ascontiguousarray(_solute_rad)
+    for i in range(nsolute):
+        solute_pos[i,0] = _solute_pos[i,0]
+        solute_pos[i,1] = _solute_pos[i,1]
+        solute_pos[i,2] = _solute_pos[i,2]
+        solute_pos[i,0] += (-1*x_min + box_buffer)
+        solute_pos[i,1] += (-1*y_min + box_buffer)
+        solute_pos[i,2] += (-1*z_min + box_buffer)
 
-    # the extreme values for the (rectangular) grid
     x_min -= box_buffer
     y_min -= box_buffer
     z_min -= box_buffer
@@ -406,100 +1621,544 @@ cpdef double volume(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
     y_max += box_buffer
     z_max += box_buffer
 
-    # Find the number of voxels to use; avoid fencepost error
-    #
-    #        * -- * -- * -- * -- * -- * -- *
-    #        1    2    3    4    5    6    7 
-    # 
-    nx = numpy.ceil((x_max - x_min)/voxel_len) + 1
-    ny = numpy.ceil((y_max - y_min)/voxel_len) + 1
-    nz = numpy.ceil((z_max - z_min)/voxel_len) + 1
-
-    # unsigned char is 8-bit; I use it as a bool 
-    cdef unsigned char *grid = <unsigned char *>malloc(nx*ny*nz*sizeof(unsigned char))
-    cdef unsigned char *visited_grid = <unsigned char *>malloc(nx*ny*nz*sizeof(unsigned char))
-    if (not grid) or (not visited_grid):
-        print("Failed to allocate voxel arrays")
-        return -1
-    with nogil:
-        for i in range(nx*ny*nz):
-            grid[i] = 0
-            visited_grid[i] = 0
-
-    # possible directions to move; first we make _moves, which is a memoryview
-    # then we convert the memoryview to a true C-style array
-    cdef int[:,:] _moves = numpy.array([[0,0,-1],
-                                        [0,0,1],
-                                                   
-                                        [0,-1,-1],
-                                        [0,-1,0],
-                                        [0,-1,1],
-                                                   
-                                        [0,1,-1],
-                                        [0,1,0],
-                                        [0,1,1],
-                                                   
-                                        [-1,-1,-1],
-                                        [-1,-1,0],
-                                        [-1,-1,1],
-                                                   
-                                        [-1,0,-1],
-                                        [-1,0,0],
-                                        [-1,0,1],
-                                                   
-                                        [-1,1,-1],
-                                        [-1,1,0],
-                                        [-1,1,1],
-                                                   
-                                        [1,-1,-1],
-                                        [1,-1,0],
-                                        [1,-1,1],
-                                                   
-                                        [1,0,-1],
-                                        [1,0,0],
-                                        [1,0,1],
-                                                   
-                                        [1,1,-1],
-                                        [1,1,0],
-                                        [1,1,1]], dtype=numpy.int32)
-    # Start making the true c-style array
-    cdef int *moves = <int *>malloc(3*26*sizeof(int))
-    if not moves:
-        print("Failed to allocate ``moves`` array")
-        return -1
+    nx = numpy.ceil((x_max - x_min)/_voxel_len) + 1
+    ny = numpy.ceil((y_max - y_min)/_voxel_len) + 1
+    nz = numpy.ceil((z_max - z_min)/_voxel_len) + 1
+
+    counts = numpy.zeros(nprobe, dtype=numpy.int_)
     with nogil:
-        for i in range(26):
-            moves[3*i+0] = _moves[i,0]
-            moves[3*i+1] = _moves[i,1]
-            moves[3*i+2] = _moves[i,2]
+        failed = probe_sweep(_voxel_len, nx, ny, nz, &solute_pos[0,0],
+                             &solute_rad[0], nsolute, &radii[0], nprobe,
+                             nthreads, &counts[0])
+    if failed:
+        raise MemoryError("Failed to allocate voxel arrays")
 
-    cdef int ptcnt = 0
-    cdef double vol
+    nvoxels = <long>nx*ny*nz
+    vols = numpy.empty(nprobe, dtype=numpy.float64)
+    for i in range(nprobe):
+        # the voxels outside the smaller boxes are all accessible
+        nblocked = nvoxels - counts[i]
+        # the box of ``volume`` for this probe
+        box_buffer = 2*(_solute_rad.max() + radii[i])
+        x_min = _solute_pos[:,0].min() - box_buffer
+        y_min = _solute_pos[:,1].min() - box_buffer
+        z_min = _solute_pos[:,2].min() - box_buffer
+        x_max = _solute_pos[:,0].max() + box_buffer
+        y_max = _solute_pos[:,1].max() + box_buffer
+        z_max = _solute_pos[:,2].max() + box_buffer
+        nx = numpy.ceil((x_max - x_min)/_voxel_len) + 1
+        ny = numpy.ceil((y_max - y_min)/_voxel_len) + 1
+        nz = numpy.ceil((z_max - z_min)/_voxel_len) + 1
+        vols[order[i]] = (1-float(<long>nx*ny*nz - nblocked)/(float(nx)*ny*nz))\
+                         *(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
+    return vols
 
-    with nogil:
-        # flood-fill from the corner
-        ix = 0
-        iy = 0
-        iz = 0
-        x = 0
-        y = 0
-        z = 0
-
-        if is_free(x, y, z, solute_pos, solute_rad, nsolute, solvent_rad):
-            floodfill(ix, iy, iz, nx, ny, nz, voxel_len, visited_grid, grid, 
-                    moves, solute_pos, solute_rad, nsolute, solvent_rad)
-
-        #find the volume
-        for i in range(nx):
-            for j in range(ny):
-                for k in range(nz):
-                    ptcnt += grid[i*ny*nz+j*nz+k]
-
-        vol = (1-float(ptcnt)/float(nx*ny*nz))*(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
-
-    free(grid)
-    free(visited_grid)
-    free(solute_pos)
-    free(solute_rad)
-    free(moves)
+def volume_adaptive(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                    numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad,
+                    double _solvent_rad,
+                    double tol=1e-3,
+                    double coarse_voxel_len=0.32,
+                    double min_voxel_len=0.02,
+                    _solvent_pos=None,
+                    bint return_levels=False):
+    '''
+    Volume refined until it no longer changes by more than ``tol``. Starting
+    from ``coarse_voxel_len``, the edge length of the voxels is halved until
+    the volumes of two successive levels differ by at most ``tol`` times the
+    volume, or the next edge length would be smaller than ``min_voxel_len``.
+
+    Every level is calculated with the sparse engine, and gives the same
+    volume as ``volume`` (or ``volume_explicit_sol``) at its voxel length, so
+    the fine levels only cost memory near the surface of the solute.
+
+    -----------
+    Parameters
+    -----------
+    _solute_pos: shape (n,3) array of (x,y,z) coordinates of solute atoms
+    _solute_rad: shape (n,) array of solute atom radii
+    _solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    tol: relative difference between successive levels to stop at
+    coarse_voxel_len: edge length of voxels of the first level
+    min_voxel_len: smallest edge length of voxels to refine to
+    _solvent_pos: shape (m,3) array of (x,y,z) coordinates of solvent atoms;
+        if given, the volume is that of ``volume_explicit_sol``
+    return_levels: also return the (voxel_len, volume) of every level
+
+    -------------
+    Returns
+    -------------
+    The volume of the finest level, and if ``return_levels``, the list of
+    (voxel_len, volume) of every level, coarsest first.
+    '''
+    cdef double voxel_len = coarse_voxel_len
+    cdef double vol, prev
+
+    if tol < 0:
+        raise ValueError("tol must not be negative, not {}".format(tol))
+    if (coarse_voxel_len <= 0) or (min_voxel_len <= 0) or\
+            (min_voxel_len > coarse_voxel_len):
+        raise ValueError("Expected 0 < min_voxel_len <= coarse_voxel_len, got "\
+                         "{} and {}".format(min_voxel_len, coarse_voxel_len))
+    levels = []
+    while True:
+        with VolumeCalculator(_solvent_rad, voxel_len, engine='sparse') as calc:
+            if _solvent_pos is None:
+                vol = calc.volume(_solute_pos, _solute_rad)
+            else:
+                vol = calc.volume_explicit_sol(_solute_pos, _solute_rad,
+                                               _solvent_pos)
+        if levels and (abs(vol - prev) <= tol*abs(vol)):
+            levels.append((voxel_len, vol))
+            break
+        levels.append((voxel_len, vol))
+        prev = vol
+        if voxel_len/2 < min_voxel_len:
+            break
+        voxel_len /= 2
+    if return_levels:
+        return vol, levels
     return vol
+
+def _sobol_directions():
+    # direction numbers of the first three dimensions of the Sobol sequence,
+    # scaled to 32 bits: the van der Corput sequence, then the primitive
+    # polynomials x + 1 and x^2 + x + 1 with initial numbers (1,) and (1, 3)
+    m = [[1]*32, [1], [1, 3]]
+    for k in range(1, 32):
+        m[1].append((2*m[1][k-1]) ^ m[1][k-1])
+    for k in range(2, 32):
+        m[2].append((2*m[2][k-1]) ^ (4*m[2][k-2]) ^ m[2][k-2])
+    return numpy.array([[m[d][k] << (31 - k) for k in range(32)]
+                        for d in range(3)], dtype=numpy.uint64)
+
+SOBOL_DIRECTIONS = _sobol_directions()
+
+def _sobol(start, n):
+    # points start ... start+n-1 of the Sobol sequence in 3 dimensions, as
+    # 32-bit integers
+    index = numpy.arange(start, start + n, dtype=numpy.uint64)
+    points = numpy.zeros((n, 3), dtype=numpy.uint64)
+    for k in range(32):
+        bit = (index >> numpy.uint64(k)) & numpy.uint64(1)
+        points ^= bit[:,None]*SOBOL_DIRECTIONS[:,k]
+    return points
+
+cdef long _classify(double* points, long npoints, double voxel_len,
+                    BitGrid* reached, CellList* cells, double solvent_rad,
+                    unsigned char* excluded) nogil:
+    # Mark the points (in the frame of the grid) that solvent does not reach.
+    # A point among 8 voxels that are all reached from the exterior is
+    # reached, and one among 8 that are not is excluded. A point between
+    # reached and unreached voxels is near the surface, and is excluded if a
+    # solvent centered on it would overlap a solute atom. Returns the number
+    # of points checked against the atoms.
+    cdef long i, nchecked = 0
+    cdef int ix, iy, iz, nreached
+    for i in range(npoints):
+        ix = <int>floor(points[3*i]/voxel_len)
+        iy = <int>floor(points[3*i+1]/voxel_len)
+        iz = <int>floor(points[3*i+2]/voxel_len)
+        nreached = getbit(reached, ix, iy, iz) +\
+                   getbit(reached, ix, iy, iz+1) +\
+                   getbit(reached, ix, iy+1, iz) +\
+                   getbit(reached, ix, iy+1, iz+1) +\
+                   getbit(reached, ix+1, iy, iz) +\
+                   getbit(reached, ix+1, iy, iz+1) +\
+                   getbit(reached, ix+1, iy+1, iz) +\
+                   getbit(reached, ix+1, iy+1, iz+1)
+        if nreached == 8:
+            excluded[i] = 0
+        elif nreached == 0:
+            excluded[i] = 1
+        else:
+            excluded[i] = not is_free_cells(points[3*i], points[3*i+1],
+                                            points[3*i+2], cells, solvent_rad,
+                                            NULL)
+            nchecked += 1
+    return nchecked
+
+def volume_sampled(numpy.ndarray[numpy.float64_t, ndim=2] _solute_pos,
+                   numpy.ndarray[numpy.float64_t, ndim=1] _solute_rad,
+                   double _solvent_rad,
+                   double rel_error=0.002,
+                   double coarse_voxel_len=0.5,
+                   long max_points=1 << 22,
+                   int replicates=8,
+                   seed=None,
+                   bint return_points=False):
+    '''
+    Volume estimated from quasi-random points, with its standard error; for
+    screening many solutes, where a volume within a known error is enough.
+
+    A coarse grid of ``coarse_voxel_len`` is flood filled from the exterior,
+    as by ``volume``. Points of the Sobol sequence are then drawn in the box
+    around the exclusion spheres of the solute atoms, each point classified
+    by the voxels around it, or by checking it against the atoms if these lie
+    on both sides of the surface. The fraction of points not reached by
+    solvent, times the box, estimates the volume. Every replicate draws the
+    same points under a random digital shift, which makes the estimates of
+    the replicates independent, and unbiased estimates of the volume the
+    points are classified into; their spread gives the standard error. The
+    number of points doubles until the standard error is at most
+    ``rel_error`` times the volume, or ``max_points`` are drawn in all.
+
+    The standard error covers the sampling error only. A point whose 8 voxels
+    are all reached, or all blocked, is classified without checking it, so a
+    sphere cap poking in between 8 reached voxels, or a seam between 8 blocked
+    ones, is missed: the classification has a bias on the order of surface
+    features smaller than ``coarse_voxel_len``. Likewise, channels and
+    cavities finer than ``coarse_voxel_len`` are not resolved. Otherwise, the
+    volume does not depend on a voxel length, unlike that of ``volume``.
+
+    -----------
+    Parameters
+    -----------
+    _solute_pos: shape (n,3) array of (x,y,z) coordinates of solute atoms
+    _solute_rad: shape (n,) array of solute atom radii
+    _solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    rel_error: standard error, relative to the volume, to stop at
+    coarse_voxel_len: edge length of the voxels of the coarse grid
+    max_points: most points to draw, over all replicates
+    replicates: number of independently shifted replicates; at least 2
+    seed: seed of the random shifts, for repeatable estimates
+    return_points: also return the number of points drawn
+
+    -------------
+    Returns
+    -------------
+    A tuple of the volume and its standard error, followed by the number of
+    points drawn if ``return_points``.
+    '''
+    cdef VolumeCalculator calc
+    cdef CellList* cells = NULL
+    cdef numpy.ndarray[numpy.float64_t, ndim=2] points
+    cdef numpy.ndarray[numpy.uint8_t, ndim=1] excluded
+    cdef long n, drawn = 0
+    cdef int nsolute = _solute_pos.shape[0]
+
+    _check_solute(_solute_pos, _solute_rad)
+    if rel_error < 0:
+        raise ValueError("rel_error must not be negative, not {}"\
+                         .format(rel_error))
+    if coarse_voxel_len <= 0:
+        raise ValueError("coarse_voxel_len must be positive, not {}"\
+                         .format(coarse_voxel_len))
+    if replicates < 2:
+        raise ValueError("Need at least 2 replicates for a standard error, "\
+                         "not {}".format(replicates))
+    shifts = numpy.random.RandomState(seed).randint(0, 1 << 32,
+                                                    size=(replicates, 3),
+                                                    dtype=numpy.uint64)
+
+    calc = VolumeCalculator(_solvent_rad, coarse_voxel_len, engine='raster')
+    try:
+        calc.volume(_solute_pos, _solute_rad)
+        with nogil:
+            cells = newCellList(calc.solute_pos, calc.solute_rad, nsolute,
+                                _solvent_rad)
+        if not cells:
+            raise MemoryError("Failed to allocate cell list")
+
+        # the box around the exclusion spheres, in the frame of the grid;
+        # solvent reaches every point outside it
+        origin = numpy.array((calc.origin[0], calc.origin[1], calc.origin[2]))
+        cut = (_solute_rad + _solvent_rad)[:,None]
+        lo = (_solute_pos - cut).min(axis=0) - origin
+        hi = (_solute_pos + cut).max(axis=0) - origin
+        box = numpy.prod(hi - lo)
+
+        counts = numpy.zeros(replicates)
+        n = min(1024, max(max_points//replicates, 1))
+        while True:
+            sobol = _sobol(drawn, n)
+            for r in range(replicates):
+                points = numpy.ascontiguousarray(
+                    lo + (hi - lo)*(((sobol ^ shifts[r]) + 0.5)/2.0**32))
+                excluded = numpy.empty(n, dtype=numpy.uint8)
+                with nogil:
+                    _classify(<double*>points.data, n, coarse_voxel_len,
+                              calc.grid, cells, _solvent_rad,
+                              <unsigned char*>excluded.data)
+                counts[r] += excluded.sum()
+            drawn += n
+            estimates = counts/drawn*box
+            vol = estimates.mean()
+            err = estimates.std(ddof=1)/numpy.sqrt(replicates)
+            if (err <= rel_error*vol) or (2*drawn*replicates > max_points):
+                break
+            n = drawn
+    finally:
+        if cells:
+            delCellList(cells)
+        calc.close()
+    if return_points:
+        return vol, err, drawn*replicates
+    return vol, err
+
+cdef class IncrementalVolume:
+    '''
+    Volumes of the frames of a trajectory, each updated from the one before.
+    Between nearby frames, most of the grid stays the same: the calculator
+    keeps which voxels each atom blocks and which are reached from the
+    exterior, checks only the voxels where an atom's exclusion sphere moved,
+    and only labels again the bricks of 8x8x8 voxels where voxels became
+    blocked or accessible. When more than ``max_dirty`` of the bricks change,
+    or the changes might cut off a region, the whole grid is labelled again.
+
+    The grid is fixed by the first frame: the box of ``volume``, with
+    ``margin`` more on every side. When the solute moves out of it, the grid
+    is set up again around the frame. The volume of each frame is the number
+    of blocked voxels scaled to the box ``volume`` would use for the frame, so
+    it differs from that of ``volume`` by about the discretization error (the
+    voxels lie elsewhere). It does not depend on ``max_dirty``, nor on the
+    frames before: it is the same as from scratch on the same grid.
+
+    -----------
+    Parameters
+    -----------
+    radii: shape (n,) array of solute atom radii
+    solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    voxel_len: edge length of voxels
+    margin: room the solute has to move in, in each direction, before the grid
+        is set up again
+    max_dirty: fraction of the bricks that may change before the whole grid is
+        labelled again
+
+    ``full_updates`` and ``incremental_updates`` count the frames done each
+    way, and ``changed_voxels`` is the number of voxels that became blocked or
+    accessible in the last frame.
+    '''
+    cdef readonly double solvent_rad
+    cdef readonly double voxel_len
+    cdef readonly double margin
+    cdef readonly double max_dirty
+    cdef readonly long full_updates
+    cdef readonly long incremental_updates
+    cdef readonly long changed_voxels
+    cdef object radii
+    cdef double max_rad
+    cdef Incremental* inc
+    cdef double origin[3]
+
+    def __cinit__(self):
+        self.inc = NULL
+
+    def __init__(self, numpy.ndarray[numpy.float64_t, ndim=1] radii,
+                 double solvent_rad, double voxel_len, double margin=2.0,
+                 double max_dirty=0.25):
+        if margin < 0:
+            raise ValueError("margin must not be negative, not {}"\
+                             .format(margin))
+        if not (0 <= max_dirty <= 1):
+            raise ValueError("max_dirty must be between 0 and 1, not {}"\
+                             .format(max_dirty))
+        self.radii = numpy.ascontiguousarray(radii)
+        self.max_rad = radii.max()
+        self.solvent_rad = solvent_rad
+        self.voxel_len = voxel_len
+        self.margin = margin
+        self.max_dirty = max_dirty
+        self.full_updates = 0
+        self.incremental_updates = 0
+        self.changed_voxels = 0
+
+    def __dealloc__(self):
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Free the grids. The next frame sets them up again.
+        '''
+        self._release()
+
+    cdef void _release(self):
+        if self.inc:
+            delIncremental(self.inc)
+            self.inc = NULL
+
+    def volume(self, _solute_pos, bint full=False):
+        '''
+        The volume of ``volume`` for the frame ``_solute_pos``, a shape (n,3)
+        array of (x,y,z) coordinates of the solute atoms. With ``full``, the
+        grid is filled in from scratch instead of updated.
+        '''
+        cdef:
+            numpy.ndarray[numpy.float64_t, ndim=2] solute_pos
+            numpy.ndarray[numpy.float64_t, ndim=1] solute_rad = self.radii
+            double box_buffer = 2*(self.max_rad + self.solvent_rad)
+            double voxel_len = self.voxel_len
+            double max_dirty = self.max_dirty
+            double x_min, y_min, z_min
+            double x_max, y_max, z_max
+            int nx, ny, nz
+            int nsolute = solute_rad.shape[0]
+            int result
+            long nblocked
+
+        _solute_pos = numpy.asarray(_solute_pos, dtype=numpy.float64)
+        if (_solute_pos.ndim != 2) or (_solute_pos.shape[0] != nsolute) or\
+                (_solute_pos.shape[1] != 3):
+            raise ValueError("Expected a frame of shape ({:d}, 3), got {}"\
+                             .format(nsolute, _solute_pos.shape))
+        x_min, y_min, z_min = _solute_pos.min(axis=0) - box_buffer
+        x_max, y_max, z_max = _solute_pos.max(axis=0) + box_buffer
+
+        # set up the grid around the frame if there is none yet, or the
+        # frame does not fit in it
+        if self.inc and ((x_min < self.origin[0]) or (y_min < self.origin[1])\
+                or (z_min < self.origin[2]) or\
+                (x_max > self.origin[0] + (self.inc.nx - 1)*voxel_len) or\
+                (y_max > self.origin[1] + (self.inc.ny - 1)*voxel_len) or\
+                (z_max > self.origin[2] + (self.inc.nz - 1)*voxel_len)):
+            self._release()
+        if not self.inc:
+            full = True
+            self.origin[0] = x_min - self.margin
+            self.origin[1] = y_min - self.margin
+            self.origin[2] = z_min - self.margin
+            nx = numpy.ceil((x_max + self.margin - self.origin[0])/voxel_len) + 1
+            ny = numpy.ceil((y_max + self.margin - self.origin[1])/voxel_len) + 1
+            nz = numpy.ceil((z_max + self.margin - self.origin[2])/voxel_len) + 1
+            self.inc = newIncremental(nx, ny, nz, voxel_len, &solute_rad[0],
+                                      nsolute, self.solvent_rad)
+            if not self.inc:
+                raise MemoryError("Failed to allocate voxel arrays")
+
+        solute_pos = numpy.ascontiguousarray(_solute_pos - numpy.array(
+            [self.origin[0], self.origin[1], self.origin[2]]))
+        with nogil:
+            if full:
+                result = incremental_full(self.inc, &solute_pos[0,0])
+            else:
+                result = incremental_update(self.inc, &solute_pos[0,0],
+                                            max_dirty)
+        if result == 1:
+            # the grid is only partly filled; start over next time
+            self._release()
+            raise MemoryError("Failed to allocate voxel arrays")
+        if full or (result == 3):
+            self.full_updates += 1
+        else:
+            self.incremental_updates += 1
+        self.changed_voxels = self.inc.changed
+
+        # the voxels outside the box of ``volume`` are all accessible
+        nblocked = <long>self.inc.nx*self.inc.ny*self.inc.nz -\
+                   countBits(self.inc.grid)
+        nx = numpy.ceil((x_max - x_min)/voxel_len) + 1
+        ny = numpy.ceil((y_max - y_min)/voxel_len) + 1
+        nz = numpy.ceil((z_max - z_min)/voxel_len) + 1
+        return (1-float(<long>nx*ny*nz - nblocked)/(float(nx)*ny*nz))\
+               *(x_max-x_min)*(y_max-y_min)*(z_max-z_min)
+
+def volume_trajectory(frames,
+                      numpy.ndarray[numpy.float64_t, ndim=1] radii,
+                      double solvent_rad,
+                      double voxel_len,
+                      str engine='celllist',
+                      int nthreads=1,
+                      int workers=1,
+                      int chunksize=16,
+                      str kernel='batch',
+                      bint incremental=False):
+    '''
+    Same as ``volume``, for every frame of a trajectory. The voxel grids are
+    allocated once, for the largest frame seen so far, and reused.
+
+    -----------
+    Parameters
+    -----------
+    frames: shape (nframes,n,3) array (e.g. a memory-mapped .npy file) or
+        iterable of shape (n,3) arrays of (x,y,z) coordinates of solute atoms
+    radii: shape (n,) array of solute atom radii
+    solvent_rad: solvent molecule radius; solvent is approximated as sphere
+    voxel_len: edge length of voxels
+    engine: see ``volume``
+    nthreads: number of threads per frame; see ``volume``
+    workers: number of processes to spread the frames over; 0 uses all cores
+    chunksize: number of frames handed to a worker process at a time
+    kernel: see ``volume``
+    incremental: update each frame from the one before with an
+        IncrementalVolume, instead of starting from scratch; faster when
+        little moves between frames. The volumes differ from those of
+        ``volume`` by about the discretization error. engine, nthreads and
+        kernel are then ignored.
+
+    -------------
+    Returns
+    -------------
+    shape (nframes,) array of the volume of each frame
+    '''
+    cdef VolumeCalculator calc
+
+    _check_engine(engine)
+    _check_nthreads(nthreads)
+    _check_kernel(kernel)
+    if workers < 0:
+        raise ValueError("workers must be 0 (all cores) or a positive number "\
+                         "of processes, not {}".format(workers))
+    if chunksize < 1:
+        raise ValueError("chunksize must be positive, not {}".format(chunksize))
+    if workers == 0:
+        workers = multiprocessing.cpu_count()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            vols = pool.imap(_trajectory_chunk,
+                             _chunks(frames, chunksize, radii, solvent_rad,
+                                     voxel_len, engine, nthreads, kernel,
+                                     incremental))
+            return numpy.concatenate([numpy.zeros(0)] + list(vols))
+        finally:
+            pool.terminate()
+
+    vols = []
+    if incremental:
+        with IncrementalVolume(radii, solvent_rad, voxel_len) as inc:
+            for frame in frames:
+                vols.append(inc.volume(frame))
+        return numpy.array(vols, dtype=numpy.float64)
+
+    calc = VolumeCalculator(solvent_rad, voxel_len, engine=engine,
+                            nthreads=nthreads, kernel=kernel)
+    with calc:
+        if calc._load_radii(radii):
+            raise MemoryError("Failed to allocate arrays")
+        max_rad = radii.max()
+        for frame in frames:
+            frame = numpy.asarray(frame, dtype=numpy.float64)
+            if (frame.ndim != 2) or (frame.shape[0] != radii.shape[0]) or\
+                    (frame.shape[1] != 3):
+                raise ValueError("Expected frames of shape ({:d}, 3), got {}"\
+                                 .format(radii.shape[0], frame.shape))
+            vols.append(calc._volume(frame, max_rad))
+    return numpy.array(vols, dtype=numpy.float64)
+
+def _chunks(frames, chunksize, *args):
+    # (chunk,) + args for lists of up to chunksize frames; slices of arrays are
+    # views, so only the frames of a chunk are read from a memory-mapped file
+    if isinstance(frames, numpy.ndarray):
+        for start in range(0, frames.shape[0], chunksize):
+            yield (numpy.asarray(frames[start:start+chunksize]),) + args
+        return
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == chunksize:
+            yield (chunk,) + args
+            chunk = []
+    if chunk:
+        yield (chunk,) + args
+
+def _trajectory_chunk(args):
+    chunk, radii, solvent_rad, voxel_len, engine, nthreads, kernel,\
+        incremental = args
+    return volume_trajectory(chunk, radii, solvent_rad, voxel_len,
+                             engine=engine, nthreads=nthreads, workers=1,
+                             kernel=kernel, incremental=incremental)
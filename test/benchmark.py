@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+import argparse
+import datetime
+import json
+import multiprocessing
+import numpy
+import os
+import platform
+import resource
+import sys
+import time
+sys.path.append('../')
+import volume
+import pdb2volume
+'''
+Benchmark the volume calculations across system size, voxel length, solvent
+radius, implicit vs explicit solvent and engine.
+
+Every case runs in a fresh process, so that its peak memory can be measured.
+The wall time (best of --repeat runs), peak resident set size and voxels per
+second of every case are written to a JSON file; with --compare, the results
+are checked against an earlier run, and slower or changed cases are flagged.
+
+    python benchmark.py --output new.json --compare baseline.json
+'''
+
+# atom counts of the synthetic systems
+NATOMS = (1000, 5000, 20000)
+VOXEL_LENS = (0.5, 0.25)
+SOLVENT_RADS = (0.0, 1.4)
+MODES = ('implicit', 'explicit')
+# the linear engine checks every atom for every voxel; only run it on small
+# systems
+LINEAR_MAX_ATOMS = 1000
+
+def synthetic_solute(natoms, density=0.1, seed=0):
+    '''
+    Random atoms (radii 1.2-1.9) in a ball, at roughly the atom density of a
+    protein (``density`` atoms per cubic Angstrom).
+    '''
+    rng = numpy.random.RandomState(seed)
+    r = (3.*natoms/(4*numpy.pi*density))**(1./3)
+    direction = rng.normal(size=(natoms,3))
+    direction /= numpy.linalg.norm(direction, axis=1)[:,numpy.newaxis]
+    pos = direction*r*rng.uniform(size=(natoms,1))**(1./3)
+    rad = rng.uniform(1.2, 1.9, size=natoms)
+    return pos, rad
+
+def synthetic_solvent(natoms, density=0.1, spacing=3.1, padding=8.):
+    '''
+    Waters on a cubic lattice (about the density of water) around the ball of
+    synthetic_solute, leaving out those that could overlap the ball.
+    '''
+    r = (3.*natoms/(4*numpy.pi*density))**(1./3)
+    ticks = numpy.arange(-(r + padding), r + padding, spacing)
+    pos = numpy.stack(numpy.meshgrid(ticks, ticks, ticks, indexing='ij'),
+                      axis=-1).reshape(-1, 3)
+    return pos[numpy.linalg.norm(pos, axis=1) > r + 2]
+
+def villin_system():
+    pdbvol = pdb2volume.PDBVolume('villin.pdb', 'radii.lib')
+    return pdbvol.select(report=False)
+
+def system(name):
+    '''
+    (solute_pos, solute_rad, solvent_pos) of the system called ``name``;
+    'villin', or 'synthetic-<number of atoms>'.
+    '''
+    if name == 'villin':
+        return villin_system()
+    natoms = int(name.split('-')[1])
+    solute_pos, solute_rad = synthetic_solute(natoms)
+    return solute_pos, solute_rad, synthetic_solvent(natoms)
+
+def grid_voxels(solute_pos, solute_rad, solvent_rad, voxel_len,
+                solvent_pos=None):
+    '''
+    Number of voxels of the grid of a calculation, as set up by volume (or
+    volume_explicit_sol, if ``solvent_pos`` is given).
+    '''
+    box_buffer = 2*(solute_rad.max() + solvent_rad)
+    pos = solute_pos
+    if solvent_pos is not None:
+        pos = numpy.concatenate((solute_pos, solvent_pos))
+    extent = pos.max(axis=0) - pos.min(axis=0) + 2*box_buffer
+    return int(numpy.prod(numpy.ceil(extent/voxel_len) + 1))
+
+def cases(systems, engines, voxel_lens=VOXEL_LENS, solvent_rads=SOLVENT_RADS,
+          modes=MODES):
+    '''
+    All combinations of the parameters, as dicts with a unique 'name'.
+    '''
+    for sysname, natoms in systems:
+        for mode in modes:
+            for voxel_len in voxel_lens:
+                for solvent_rad in solvent_rads:
+                    for engine in engines:
+                        if (engine == 'linear') and (natoms > LINEAR_MAX_ATOMS):
+                            continue
+                        yield {'name': "{:s}/{:s}/{:s}/voxel{:g}/solvent{:g}"\
+                                       .format(sysname, mode, engine,
+                                               voxel_len, solvent_rad),
+                               'system': sysname,
+                               'mode': mode,
+                               'engine': engine,
+                               'voxel_len': voxel_len,
+                               'solvent_rad': solvent_rad}
+
+def _rss():
+    # current resident set size, in bytes
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+
+def _run_case(case, repeat, conn):
+    # runs in a fresh process; sends the results of the case through conn
+    solute_pos, solute_rad, solvent_pos = system(case['system'])
+    if case['mode'] == 'implicit':
+        solvent_pos = None
+        calculate = lambda: volume.volume(solute_pos, solute_rad,
+                                          case['solvent_rad'], case['voxel_len'],
+                                          engine=case['engine'])
+    else:
+        calculate = lambda: volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                       solvent_pos,
+                                                       case['solvent_rad'],
+                                                       case['voxel_len'],
+                                                       engine=case['engine'])
+    before = _rss()
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        vol = calculate()
+        times.append(time.time() - t0)
+    # ru_maxrss is in kilobytes
+    peak = 1024*resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    voxels = grid_voxels(solute_pos, solute_rad, case['solvent_rad'],
+                         case['voxel_len'], solvent_pos)
+    result = dict(case)
+    result.update({'natoms': int(solute_pos.shape[0]),
+                   'nsolvent': 0 if solvent_pos is None else int(solvent_pos.shape[0]),
+                   'volume': vol,
+                   'time': min(times),
+                   'peak_rss': max(peak, 0),
+                   'voxels': voxels,
+                   'voxels_per_s': voxels/max(min(times), 1e-9)})
+    conn.send(result)
+    conn.close()
+
+def run_case(case, repeat=3):
+    '''
+    Run ``case`` ``repeat`` times in a fresh process, and return its results.
+    '''
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case,
+                                      args=(case, repeat, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        raise RuntimeError("benchmark case {:s} failed".format(case['name']))
+    finally:
+        process.join()
+    return result
+
+def metadata():
+    return {'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': multiprocessing.cpu_count()}
+
+def compare(results, baseline, threshold=0.1):
+    '''
+    Check ``results`` against ``baseline`` (both lists of the results of
+    cases). A case is flagged if it got slower, or used more memory, by more
+    than ``threshold`` (relative), or if its volume changed.
+
+    -------------
+    Returns
+    -------------
+    The number of flagged cases
+    '''
+    old = dict((result['name'], result) for result in baseline)
+    flagged = 0
+    print("{:60s} {:>10s} {:>10s} {:>8s}".format("case", "baseline", "time",
+                                                 "ratio"))
+    for result in results:
+        if result['name'] not in old:
+            print("{:60s} {:>10s} {:10.4f}".format(result['name'], "-",
+                                                   result['time']))
+            continue
+        base = old[result['name']]
+        ratio = result['time']/max(base['time'], 1e-9)
+        flags = []
+        if ratio > 1 + threshold:
+            flags.append("SLOWER")
+        if result['peak_rss'] > (1 + threshold)*base['peak_rss'] +\
+                (1 << 20):
+            flags.append("MORE MEMORY ({:.1f} MB -> {:.1f} MB)"\
+                         .format(base['peak_rss']/2.**20,
+                                 result['peak_rss']/2.**20))
+        if result['volume'] != base['volume']:
+            flags.append("VOLUME CHANGED ({!r} -> {!r})"\
+                         .format(base['volume'], result['volume']))
+        if flags:
+            flagged += 1
+        print("{:60s} {:10.4f} {:10.4f} {:7.2f}x {:s}"\
+              .format(result['name'], base['time'], result['time'], ratio,
+                      " ".join(flags)))
+    print("{:d} of {:d} cases flagged".format(flagged, len(results)))
+    return flagged
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the volume "
+                                     "calculations")
+    parser.add_argument("-o", "--output", dest="output", type=str,
+                        default="benchmark.json",
+                        help="Path of the JSON file to write the results to")
+    parser.add_argument("-c", "--compare", dest="compare", type=str,
+                        help="Path of the JSON file of an earlier run to "
+                        "compare the results against")
+    parser.add_argument("-t", "--threshold", dest="threshold", type=float,
+                        default=0.1,
+                        help="Relative slowdown (or growth in memory) to flag")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3,
+                        help="Number of runs of each case; the fastest counts")
+    parser.add_argument("-e", "--engines", dest="engines", nargs='+',
+                        default=list(volume.ENGINES), choices=volume.ENGINES,
+                        help="Engines to benchmark")
+    parser.add_argument("-q", "--quick", dest="quick", action="store_true",
+                        help="Only benchmark the small systems, at the "
+                        "coarsest voxel length")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _parse_args()
+    natoms = NATOMS[:1] if args.quick else NATOMS
+    systems = [('villin', villin_system()[0].shape[0])] +\
+              [('synthetic-{:d}'.format(n), n) for n in natoms]
+    voxel_lens = VOXEL_LENS[:1] if args.quick else VOXEL_LENS
+
+    results = []
+    for case in cases(systems, args.engines, voxel_lens=voxel_lens):
+        result = run_case(case, args.repeat)
+        print("{:60s} {:10.4f} s {:8.1f} MB {:12.3g} voxels/s   volume {:.3f}"\
+              .format(result['name'], result['time'],
+                      result['peak_rss']/2.**20, result['voxels_per_s'],
+                      result['volume']))
+        results.append(result)
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta': metadata(), 'results': results}, f, indent=1)
+    print("Results written to {:s}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
@@ -1,9 +1,19 @@
 #!/usr/bin/env python
 import numpy
+import asyncio
+import glob
+import os
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append('../')
 import volume
+import volumecache
 import pdb2volume
+import genradiilib
 
 def test_simple():
     solute_pos = numpy.array(((0,0,0),), dtype=numpy.float64)
@@ -296,10 +306,1073 @@ def test_void():
         print("  TEST FAILED")
 
 
+def test_engines():
+    print("Test: all engines give identical volumes")
+    numpy.random.seed(1)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    solvent_pos = numpy.random.uniform(-3, 13, size=(20,3))
+    solvent_rad = 1.4
+    voxel_len = 0.2
+
+    vols = []
+    for engine in volume.ENGINES:
+        vol = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                            engine=engine)
+        vol_explicit = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                  solvent_pos, solvent_rad,
+                                                  voxel_len, engine=engine)
+        print("  {:s}: {:f} (explicit solvent: {:f})".format(engine, vol,
+                                                            vol_explicit))
+        vols.append((vol, vol_explicit))
+    if all(v == vols[0] for v in vols):
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_solvation_shell():
+    print("Test: explicit solvent cropped to a shell around the solute")
+    # a hollow ball of atoms, too tight for water to pass, with one water in
+    # the cavity and a box of water around it
+    n = 400
+    k = numpy.arange(n) + 0.5
+    phi = numpy.arccos(1 - 2*k/n)
+    theta = numpy.pi*(1 + 5**0.5)*k
+    solute_pos = 8*numpy.array((numpy.cos(theta)*numpy.sin(phi),
+                                numpy.sin(theta)*numpy.sin(phi),
+                                numpy.cos(phi))).T
+    solute_rad = numpy.full(n, 1.5)
+    lattice = numpy.mgrid[-20:20:3.1, -20:20:3.1, -20:20:3.1].reshape(3, -1).T
+    outside = lattice[numpy.sqrt((lattice**2).sum(axis=1)) > 11]
+    solvent_pos = numpy.concatenate((((0.5, 0.2, 0.1),), outside))
+    solvent_rad = 1.4
+    voxel_len = 0.25
+
+    failed = 0
+    ref, ref_stats = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                solvent_pos, solvent_rad,
+                                                voxel_len, stats=True)
+    dry = volume.volume_explicit_sol(solute_pos, solute_rad, outside,
+                                     solvent_rad, voxel_len)
+    print("  whole box: {:f}, {} voxels; without the internal water: {:f}"\
+          .format(ref, ref_stats.shape, dry))
+    if dry <= ref:
+        failed = 1
+    for engine in volume.ENGINES:
+        for shell in (0.0, 3.0, 100.0):
+            vol, stats = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                    solvent_pos, solvent_rad,
+                                                    voxel_len, engine=engine,
+                                                    stats=True,
+                                                    solvent_shell=shell)
+            print("  {:s}, shell {:.1f}: {:f}, {} voxels".format(
+                engine, shell, vol, stats.shape))
+            if (vol != ref) or ((shell < 10) and (numpy.prod(stats.shape) >
+                                                  numpy.prod(ref_stats.shape)/4)):
+                failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_periodic():
+    print("Test: volumes in a periodic box")
+    # the hollow ball of test_solvation_shell, in a box that the lattice of
+    # water tiles
+    n = 400
+    k = numpy.arange(n) + 0.5
+    phi = numpy.arccos(1 - 2*k/n)
+    theta = numpy.pi*(1 + 5**0.5)*k
+    solute_pos = 8*numpy.array((numpy.cos(theta)*numpy.sin(phi),
+                                numpy.sin(theta)*numpy.sin(phi),
+                                numpy.cos(phi))).T
+    solute_rad = numpy.full(n, 1.5)
+    lattice = numpy.mgrid[-20:20:3.1, -20:20:3.1, -20:20:3.1].reshape(3, -1).T
+    outside = lattice[numpy.sqrt((lattice**2).sum(axis=1)) > 11]
+    solvent_pos = numpy.concatenate((((0.5, 0.2, 0.1),), outside))
+    solvent_rad = 1.4
+    voxel_len = 0.25
+    box = numpy.full(3, 40.3)
+    # a shift by whole voxels that puts the ball across the corner of the box
+    spacing = box/numpy.ceil(box/voxel_len)
+    shift = numpy.round(box/2/spacing)*spacing
+
+    failed = 0
+    # without a box, the volume of the voxels outside the exterior
+    vol, stats = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                               stats=True)
+    excluded = (numpy.prod(stats.shape) - stats.voxels_accessible)*voxel_len**3
+    pbc = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                        box=box)
+    split = volume.volume(solute_pos + shift, solute_rad, solvent_rad,
+                          voxel_len, box=numpy.diag(box))
+    print("  excluded voxels without a box: {:f}; in the box: {:f}, split "\
+          "over the faces: {:f}".format(excluded, pbc, split))
+    if (abs(pbc - excluded) > 0.01*excluded) or (split != pbc):
+        failed = 1
+    wet = volume.volume_explicit_sol(solute_pos, solute_rad, solvent_pos,
+                                     solvent_rad, voxel_len, box=box)
+    dry = volume.volume_explicit_sol(solute_pos, solute_rad, outside,
+                                     solvent_rad, voxel_len, box=box)
+    wet_split = volume.volume_explicit_sol(solute_pos + shift, solute_rad,
+                                           solvent_pos + shift, solvent_rad,
+                                           voxel_len, box=box)
+    print("  explicit solvent: {:f}, split: {:f}; without the internal "\
+          "water: {:f}".format(wet, wet_split, dry))
+    if (dry != pbc) or (wet >= dry) or (wet_split != wet):
+        failed = 1
+    for bad in ({'box': ((40, 0, 0), (10, 40, 0), (0, 0, 40))},
+                {'box': box, 'return_grid': True}):
+        try:
+            volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                          **bad)
+            failed = 1
+        except ValueError:
+            pass
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_kernels():
+    print("Test: the raster kernels mark the same voxels")
+    failed = 0
+    for seed in range(4):
+        numpy.random.seed(seed)
+        if seed % 2:
+            # atoms on the grid, so that many voxels lie exactly on the
+            # exclusion spheres
+            solute_pos = numpy.random.randint(0, 20, size=(100,3))*0.5
+            solute_rad = numpy.random.choice([1.0, 1.5, 2.0], size=100)
+            solvent_rad = 0.5
+            voxel_len = 0.5
+        else:
+            solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+            solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+            solvent_rad = 1.4
+            voxel_len = 0.2
+        for nthreads in (1, 2):
+            grids = {}
+            vols = {}
+            for kernel in volume.KERNELS:
+                vols[kernel], grids[kernel] = volume.volume(
+                    solute_pos, solute_rad, solvent_rad, voxel_len,
+                    engine='raster', nthreads=nthreads, kernel=kernel,
+                    return_grid=True)
+            print("  seed {:d}, {:d} threads: {:s}"\
+                  .format(seed, nthreads,
+                          ", ".join("{:s} {:f}".format(kernel, vols[kernel])
+                                    for kernel in volume.KERNELS)))
+            if (vols['batch'] != vols['scalar']) or\
+                    not numpy.array_equal(grids['batch'].bits,
+                                          grids['scalar'].bits) or\
+                    (abs(vols['batch32'] - vols['scalar']) > 1e-3*vols['scalar']):
+                failed = 1
+    try:
+        volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                      engine='raster', kernel='simd')
+        failed = 1
+    except ValueError:
+        pass
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_threads():
+    print("Test: volumes do not depend on the number of threads")
+    # a hollow cube of spheres (as in test_void) with one water outside and one
+    # in the void, so that the accessible voxels form several separate regions
+    s = 1.4
+    solute_pos = numpy.array([(a*s, b*s, c*s) for a in (0,2,4,6)
+                                              for b in (0,2,4,6)
+                                              for c in (0,2,4,6)
+                              if not (a in (2,4) and b in (2,4) and c in (2,4))],
+                             dtype=numpy.float64)
+    solute_rad = numpy.ones(solute_pos.shape[0])*s
+    solvent_pos = numpy.array(((10*s,0,0),(3*s,3*s,3*s)), dtype=numpy.float64)
+    voxel_len = 0.15
+
+    failed = 0
+    for engine in volume.ENGINES:
+        vols = []
+        for nthreads in (1, 2, 4):
+            vol = volume.volume(solute_pos, solute_rad, s, voxel_len,
+                                engine=engine, nthreads=nthreads)
+            vol_explicit = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                      solvent_pos, s, voxel_len,
+                                                      engine=engine,
+                                                      nthreads=nthreads)
+            print("  {:s}, {:d} threads: {:f} (explicit solvent: {:f})"\
+                  .format(engine, nthreads, vol, vol_explicit))
+            vols.append((vol, vol_explicit))
+        if not all(v == vols[0] for v in vols):
+            failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_concurrent():
+    print("Test: concurrent calculations in threads and from asyncio")
+    pdbvol = pdb2volume.PDBVolume('villin.pdb', 'radii.lib', voxel_len=0.1)
+    solute_pos, solute_rad = pdbvol.select(report=False)[:2]
+    solvent_rad = 1.4
+    voxel_lens = (0.2, 0.3, 0.4, 0.5)
+    passed = True
+
+    serial = [volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len)
+              for voxel_len in voxel_lens]
+    with ThreadPoolExecutor(4) as executor:
+        threaded = list(executor.map(
+            lambda voxel_len: volume.volume(solute_pos, solute_rad,
+                                            solvent_rad, voxel_len),
+            voxel_lens))
+    async def gather():
+        return await asyncio.gather(*[
+            volume.volume_async(solute_pos, solute_rad, solvent_rad, voxel_len)
+            for voxel_len in voxel_lens])
+    awaited = asyncio.run(gather())
+    # a coroutine, to run directly or as a task
+    direct = asyncio.run(volume.volume_async(solute_pos, solute_rad,
+                                             solvent_rad, voxel_lens[0]))
+    async def tasks():
+        return await asyncio.gather(*[asyncio.create_task(
+            volume.volume_async(solute_pos, solute_rad, solvent_rad, voxel_len))
+            for voxel_len in voxel_lens])
+    tasked = asyncio.run(tasks())
+    print("  serial:   {}".format(serial))
+    print("  threads:  {}".format(threaded))
+    print("  awaited:  {}".format(awaited))
+    print("  tasks:    {}".format(tasked))
+    if (threaded != serial) or (awaited != serial) or (tasked != serial) or\
+            (direct != serial[0]):
+        passed = False
+
+    # a thread counting in Python keeps going while a calculation runs
+    def rate(done):
+        n = 0
+        start = time.time()
+        while not done():
+            n += 1
+        return n/(time.time() - start)
+    idle = rate(lambda start=time.time(): time.time() - start > 0.5)
+    finished = threading.Event()
+    def calculate():
+        volume.volume(solute_pos, solute_rad, solvent_rad, 0.1)
+        finished.set()
+    thread = threading.Thread(target=calculate)
+    thread.start()
+    busy = rate(finished.is_set)
+    thread.join()
+    print("  counting while a calculation runs: {:.0f}% of the idle rate"\
+          .format(100*busy/idle))
+    if busy < 0.2*idle:
+        passed = False
+
+    # a grid that does not fit in memory raises MemoryError, and the process
+    # goes on
+    code = """
+import numpy, resource, sys
+sys.path.append('../')
+import volume
+resource.setrlimit(resource.RLIMIT_AS, (2*1024**3, 2*1024**3))
+solute_pos = numpy.array(((0,0,0),), dtype=numpy.float64)
+solute_rad = numpy.array((3,), dtype=numpy.float64)
+try:
+    volume.volume(solute_pos, solute_rad, 1.4, 0.003)
+except MemoryError:
+    print('MemoryError')
+print(volume.volume(solute_pos, solute_rad, 1.4, 0.1) > 0)
+"""
+    output = subprocess.check_output([sys.executable, '-c', code]).decode()
+    print("  3 GB grid under a 2 GB limit: {}".format(" ".join(output.split())))
+    if output.split() != ['MemoryError', 'True']:
+        passed = False
+    if passed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_trajectory():
+    print("Test: volumes of a trajectory")
+    numpy.random.seed(2)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    # frames of different extents, so that the grids are resized in between
+    frames = numpy.array([solute_pos*(1 + 0.1*(i % 3))
+                          + numpy.random.normal(scale=0.2, size=(100,3))
+                          for i in range(6)])
+    solvent_rad = 1.4
+    voxel_len = 0.2
+
+    expected = numpy.array([volume.volume(frame, solute_rad, solvent_rad,
+                                          voxel_len) for frame in frames])
+    vols = volume.volume_trajectory(frames, solute_rad, solvent_rad, voxel_len)
+    vols_workers = volume.volume_trajectory(iter(frames), solute_rad,
+                                            solvent_rad, voxel_len, workers=2,
+                                            chunksize=2)
+    print("  Expected volumes:   {}".format(expected))
+    print("  Calculated volumes: {}".format(vols))
+    print("  With 2 workers:     {}".format(vols_workers))
+    if numpy.array_equal(vols, expected) and\
+            numpy.array_equal(vols_workers, expected):
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_calculator():
+    print("Test: a VolumeCalculator gives the same volumes as volume()")
+    numpy.random.seed(3)
+    solvent_rad = 1.4
+    voxel_len = 0.2
+    calc = volume.VolumeCalculator(solvent_rad, voxel_len)
+    failed = 0
+    # molecules of different sizes, so that the buffers have to grow (and are
+    # reused when they are big enough)
+    for natoms, size in ((20, 8.), (5, 4.), (60, 12.), (10, 6.)):
+        solute_pos = numpy.random.uniform(0, size, size=(natoms,3))
+        solute_rad = numpy.random.uniform(1.0, 2.0, size=natoms)
+        solvent_pos = numpy.random.uniform(-3, size+3, size=(5,3))
+        expected = volume.volume(solute_pos, solute_rad, solvent_rad,
+                                 voxel_len)
+        expected_explicit = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                                       solvent_pos, solvent_rad,
+                                                       voxel_len)
+        vol = calc.volume(solute_pos, solute_rad)
+        vol_explicit = calc.volume_explicit_sol(solute_pos, solute_rad,
+                                                solvent_pos)
+        print("  {:d} atoms: {:f} (explicit solvent: {:f}); {:d} bytes of grids"\
+              .format(natoms, vol, vol_explicit, calc.grid_capacity))
+        if (vol != expected) or (vol_explicit != expected_explicit):
+            failed = 1
+    calc.close()
+    if calc.grid_capacity != 0:
+        failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_many_waters():
+    print("Test: many waters in one region give the same volume as a few")
+    numpy.random.seed(4)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    solvent_rad = 1.4
+    voxel_len = 0.2
+    # waters on a shell around the solute, all in the region outside of it
+    direction = numpy.random.normal(size=(500,3))
+    direction /= numpy.linalg.norm(direction, axis=1)[:,numpy.newaxis]
+    solvent_pos = 5 + direction*15
+    vol_many = volume.volume_explicit_sol(solute_pos, solute_rad, solvent_pos,
+                                          solvent_rad, voxel_len)
+    # two waters (also outside of the solute) that span the same box
+    solvent_box = numpy.array((solvent_pos.min(axis=0),
+                               solvent_pos.max(axis=0)))
+    vol_box = volume.volume_explicit_sol(solute_pos, solute_rad, solvent_box,
+                                         solvent_rad, voxel_len)
+    print("  500 waters: {:f}; 2 waters: {:f}".format(vol_many, vol_box))
+    if vol_many == vol_box:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_adaptive():
+    print("Test: adaptive refinement of the volume of a sphere")
+    solute_pos = numpy.array(((0,0,0),), dtype=numpy.float64)
+    solute_rad = numpy.array((3,), dtype=numpy.float64)
+    solvent_rad = 1.4
+    vol, levels = volume.volume_adaptive(solute_pos, solute_rad, solvent_rad,
+                                         tol=1e-3, coarse_voxel_len=0.4,
+                                         min_voxel_len=0.05,
+                                         return_levels=True)
+    # every level is the volume at its voxel length
+    passed = True
+    for voxel_len, level_vol in levels:
+        print("  voxel_len {:f}: {:f}".format(voxel_len, level_vol))
+        if level_vol != volume.volume(solute_pos, solute_rad, solvent_rad,
+                                      voxel_len):
+            passed = False
+    if (vol != levels[-1][1]) or (levels[-1][0] < 0.05) or (len(levels) < 2):
+        passed = False
+    # stopped at the tolerance, or at the finest level allowed
+    if (abs(vol - levels[-2][1]) > 1e-3*vol) and (levels[-1][0]/2 >= 0.05):
+        passed = False
+    if passed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_sampled():
+    print("Test: volume estimated from quasi-random points")
+    # the two overlapping spheres of test_2sphere_overlapping
+    solute_pos = numpy.array(((0,0,0), (3,0,0)), dtype=numpy.float64)
+    solute_rad = numpy.array((3,3), dtype=numpy.float64)
+    solvent_rad = 1.4
+    r = solute_rad[0] + solvent_rad
+    h = r - 1.5
+    analytical_vol = 2*numpy.pi*4./3*r**3 - 2*1./3*numpy.pi*h**2*(3*r - h)
+
+    passed = True
+    vol, err, npoints = volume.volume_sampled(solute_pos, solute_rad,
+                                              solvent_rad, rel_error=0.001,
+                                              seed=0, return_points=True)
+    print("  sampled volume: {:f} +- {:f} from {:d} points"\
+          .format(vol, err, npoints))
+    print("  analytical volume: {:f}".format(analytical_vol))
+    if (abs(vol - analytical_vol) > 4*err) or (err > 0.001*vol):
+        passed = False
+    # a looser error stops sooner, and the same seed gives the same estimate
+    loose = volume.volume_sampled(solute_pos, solute_rad, solvent_rad,
+                                  rel_error=0.01, seed=0, return_points=True)
+    print("  with rel_error 0.01: {:f} +- {:f} from {:d} points".format(*loose))
+    if (loose[2] >= npoints) or (loose != volume.volume_sampled(
+            solute_pos, solute_rad, solvent_rad, rel_error=0.01, seed=0,
+            return_points=True)):
+        passed = False
+    # the void of a hollow ball is excluded from the estimate, as from the grid
+    n = 400
+    k = numpy.arange(n) + 0.5
+    phi = numpy.arccos(1 - 2*k/n)
+    theta = numpy.pi*(1 + 5**0.5)*k
+    ball_pos = 8*numpy.array((numpy.cos(theta)*numpy.sin(phi),
+                              numpy.sin(theta)*numpy.sin(phi),
+                              numpy.cos(phi))).T
+    ball_rad = numpy.full(n, 1.5)
+    vol, err = volume.volume_sampled(ball_pos, ball_rad, solvent_rad, seed=0)
+    grid_vol, stats = volume.volume(ball_pos, ball_rad, solvent_rad, 0.1,
+                                    engine='raster', stats=True)
+    excluded = (numpy.prod(stats.shape) - stats.voxels_accessible)*0.1**3
+    print("  hollow ball: {:f} +- {:f}; excluded voxels at 0.1: {:f}"\
+          .format(vol, err, excluded))
+    if abs(vol - excluded) > 4*err + 0.002*excluded:
+        passed = False
+    if passed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_stats():
+    print("Test: counters of a calculation with stats=True")
+    numpy.random.seed(5)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    solvent_pos = numpy.random.uniform(-3, 13, size=(20,3))
+    solvent_rad = 1.4
+    voxel_len = 0.2
+
+    failed = 0
+    accessible = set()
+    for engine in volume.ENGINES:
+        for nthreads in (1, 2):
+            vol = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                                engine=engine, nthreads=nthreads)
+            vol_stats, stats = volume.volume(solute_pos, solute_rad,
+                                             solvent_rad, voxel_len,
+                                             engine=engine, nthreads=nthreads,
+                                             stats=True)
+            vol_explicit, stats_explicit = volume.volume_explicit_sol(
+                    solute_pos, solute_rad, solvent_pos, solvent_rad,
+                    voxel_len, engine=engine, nthreads=nthreads, stats=True)
+            print("  {:s}, {:d} threads: {!r}".format(engine, nthreads, stats))
+            # collecting stats does not change the volume
+            if vol_stats != vol:
+                failed = 1
+            accessible.add(stats.voxels_accessible)
+            if (stats.seeds != 1) or (stats.fills != 1) or\
+                    (stats_explicit.seeds < stats_explicit.fills) or\
+                    (stats.voxels_visited < stats.voxels_accessible) or\
+                    (stats.distance_evals <= 0) or\
+                    (stats.bytes_allocated <= 0):
+                failed = 1
+            if (engine != 'raster') and (stats.is_free_calls <= 0):
+                failed = 1
+            if sorted(stats.times) != sorted(volume.PHASES + ('total',)) or\
+                    min(stats.times.values()) < 0:
+                failed = 1
+    # every engine reaches the same voxels
+    if len(accessible) != 1:
+        failed = 1
+    calc = volume.VolumeCalculator(solvent_rad, voxel_len)
+    calc.volume(solute_pos, solute_rad)
+    if calc.stats is not None:
+        failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_grid():
+    print("Test: the grid of accessible voxels is returned and saved")
+    numpy.random.seed(6)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    solvent_pos = numpy.random.uniform(-3, 13, size=(20,3))
+    solvent_rad = 1.4
+    voxel_len = 0.2
+
+    failed = 0
+    grids = []
+    for engine in ('celllist', 'linear', 'raster'):
+        for nthreads in (1, 2):
+            vol = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                                engine=engine, nthreads=nthreads)
+            vol_grid, grid, stats = volume.volume(solute_pos, solute_rad,
+                                                  solvent_rad, voxel_len,
+                                                  engine=engine,
+                                                  nthreads=nthreads,
+                                                  return_grid=True, stats=True)
+            accessible = grid.unpack()
+            print("  {:s}, {:d} threads: {!r}, {:d} accessible voxels"\
+                  .format(engine, nthreads, grid, int(accessible.sum())))
+            if (vol_grid != vol) or (accessible.shape != grid.shape) or\
+                    (accessible.sum() != stats.voxels_accessible) or\
+                    (grid.count() != stats.voxels_accessible):
+                failed = 1
+            grids.append(accessible)
+    # the voxel at the center of an atom is blocked, the corner is not
+    index = tuple(numpy.round((solute_pos[0] - grid.origin)/grid.spacing)\
+                  .astype(int))
+    if accessible[index] or not accessible[0,0,0]:
+        failed = 1
+    if not all(numpy.array_equal(g, grids[0]) for g in grids):
+        failed = 1
+
+    # a grid written to disk reads back the same
+    path = os.path.join(tempfile.mkdtemp(), 'grid.npz')
+    vol, grid = volume.volume_explicit_sol(solute_pos, solute_rad, solvent_pos,
+                                           solvent_rad, voxel_len,
+                                           return_grid=True)
+    grid.save(path)
+    loaded = volume.AccessibleGrid.load(path)
+    print("  saved in {:d} bytes ({:d} bytes in memory)"\
+          .format(os.path.getsize(path), grid.bits.nbytes))
+    if (loaded.shape != grid.shape) or (loaded.spacing != grid.spacing) or\
+            not numpy.array_equal(loaded.origin, grid.origin) or\
+            not numpy.array_equal(loaded.unpack(), grid.unpack()):
+        failed = 1
+
+    # a calculator hands its grid over once, and then allocates a new one
+    calc = volume.VolumeCalculator(solvent_rad, voxel_len)
+    calc.volume(solute_pos, solute_rad)
+    grid = calc.take_grid()
+    try:
+        calc.take_grid()
+        failed = 1
+    except ValueError:
+        pass
+    if (calc.volume(solute_pos, solute_rad) != vol_grid) or\
+            not numpy.array_equal(calc.take_grid().unpack(), grid.unpack()):
+        failed = 1
+    try:
+        volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                      engine='sparse', return_grid=True)
+        failed = 1
+    except ValueError:
+        pass
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_sweep():
+    print("Test: volumes for several probe radii from one sweep")
+    numpy.random.seed(7)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    voxel_len = 0.2
+    # not in order, to check the volumes come back in the order given
+    probe_radii = [1.4, 0.0, 1.6, 1.0, 1.2]
+
+    failed = 0
+    for nthreads in (1, 2):
+        vols = volume.volume_probe_sweep(solute_pos, solute_rad, probe_radii,
+                                         voxel_len, nthreads=nthreads)
+        for probe_rad, vol in zip(probe_radii, vols):
+            ref = volume.volume(solute_pos, solute_rad, probe_rad, voxel_len)
+            single = volume.volume_probe_sweep(solute_pos, solute_rad,
+                                               [probe_rad], voxel_len,
+                                               nthreads=nthreads)[0]
+            print("  {:d} threads, probe {:.1f}: {:.4f} (volume: {:.4f})"\
+                  .format(nthreads, probe_rad, vol, ref))
+            # the same grid as volume for the largest (or only) probe
+            if (single != ref) or (abs(vol - ref) > 1e-2*ref) or\
+                    ((probe_rad == max(probe_radii)) and (vol != ref)):
+                failed = 1
+    try:
+        volume.volume_probe_sweep(solute_pos, solute_rad, [], voxel_len)
+        failed = 1
+    except ValueError:
+        pass
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+def test_incremental():
+    print("Test: incremental volumes of the frames of a trajectory")
+    numpy.random.seed(8)
+    radii = numpy.random.uniform(1.0, 2.0, size=150)
+    frame = numpy.random.uniform(0, 12, size=(150,3))
+    frames = [frame]
+    for i in range(12):
+        frame = frame.copy()
+        if i == 5:
+            # far out of the grid, which is then set up again
+            frame += 30
+        elif i != 8:
+            # some atoms move a little; nothing moves in frame 9
+            moved = numpy.random.uniform(size=150) < 0.2
+            frame[moved] += numpy.random.normal(0, 0.3, size=(moved.sum(), 3))
+        frames.append(frame)
+
+    failed = 0
+    inc = volume.IncrementalVolume(radii, 1.4, 0.25)
+    ref = volume.IncrementalVolume(radii, 1.4, 0.25)
+    vols = []
+    for frame in frames:
+        vol = inc.volume(frame)
+        # from scratch, on the same grid
+        full = ref.volume(frame, full=True)
+        single = volume.volume(frame, radii, 1.4, 0.25)
+        vols.append(vol)
+        print("  {:.4f} (from scratch: {:.4f}, volume: {:.4f})"\
+              .format(vol, full, single))
+        if (vol != full) or (abs(vol - single) > 1e-2*single):
+            failed = 1
+    print("  {:d} incremental updates, {:d} full".format(
+        inc.incremental_updates, inc.full_updates))
+    if (inc.full_updates < 2) or (inc.incremental_updates < 5):
+        failed = 1
+    inc.close()
+
+    traj = volume.volume_trajectory(frames, radii, 1.4, 0.25, incremental=True)
+    if not numpy.array_equal(traj, vols):
+        failed = 1
+    try:
+        inc.volume(frames[0][:10])
+        failed = 1
+    except ValueError:
+        pass
+    for max_dirty in (-1, 1.5, float('nan')):
+        try:
+            volume.IncrementalVolume(radii, 1.4, 0.25, max_dirty=max_dirty)
+            failed = 1
+        except ValueError:
+            pass
+
+    # a large probe, which covers voxels with hundreds of atoms
+    pdbvol = pdb2volume.PDBVolume('villin.pdb', 'radii.lib', voxel_len=0.5)
+    solute_pos, solute_rad = pdbvol.select(report=False)[:2]
+    single = volume.volume(solute_pos, solute_rad, 10.0, 0.5)
+    vol = volume.IncrementalVolume(solute_rad, 10.0, 0.5).volume(solute_pos)
+    traj = volume.volume_trajectory([solute_pos, solute_pos + 0.01],
+                                    solute_rad, 10.0, 0.5, incremental=True)
+    print("  solvent radius 10: {:.2f} (volume: {:.2f}), trajectory {}"\
+          .format(vol, single, traj))
+    if (abs(vol - single) > 1e-2*single) or\
+            (abs(traj - single) > 1e-2*single).any():
+        failed = 1
+    # more atoms on a voxel than the counts hold; every frame is then done
+    # from scratch
+    stacked = numpy.zeros((70000, 3))
+    stacked_rad = numpy.ones(70000)
+    inc = volume.IncrementalVolume(stacked_rad, 1.4, 0.25)
+    ref = volume.IncrementalVolume(stacked_rad[:1], 1.4, 0.25)
+    for shift in (0, 0.1):
+        vol = inc.volume(stacked + shift)
+        if vol != ref.volume(stacked[:1] + shift, full=True):
+            failed = 1
+    if inc.full_updates != 2:
+        failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+def test_tiled():
+    print("Test: tiled engine within a memory budget")
+    numpy.random.seed(9)
+    solute_pos = numpy.random.uniform(0, 10, size=(100,3))
+    solute_rad = numpy.random.uniform(1.0, 2.0, size=100)
+    solvent_pos = numpy.random.uniform(-3, 13, size=(20,3))
+    solvent_rad = 1.4
+    voxel_len = 0.2
+
+    failed = 0
+    ref = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                        engine='raster')
+    ref_explicit = volume.volume_explicit_sol(solute_pos, solute_rad,
+                                              solvent_pos, solvent_rad,
+                                              voxel_len, engine='raster')
+    scratch_dir = tempfile.mkdtemp()
+    # from slabs of a single plane to the whole grid in one slab
+    for budget in (1, 100000, volume.MEMORY_BUDGET):
+        for directory in (None, scratch_dir):
+            vol, stats = volume.volume(solute_pos, solute_rad, solvent_rad,
+                                       voxel_len, engine='tiled', stats=True,
+                                       memory_budget=budget,
+                                       scratch_dir=directory)
+            vol_explicit = volume.volume_explicit_sol(
+                solute_pos, solute_rad, solvent_pos, solvent_rad, voxel_len,
+                engine='tiled', nthreads=2, memory_budget=budget,
+                scratch_dir=directory)
+            print("  budget {:d}, scratch {}: {:f} (explicit solvent: {:f}), "\
+                  "{:d} bytes".format(budget, directory is not None, vol,
+                                      vol_explicit, stats.bytes_allocated))
+            if (vol != ref) or (vol_explicit != ref_explicit):
+                failed = 1
+    # the scratch files are removed as soon as they are mapped
+    if os.listdir(scratch_dir):
+        failed = 1
+    os.rmdir(scratch_dir)
+    try:
+        volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                      engine='tiled', return_grid=True)
+        failed = 1
+    except ValueError:
+        pass
+    # more voxels along x than the other engines take
+    long_pos = numpy.array(((0., 0., 0.), (70000., 0., 0.)))
+    long_rad = numpy.array((2., 2.))
+    long_solvent = numpy.array(((35000., 0., 0.),))
+    vol = volume.volume(long_pos, long_rad, solvent_rad, 1.0, engine='tiled')
+    vol_explicit = volume.volume_explicit_sol(long_pos, long_rad, long_solvent,
+                                              solvent_rad, 1.0, engine='tiled')
+    print("  70000 Angstroms along x: {:f} (explicit solvent: {:f})"\
+          .format(vol, vol_explicit))
+    if abs(vol_explicit - vol) > 1e-6*vol:
+        failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+def test_pdb_models():
+    print("Test: models of a multi-model PDB file are read one at a time")
+    with open('villin.pdb') as f:
+        atoms = [line for line in f if line.startswith('ATOM')]
+    # three models; the second one is shifted by 100 Angstroms along x, which
+    # does not change its volume
+    shifted = ["{:s}{:8.3f}{:s}".format(line[:30], float(line[30:38]) + 100,
+                                        line[38:]) for line in atoms]
+    pdbpath = os.path.join(tempfile.mkdtemp(), 'models.pdb')
+    with open(pdbpath, 'w') as f:
+        for i, model in enumerate((atoms, shifted, atoms)):
+            f.write("MODEL     {:4d}\n".format(i + 1))
+            f.writelines(model)
+            f.write("ENDMDL\n")
+    pdbvol = pdb2volume.PDBVolume(pdbpath, 'radii.lib', voxel_len=0.5)
+    vols = pdbvol.run_models()
+    vol = pdb2volume.PDBVolume('villin.pdb', 'radii.lib', voxel_len=0.5).run()
+    print("  volumes of the models: {}; single model: {:f}".format(vols, vol))
+    # an empty file has no models, and an empty structure
+    emptypath = os.path.join(os.path.dirname(pdbpath), 'empty.pdb')
+    open(emptypath, 'w').close()
+    nempty = len(list(pdb2volume.PDBStructure.models(emptypath)))
+    empty = pdb2volume.PDBStructure().from_file(emptypath)
+    if (pdbvol.pdb.atoms.shape[0] == len(atoms)) and (len(vols) == 3) and\
+            numpy.allclose(vols, vol, rtol=1e-3) and (vols[0] == vol) and\
+            (vols[2] == vol) and (nempty == 0) and (empty.atoms.shape[0] == 0):
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_batch():
+    print("Test: volumes of a batch of PDB files, resumed after an interruption")
+    tmpdir = tempfile.mkdtemp()
+    with open('villin.pdb') as f:
+        lines = f.readlines()
+    atoms = [line for line in lines if line.startswith('ATOM')]
+    # villin, villin without its first residue, and a file without atoms
+    first = atoms[0][22:26]
+    for name, records in (('a.pdb', atoms),
+                          ('b.pdb', [line for line in atoms
+                                     if line[22:26] != first]),
+                          ('c.pdb', [])):
+        with open(os.path.join(tmpdir, name), 'w') as f:
+            f.writelines(records)
+    vols = [pdb2volume.PDBVolume(os.path.join(tmpdir, name), 'radii.lib',
+                                 voxel_len=0.5).run()
+            for name in ('a.pdb', 'b.pdb')]
+
+    failed = 0
+    batch = pdb2volume.BatchVolume('radii.lib', voxel_len=0.5, workers=2)
+    for ext in ('.csv', '.jsonl'):
+        outpath = os.path.join(tmpdir, 'volumes' + ext)
+        rows, nskipped = batch.run([tmpdir], outpath)
+        byname = dict((os.path.basename(row['pdbpath']), row) for row in rows)
+        print("  {:s}: {}".format(ext, ", ".join(
+            "{:s} {}".format(name, byname[name]['volume'])
+            for name in sorted(byname))))
+        if (len(rows) != 3) or (nskipped != 0) or\
+                (byname['a.pdb']['volume'] != vols[0]) or\
+                (byname['b.pdb']['volume'] != vols[1]) or\
+                (not byname['c.pdb']['error']):
+            failed = 1
+        # cut the file off in the middle of the last line, as if the run was
+        # interrupted; the files without a volume are calculated again
+        with open(outpath, 'rb') as f:
+            data = f.read()
+        last_row = data[data.rstrip(b'\n').rfind(b'\n') + 1:]
+        with open(outpath, 'wb') as f:
+            f.write(data[:-len(last_row)//2])
+        # looking up what is finished leaves the file as it is
+        cut_size = os.path.getsize(outpath)
+        before = batch.finished(outpath)
+        if os.path.getsize(outpath) != cut_size:
+            failed = 1
+        rows, nskipped = batch.run(glob.glob(os.path.join(tmpdir, '*.pdb')),
+                                   outpath)
+        if nskipped != len(before):
+            failed = 1
+        done = batch.finished(outpath)
+        print("  resumed: {:d} calculated, {:d} skipped".format(len(rows),
+                                                                nskipped))
+        if (nskipped + len(rows) != 3) or (len(rows) < 1) or\
+                (sorted(os.path.basename(path) for path in done) !=
+                 ['a.pdb', 'b.pdb']):
+            failed = 1
+    if not failed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_volume_cache():
+    print("Test: cached volumes are looked up instead of calculated again")
+    solute_pos = numpy.array(((0,0,0), (3,0,0)), dtype=numpy.float64)
+    solute_rad = numpy.array((3,3), dtype=numpy.float64)
+    solvent_pos = numpy.array(((11,0,0),), dtype=numpy.float64)
+    solvent_rad = 1.4
+    voxel_len = 0.1
+    path = os.path.join(tempfile.mkdtemp(), 'cache')
+    passed = True
+
+    cache = volumecache.VolumeCache(path)
+    ref = volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len)
+    vols = [cache.volume(solute_pos, solute_rad, solvent_rad, voxel_len),
+            cache.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+                         engine='raster', nthreads=2)]
+    # the same structure and parameters in a new process hit the disk
+    cache = volumecache.VolumeCache(path)
+    vols.append(cache.volume(solute_pos.copy(), solute_rad, solvent_rad,
+                             voxel_len))
+    print("  volumes: {}; {}".format(vols, cache))
+    if (vols != [ref]*3) or (cache.disk_hits != 1) or (cache.misses != 0):
+        passed = False
+    # other coordinates, parameters or functions miss
+    moved = solute_pos + (0, 0, 0.01)
+    cache.volume(moved, solute_rad, solvent_rad, voxel_len)
+    cache.volume(solute_pos, solute_rad, 1.2, voxel_len)
+    vol = cache.volume_explicit_sol(solute_pos, solute_rad, solvent_pos,
+                                    solvent_rad, voxel_len)
+    if (cache.misses != 3) or (vol != volume.volume_explicit_sol(
+            solute_pos, solute_rad, solvent_pos, solvent_rad, voxel_len)):
+        passed = False
+    # a grid is cached with the volume
+    vol, grid = cache.volume(moved, solute_rad, solvent_rad, voxel_len,
+                             return_grid=True)
+    cached_vol, cached_grid = volumecache.VolumeCache(path).volume(
+        moved, solute_rad, solvent_rad, voxel_len, return_grid=True)
+    if (cache.misses != 4) or (cached_vol != vol) or\
+            not (cached_grid.unpack() == grid.unpack()).all():
+        passed = False
+    # PDBVolume.run goes through the cache too
+    pdbvol = pdb2volume.PDBVolume('villin.pdb', 'radii.lib', voxel_len=0.5,
+                                  cache=cache)
+    hits = cache.hits
+    if (pdbvol.run() != pdbvol.run()) or (cache.hits != hits + 1):
+        passed = False
+    # the least recently used results go when the store is full
+    nfiles = len(os.listdir(path))
+    small = volumecache.VolumeCache(path, max_bytes=1, memory_items=0)
+    small.volume(solute_pos, solute_rad, 1.0, voxel_len)
+    print("  {:d} files, then {:d} with max_bytes=1; {}"\
+          .format(nfiles, len(os.listdir(path)), small))
+    if (len(os.listdir(path)) > 1) or (small.evictions < nfiles):
+        passed = False
+    if passed:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_radii_cache():
+    print("Test: compiled radii library is cached, and rebuilt when it changes")
+    radiipath = os.path.join(tempfile.mkdtemp(), 'radii.lib')
+    with open('radii.lib') as f:
+        lines = f.readlines()
+    with open(radiipath, 'w') as f:
+        f.writelines(lines)
+    library = pdb2volume.RadiiLibrary.load(radiipath)
+    cached = pdb2volume.RadiiLibrary.load(radiipath)
+    resnames = ['ALA', 'ALA', 'Cl-']
+    atomnames = [' CA ', ' H  ', 'Cl- ']
+    radii = library.lookup(resnames, atomnames)
+    passed = os.path.exists(radiipath + '.npz') and\
+             numpy.array_equal(radii, cached.lookup(resnames, atomnames),
+                               equal_nan=True) and\
+             (radii[0] == 1.908) and (radii[1] == 0.6) and numpy.isnan(radii[2])
+    # add a radius for the ion; the size of the library changes
+    with open(radiipath, 'a') as f:
+        f.write("Cl- Cl-  2.470\n")
+    radii = pdb2volume.RadiiLibrary.load(radiipath).lookup(resnames, atomnames)
+    print("  radii: {}".format(radii))
+    if passed and (radii[2] == 2.47):
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_genradiilib():
+    print("Test: radii library of a small Amber topology")
+    # two atom types, with radii 1 and 0.5
+    parm7 = """%VERSION  VERSION_STAMP = V0001.000
+%FLAG ATOM_NAME
+%FORMAT(20a4)
+N   CA  O   H1  Cl- 
+%FLAG CHARGE
+%FORMAT(5E16.8)
+  1.00000000E+00  0.00000000E+00 -1.00000000E+00  5.00000000E-01 -1.00000000E+00
+%FLAG ATOM_TYPE_INDEX
+%FORMAT(10I8)
+       1       2       1       2       1
+%FLAG NONBONDED_PARM_INDEX
+%FORMAT(10I8)
+       1       2       2       3
+%FLAG RESIDUE_LABEL
+%FORMAT(20a4)
+ALA WAT Cl- 
+%FLAG RESIDUE_POINTER
+%FORMAT(10I8)
+       1       3       5
+%FLAG LENNARD_JONES_ACOEF
+%FORMAT(5E16.8)
+  3.20000000E+01  1.00000000E+00  5.00000000E-01
+%FLAG LENNARD_JONES_BCOEF
+%FORMAT(5E16.8)
+  1.00000000E+00  1.00000000E+00  1.00000000E+00
+"""
+    tmpdir = tempfile.mkdtemp()
+    parmpath = os.path.join(tmpdir, 'test.parm7')
+    radiipath = os.path.join(tmpdir, 'radii.lib')
+    with open(parmpath, 'w') as f:
+        f.write(parm7)
+    gen = genradiilib.RadiiLibGen(parmpath, radiipath)
+    with open(radiipath) as f:
+        lines = f.read().splitlines()
+    print("  radii.lib: {}".format(lines))
+    if lines == ["ALA  CA  0.500", "ALA  N   1.000", "Cl-  Cl- 1.000",
+                 "WAT  H1  0.500", "WAT  O   1.000"] and\
+            (gen.get_van_der_waals_radius(1) == 1) and\
+            (gen.get_van_der_waals_radius(2) == 0.5):
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
+def test_memory():
+    print("Test: peak memory of a fine grid")
+    # run in a fresh process, so that the peak resident set size only reflects
+    # this calculation
+    code = """
+import numpy, os, sys
+sys.path.append('../')
+import volume
+solute_pos = numpy.array(((0,0,0),), dtype=numpy.float64)
+solute_rad = numpy.array((3,), dtype=numpy.float64)
+# current resident set size, in bytes
+with open('/proc/self/statm') as f:
+    before = int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+volume.volume(solute_pos, solute_rad, 1.4, 0.05)
+# peak resident set size, in bytes. Unlike ru_maxrss, which keeps the peak of
+# the parent process across fork and exec, VmHWM starts over in this process.
+with open('/proc/self/status') as f:
+    after = 1024*int([line.split()[1] for line in f
+                      if line.startswith('VmHWM:')][0])
+print(after-before)
+"""
+    peak = int(subprocess.check_output([sys.executable, '-c', code]))
+
+    # 353 voxels along each axis
+    n = int(numpy.ceil(4*(3+1.4)/0.05)) + 1
+    # one byte per voxel for each of the two grids, plus a queue of 6-byte
+    # grid indices with one slot per voxel
+    old_layout = 8*n**3
+    print("  peak memory:            {:.1f} MB".format(peak/1e6))
+    print("  memory of voxel grids:  {:.1f} MB".format(volume.grid_memory(n, n, n)/1e6))
+    print("  memory with byte grids: {:.1f} MB".format(old_layout/1e6))
+    if peak < old_layout/10:
+        print("  TEST PASSED")
+        return 0
+    else:
+        print("  TEST FAILED")
+        return 1
+
+
 def show_protein_surface():
     vol, grid = pdb2volume.PDBVolume('villin.pdb', 
-                                     'radii.lib', voxel_len=0.5).run()
+                                     'radii.lib', voxel_len=0.5).run(return_grid=True)
     print(vol)
+    grid = grid.unpack()
     fig = pyplot.figure()
     ax = fig.add_subplot(111, projection='3d')
     w = numpy.where(grid==0)
@@ -320,3 +1393,25 @@ if __name__ == "__main__":
     test_2sphere_overlapping()
     test_protein()
     test_void()
+    test_engines()
+    test_solvation_shell()
+    test_periodic()
+    test_kernels()
+    test_threads()
+    test_concurrent()
+    test_trajectory()
+    test_calculator()
+    test_many_waters()
+    test_adaptive()
+    test_sampled()
+    test_stats()
+    test_grid()
+    test_sweep()
+    test_incremental()
+    test_tiled()
+    test_pdb_models()
+    test_batch()
+    test_volume_cache()
+    test_radii_cache()
+    test_genradiilib()
+    test_memory()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+import collections
+import hashlib
+import numpy
+import os
+import sys
+import tempfile
+import threading
+sys.path.append('../')
+import volume
+'''
+A cache of the results of volume calculations, so that the volume of a
+structure that was already calculated with the same parameters (on a re-run,
+or in an overlapping ensemble) is looked up instead.
+
+-----------
+How to use:
+  cache = VolumeCache('volumes.cache')
+  vol = cache.volume(solute_pos, solute_rad, 1.4, 0.1)
+
+  Results are kept in memory and in the directory given, which may be shared
+  by many runs. pdb2volume.PDBVolume takes a cache with ``cache=``.
+'''
+
+# part of every key; bump it when a change to the calculations changes their
+# results, so that results of the old calculations are no longer used
+CACHE_VERSION = 1
+
+# keyword arguments of the volume functions that the result does not depend
+# on (every engine gives the same volume); they are left out of the key
+_UNKEYED = ('engine', 'nthreads', 'memory_budget', 'scratch_dir',
+            'return_grid', 'stats')
+
+# defaults of the other keyword arguments, which are left out of the key when
+# they are given, as are those given as None
+_DEFAULTS = {'kernel': 'batch'}
+
+class VolumeCache(object):
+    '''
+    Results of ``volume.volume`` and ``volume.volume_explicit_sol``, keyed by
+    a hash of the bytes of the coordinate and radius arrays, the solvent
+    radius, the voxel length, the function and its other arguments.
+
+    The most recently used ``memory_items`` results are kept in memory, and
+    every result is written to ``path`` (if given), a directory with one
+    file per result. When the files take more than ``max_bytes``, those used
+    least recently (by modification time, which every hit updates) are
+    removed. Files are written to a temporary name first, so that processes
+    sharing the directory never read a partial result.
+
+    A result with the AccessibleGrid of ``return_grid`` also serves calls
+    without it; a call with ``return_grid`` misses a result without a grid.
+    The grid returned is shared with the cache and later hits, so it should
+    not be changed. Calls with ``stats`` are not cached, since the timings are
+    those of a calculation.
+
+    -----------
+    Parameters
+    -----------
+    path: directory of the on-disk store, made if needed; None to only keep
+        results in memory
+    max_bytes: most bytes of files to keep in ``path``
+    memory_items: most results to keep in memory
+
+    ``hits`` and ``misses`` count the calls answered from the cache and those
+    calculated; ``memory_hits`` and ``disk_hits`` split up the hits, and
+    ``evictions`` counts the files removed to stay within ``max_bytes``.
+    '''
+    def __init__(self, path=None, max_bytes=1 << 30, memory_items=128):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive, not {}"\
+                             .format(max_bytes))
+        if memory_items < 0:
+            raise ValueError("memory_items must not be negative, not {}"\
+                             .format(memory_items))
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key: (volume, grid or None), least recently used first
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def __repr__(self):
+        return "VolumeCache(path={!r}, hits={:d}, misses={:d}, "\
+               "memory_hits={:d}, disk_hits={:d}, evictions={:d})"\
+               .format(self.path, self.hits, self.misses, self.memory_hits,
+                       self.disk_hits, self.evictions)
+
+    def volume(self, solute_pos, solute_rad, solvent_rad, voxel_len, **kwargs):
+        '''
+        ``volume.volume(solute_pos, solute_rad, solvent_rad, voxel_len,
+        **kwargs)``, from the cache if it was calculated before
+        '''
+        return self._cached(volume.volume, (solute_pos, solute_rad),
+                            (solvent_rad, voxel_len), kwargs)
+
+    def volume_explicit_sol(self, solute_pos, solute_rad, solvent_pos,
+                            solvent_rad, voxel_len, **kwargs):
+        '''
+        ``volume.volume_explicit_sol(solute_pos, solute_rad, solvent_pos,
+        solvent_rad, voxel_len, **kwargs)``, from the cache if it was
+        calculated before
+        '''
+        return self._cached(volume.volume_explicit_sol,
+                            (solute_pos, solute_rad, solvent_pos),
+                            (solvent_rad, voxel_len), kwargs)
+
+    def clear(self):
+        '''
+        Remove every result, from memory and from disk. The counters are kept.
+        '''
+        with self._lock:
+            self._memory.clear()
+            for name, nbytes, mtime in self._files():
+                self._remove(name)
+
+    def key(self, function, arrays, scalars, kwargs):
+        '''
+        Hex digest that identifies the result of ``function(*arrays,
+        *scalars, **kwargs)``
+        '''
+        digest = hashlib.sha256()
+        digest.update("{:d} {:s}".format(CACHE_VERSION,
+                                         function.__name__).encode())
+        for array in arrays:
+            array = numpy.ascontiguousarray(array, dtype=numpy.float64)
+            digest.update(repr(array.shape).encode())
+            digest.update(array.data)
+        digest.update(repr(tuple(float(x) for x in scalars)).encode())
+        for name in sorted(kwargs):
+            value = kwargs[name]
+            if (name in _UNKEYED) or (value is None) or\
+                    (_DEFAULTS.get(name) == value):
+                continue
+            if not isinstance(value, str):
+                value = numpy.asarray(value, dtype=numpy.float64).tolist()
+            digest.update("{:s}={!r}".format(name, value).encode())
+        return digest.hexdigest()
+
+    def _cached(self, function, arrays, scalars, kwargs):
+        if kwargs.get('stats'):
+            return function(*(arrays + scalars), **kwargs)
+        return_grid = bool(kwargs.get('return_grid'))
+        key = self.key(function, arrays, scalars, kwargs)
+        with self._lock:
+            result = self._memory.pop(key, None)
+            if (result is not None) and (result[1] is None) and return_grid:
+                result = None
+            if result is not None:
+                self.memory_hits += 1
+            else:
+                result = self._read(key, return_grid)
+                if result is not None:
+                    self.disk_hits += 1
+            if result is not None:
+                self._remember(key, result)
+                return result if return_grid else result[0]
+            self.misses += 1
+
+        # calculate without holding the lock, so that other threads can look
+        # up and calculate other results meanwhile
+        result = function(*(arrays + scalars), **kwargs)
+        if not return_grid:
+            result = (result, None)
+        with self._lock:
+            self._remember(key, result)
+            self._write(key, result)
+        return result if return_grid else result[0]
+
+    def _remember(self, key, result):
+        # keep result in memory as the one used most recently
+        if self.memory_items == 0:
+            return
+        self._memory[key] = result
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _read(self, key, return_grid):
+        # the result stored on disk, or None if there is none (with a grid, if
+        # ``return_grid``)
+        if self.path is None:
+            return None
+        filename = self._filename(key)
+        try:
+            with numpy.load(filename) as stored:
+                if 'bits' in stored:
+                    grid = volume.AccessibleGrid(stored['bits'], stored['shape'],
+                                                 stored['origin'],
+                                                 stored['spacing'])
+                elif return_grid:
+                    return None
+                else:
+                    grid = None
+                result = (float(stored['volume']), grid)
+            # a hit makes the file the most recently used
+            os.utime(filename, None)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        return result
+
+    def _write(self, key, result):
+        # store result on disk, and remove the files used least recently until
+        # the store fits in max_bytes; a store that cannot be written to is
+        # skipped
+        if self.path is None:
+            return
+        vol, grid = result
+        fields = dict(volume=numpy.float64(vol))
+        if grid is not None:
+            fields.update(bits=grid.bits.astype('<u8', copy=False),
+                          shape=numpy.array(grid.shape), origin=grid.origin,
+                          spacing=numpy.array(grid.spacing))
+        try:
+            fd, tmppath = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez_compressed(f, **fields)
+            os.rename(tmppath, self._filename(key))
+        except (IOError, OSError):
+            return
+        files = sorted(self._files(), key=lambda item: item[2])
+        total = sum(nbytes for name, nbytes, mtime in files)
+        for name, nbytes, mtime in files:
+            if total <= self.max_bytes:
+                break
+            if self._remove(name):
+                self.evictions += 1
+            total -= nbytes
+
+    def _files(self):
+        # (name, bytes, modification time) of every result in the store
+        if self.path is None:
+            return []
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                files.append((name, stat.st_size, stat.st_mtime))
+        return files
+
+    def _remove(self, name):
+        # remove a file of the store; False if another process removed it first
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            return False
+        return True